@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial decomposition of multi-region DSM models with exchange ADMM.
+
+Every region is an energy system of its own (generation, demand, SinkDsm
+components at its electrical bus). The regions are coupled by lines with a
+transfer capacity. For each line end a Source (import) and a Sink (export) are
+added at the region's bus, and the region's model gets the net export
+
+    p[r, l, t] = export - import
+
+The regions must agree on the exchange, p[a, l, t] + p[b, l, t] = 0 for the
+two ends a and b of line l. Exchange ADMM solves all regions in parallel
+worker processes (see dsm_parallel) with the augmented objective
+
+    cost_r + sum_l,t price[l, t] * p[r, l, t] + rho / 2 * (p[r, l, t] - z[r, l, t]) ** 2
+
+with the consensus target z[a] = -z[b] = (p[a] - p[b]) / 2 and the price
+update price += rho * (p[a] + p[b]) / 2, until primal and dual residual are
+below their tolerances.
+
+The quadratic term is replaced by tangents (an epigraph variable per line
+and timestep), so the sub-problems stay LPs and CBC can be used: `cuts`
+tangents on each side of the target, spaced geometrically from 2 * capacity
+down to 2 * capacity / 2 ** (cuts - 1) so the penalty does not vanish near
+consensus, and one tangent per line and timestep which is moved to the
+deviation p - z of the last iterate before every solve. With a QP solver
+(e.g. gurobi, cplex) `quadratic=True` uses the quadratic term itself. The
+build function has to be picklable (defined at module level), e.g.::
+
+    def build_region(region, timeindex):
+        es = solph.EnergySystem(timeindex=timeindex)
+        Node.registry = es
+        ...
+        return es
+
+    lines = [Line('north-south', 'north', 'south', 2000)]
+    result = admm(build_region, ['north', 'south'], lines, timeindex, rho=5)
+    result.telemetry.plot(y=['primal_residual', 'dual_residual'], logy=True)
+"""
+
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from oemof import solph, outputlib
+from oemof.network import Node
+from pyomo.environ import Set, Param, Var, Expression, Constraint, Objective, NonNegativeReals, minimize, value
+
+import dsm_parallel
+
+
+Line = namedtuple('Line', ['label', 'region_from', 'region_to', 'capacity'])
+
+AdmmResult = namedtuple('AdmmResult', ['exchange', 'prices', 'telemetry', 'results', 'converged'])
+
+
+########################################################################
+# ----------------------- Regional sub-problem -------------------------
+
+class RegionProblem:
+    """Model of one region with exchange ports and the ADMM terms, kept in a worker process.
+
+    Parameters
+    ----------
+    build_region: callable
+        build_region(region, timeindex) returns the region's EnergySystem
+    region: str
+        name of the region
+    lines: list of Line
+        lines connected to the region
+    timeindex: pandas.DatetimeIndex
+        timesteps to optimise
+    rho: float
+        ADMM penalty parameter
+    cuts: int
+        fixed tangents of the quadratic penalty on each side of the target
+    bus_label: str
+        label of the electrical bus the lines are connected to
+    solver: str
+        solver name
+    solve_kwargs: dict
+        passed to the solver
+    quadratic: bool
+        use the quadratic penalty instead of tangents (QP solver needed)
+    """
+
+    def __init__(self, build_region, region, lines, timeindex, rho, cuts=8, bus_label='bus_elec',
+                 solver='cbc', solve_kwargs=None, quadratic=False):
+        self.region = region
+        self.lines = [line.label for line in lines]
+        self.solver = solver
+        self.solve_kwargs = solve_kwargs or {'tee': False}
+        self.quadratic = quadratic
+        self._exchange = None
+
+        es = build_region(region, timeindex)
+        buses = [n for n in es.nodes if n.label == bus_label]
+        if len(buses) != 1:
+            raise ValueError('Region "{}" has no bus "{}".'.format(region, bus_label))
+        bus = buses[0]
+
+        Node.registry = es
+        ports = {}
+        for line in lines:
+            ports[line.label] = (
+                solph.Source(label='import_{}'.format(line.label),
+                             outputs={bus: solph.Flow(nominal_value=line.capacity)}),
+                solph.Sink(label='export_{}'.format(line.label),
+                           inputs={bus: solph.Flow(nominal_value=line.capacity)}))
+        capacity = {line.label: line.capacity for line in lines}
+
+        self.model = m = solph.Model(es)
+
+        m.ADMM_LINES = Set(initialize=self.lines, ordered=True)
+        m.admm_price = Param(m.ADMM_LINES, m.TIMESTEPS, mutable=True, initialize=0)
+        m.admm_target = Param(m.ADMM_LINES, m.TIMESTEPS, mutable=True, initialize=0)
+
+        def _exchange_rule(block, l, t):
+            source, sink = ports[l]
+            return m.flow[bus, sink, t] - m.flow[source, bus, t]
+        m.admm_exchange = Expression(m.ADMM_LINES, m.TIMESTEPS, rule=_exchange_rule)
+
+        if quadratic:
+            m.admm_penalty = Expression(m.ADMM_LINES, m.TIMESTEPS, rule=lambda block, l, t: rho / 2 * (
+                m.admm_exchange[l, t] - m.admm_target[l, t]) ** 2)
+        else:
+            # x = p - z lies in [-2 * cap, 2 * cap], tangents at -+2 * cap / 2 ** j for k = 2j, 2j + 1
+            m.ADMM_CUTS = Set(initialize=range(2 * cuts), ordered=True)
+            m.admm_point = Param(m.ADMM_LINES, m.TIMESTEPS, mutable=True, initialize=0)
+            m.admm_penalty = Var(m.ADMM_LINES, m.TIMESTEPS, within=NonNegativeReals)
+
+            def _tangent(l, t, delta):
+                # tangent of rho / 2 * x ** 2 at x = delta
+                return (m.admm_penalty[l, t]
+                        >= rho * delta * (m.admm_exchange[l, t] - m.admm_target[l, t]) - rho / 2 * delta ** 2)
+
+            def _cut_rule(block, l, t, k):
+                return _tangent(l, t, (1 if k % 2 else -1) * 2 * capacity[l] / 2 ** (k // 2))
+
+            m.admm_cuts = Constraint(m.ADMM_LINES, m.TIMESTEPS, m.ADMM_CUTS, rule=_cut_rule)
+            m.admm_moving_cut = Constraint(m.ADMM_LINES, m.TIMESTEPS,
+                                           rule=lambda block, l, t: _tangent(l, t, m.admm_point[l, t]))
+
+        self.cost = m.objective.expr
+        m.del_component(m.objective)
+        m.objective = Objective(sense=minimize, expr=self.cost + sum(
+            m.admm_price[l, t] * m.admm_exchange[l, t] + m.admm_penalty[l, t]
+            for l in m.ADMM_LINES for t in m.TIMESTEPS))
+
+    def solve(self, prices, targets):
+        """Solve with new prices and targets (line -> array), return the net export per line"""
+        m = self.model
+        m.admm_price.store_values({(l, t): prices[l][t] for l in self.lines for t in m.TIMESTEPS})
+        m.admm_target.store_values({(l, t): targets[l][t] for l in self.lines for t in m.TIMESTEPS})
+
+        if not self.quadratic and self._exchange is not None:
+            # move the tangent to the deviation of the last exchange from the new target
+            m.admm_point.store_values({(l, t): self._exchange[l][t] - targets[l][t]
+                                       for l in self.lines for t in m.TIMESTEPS})
+
+        start = time.perf_counter()
+        m.solve(solver=self.solver, solve_kwargs=self.solve_kwargs)
+        solve_time = time.perf_counter() - start
+
+        exchange = {l: np.array([value(m.admm_exchange[l, t]) for t in m.TIMESTEPS]) for l in self.lines}
+        self._exchange = exchange
+
+        return {'exchange': exchange, 'cost': value(self.cost), 'solve_time': solve_time}
+
+    def results(self):
+        """Results of the last solve with string keys"""
+        return outputlib.views.convert_keys_to_strings(outputlib.processing.results(self.model))
+
+
+########################################################################
+# ----------------------- Coordination ---------------------------------
+
+def _rms(values):
+    return float(np.sqrt(np.mean(np.square(values)))) if values.size else 0.0
+
+
+def admm(build_region, regions, lines, timeindex, rho=1.0, tol_primal=1e-2, tol_dual=1e-2, max_iter=100,
+         cuts=8, bus_label='bus_elec', solver='cbc', solve_kwargs=None, processes=None, callback=None,
+         quadratic=False):
+    """Solve the coupled regions with exchange ADMM.
+
+    Parameters
+    ----------
+    build_region: callable
+        build_region(region, timeindex) returns the region's EnergySystem
+        (without lines). Must be picklable.
+    regions: list of str
+        names of the regions
+    lines: list of Line
+        (label, region_from, region_to, capacity) of the exchange lines
+    timeindex: pandas.DatetimeIndex
+        timesteps to optimise
+    rho: float
+        penalty parameter (cost per unit of squared exchange mismatch)
+    tol_primal, tol_dual: float
+        tolerances of the primal residual (RMS of the exchange mismatch
+        p[a] + p[b]) and the dual residual (RMS of rho * change of the
+        target)
+    max_iter: int
+        maximum number of iterations
+    cuts: int
+        fixed tangents of the quadratic penalty on each side of the target
+        (geometrically spaced, plus one moving tangent)
+    bus_label: str
+        label of the electrical bus in every region
+    solver: str
+        solver name
+    solve_kwargs: dict
+        passed to the solver
+    processes: int
+        number of worker processes, defaults to the number of cores
+    callback: callable
+        called with the telemetry row (dict) after every iteration
+    quadratic: bool
+        exact quadratic penalty instead of tangents, needs a QP solver
+
+    Returns
+    -------
+    AdmmResult
+        exchange (timesteps x lines, positive from region_from to
+        region_to), prices (timesteps x lines), telemetry (per iteration:
+        residuals, total cost, slowest sub-problem, wall time), results
+        (region -> results of the last solve, string keys) and converged
+    """
+    lines = list(lines)
+    n_steps = len(timeindex)
+    problems = {}
+    for region in regions:
+        region_lines = [line for line in lines if region in (line.region_from, line.region_to)]
+        problems[region] = (build_region, region, region_lines, timeindex, rho, cuts, bus_label,
+                            solver, solve_kwargs, quadratic)
+
+    prices = {line.label: np.zeros(n_steps) for line in lines}
+    targets = {line.label: np.zeros(n_steps) for line in lines}
+    telemetry = []
+    converged = False
+    start = time.perf_counter()
+
+    with dsm_parallel.WorkerPool(RegionProblem, problems, processes) as pool:
+        for iteration in range(1, max_iter + 1):
+            payloads = {}
+            for region in regions:
+                region_lines = problems[region][2]
+                payloads[region] = {
+                    'prices': {line.label: prices[line.label] for line in region_lines},
+                    'targets': {line.label: targets[line.label] if line.region_from == region
+                                else -targets[line.label] for line in region_lines}}
+            replies = pool.call('solve', payloads)
+
+            mismatch = []
+            change = []
+            for line in lines:
+                p_from = replies[line.region_from]['exchange'][line.label]
+                p_to = replies[line.region_to]['exchange'][line.label]
+                target = (p_from - p_to) / 2
+                prices[line.label] = prices[line.label] + rho * (p_from + p_to) / 2
+                mismatch.append(p_from + p_to)
+                change.append(rho * (target - targets[line.label]))
+                targets[line.label] = target
+
+            row = {'iteration': iteration,
+                   'primal_residual': _rms(np.concatenate(mismatch)) if lines else 0.0,
+                   'dual_residual': _rms(np.concatenate(change)) if lines else 0.0,
+                   'cost': sum(reply['cost'] for reply in replies.values()),
+                   'max_solve_time': max(reply['solve_time'] for reply in replies.values()),
+                   'wall_time': time.perf_counter() - start}
+            telemetry.append(row)
+            if callback is not None:
+                callback(row)
+
+            if row['primal_residual'] <= tol_primal and row['dual_residual'] <= tol_dual:
+                converged = True
+                break
+
+        results = pool.call('results')
+
+    labels = [line.label for line in lines]
+    exchange = pd.DataFrame({l: targets[l] for l in labels}, index=timeindex, columns=labels)
+    prices = pd.DataFrame({l: prices[l] for l in labels}, index=timeindex, columns=labels)
+
+    return AdmmResult(exchange, prices, pd.DataFrame(telemetry).set_index('iteration'), results, converged)
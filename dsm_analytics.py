@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Shift analytics over solved delay schedules.
+
+Works on the sparse shift matrices of dsm_results (one per component) and
+is vectorised over all shifts, so year-long results of many components
+take milliseconds:
+
+    backlog       energy shifted up but not yet compensated (> 0) resp.
+                  compensated in advance (< 0) at the end of each
+                  timestep, i.e. the accumulated DSM (dsm_acum) of the
+                  notebooks
+    distances     shifted energy per shift distance tt - t
+    utilisation   shift up / down relative to Cap_up / Cap_do
+    latency       energy weighted statistics of the compensation time |tt - t|
+
+    shifts = dsm_results.shift_matrices(model)
+    report = analyse(shifts, capacities_from_model(model))
+"""
+
+import numpy as np
+import pandas as pd
+
+import oemof_DSM as oemof_dsm
+
+
+def backlog(shifts):
+    """Not yet compensated energy at the end of each timestep.
+
+    A shift of energy v up in t and down in tt adds v to the backlog from t
+    to tt - 1 (tt > t) or -v from tt to t - 1 (tt < t), i.e. the backlog is
+    the cumulated difference of shifts up and down.
+    """
+    return np.cumsum(shifts.row_sums() - shifts.col_sums())
+
+
+def distance_distribution(shifts):
+    """Shifted energy, share and number of shifts per distance (in timesteps)"""
+    energy = shifts.distance_histogram()
+    count = np.bincount(shifts.distance + shifts.delay_time, minlength=2 * shifts.delay_time + 1)
+    total = energy.sum()
+    return pd.DataFrame({'energy': energy,
+                         'share': energy / total if total > 0 else 0.0,
+                         'shifts': count}, index=energy.index)
+
+
+def utilisation(shifts, c_up, c_do):
+    """Shift up / down per timestep relative to the capacities (NaN where the capacity is zero)"""
+    up = shifts.row_sums()
+    down = shifts.col_sums()
+    c_up = oemof_dsm.sequence_array(c_up, shifts.n_steps)
+    c_do = oemof_dsm.sequence_array(c_do, shifts.n_steps)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (np.where(c_up > 0, up / c_up, np.nan),
+                np.where(c_do > 0, down / c_do, np.nan))
+
+
+def _weighted_quantiles(values, weights, quantiles):
+    """Quantiles of `values` weighted by `weights`"""
+    if weights.sum() <= 0:
+        return np.full(len(quantiles), np.nan)
+    order = np.argsort(values, kind='stable')
+    cumulated = np.cumsum(weights[order])
+    positions = np.searchsorted(cumulated, np.asarray(quantiles) * cumulated[-1], side='left')
+    return values[order][np.minimum(positions, len(values) - 1)]
+
+
+def latency(shifts, timestep=1.0):
+    """Energy weighted compensation time |tt - t| (in hours if `timestep` is the length of a timestep in hours)"""
+    distance = np.abs(shifts.distance).astype(np.float64) * timestep
+    weights = shifts.value
+    energy = weights.sum()
+    median, p90 = _weighted_quantiles(distance, weights, [0.5, 0.9])
+    return pd.Series({'energy': energy,
+                      'mean': (distance * weights).sum() / energy if energy > 0 else np.nan,
+                      'median': median,
+                      'p90': p90,
+                      'max': distance.max() if len(distance) else np.nan,
+                      'advance_share': weights[shifts.distance < 0].sum() / energy if energy > 0 else np.nan},
+                     name=shifts.label)
+
+
+def capacities_from_model(model):
+    """(c_up, c_do) arrays of all delay components of `model` (label -> tuple)"""
+    block = model.component(oemof_dsm.SinkDsmDelayBlock.__name__)
+    if block is None:
+        return {}
+    return {g.label: (g.c_up_array, g.c_do_array) for g in block.DSM}
+
+
+def analyse(shifts, capacities=None, timestep=None):
+    """All analytics for several components.
+
+    Parameters
+    ----------
+    shifts: dict
+        label -> ShiftMatrix, e.g. dsm_results.shift_matrices(model)
+    capacities: dict
+        label -> (c_up, c_do), e.g. capacities_from_model(model). Without
+        capacities there is no utilisation.
+    timestep: float
+        length of a timestep in hours for the latency, taken from the
+        timeindex of the shift matrices by default
+
+    Returns
+    -------
+    dict of pandas.DataFrame
+        backlog (timesteps x components), distances (distance x
+        (component, energy/share/shifts)), utilisation (timesteps x
+        (component, up/do)), utilisation_summary and latency (components x
+        statistics)
+    """
+    result = {}
+    index = None
+    backlogs = {}
+    distances = {}
+    latencies = []
+    utilisations = {}
+    summary = []
+
+    for label, matrix in shifts.items():
+        if index is None and matrix.timeindex is not None:
+            index = matrix.timeindex
+        step = timestep
+        if step is None:
+            step = 1.0
+            if matrix.timeindex is not None and len(matrix.timeindex) > 1:
+                step = oemof_dsm.timestep_length(matrix.timeindex) / pd.Timedelta(1, 'h')
+
+        backlogs[label] = backlog(matrix)
+        distances[label] = distance_distribution(matrix)
+        latencies.append(latency(matrix, step))
+
+        if capacities is not None and label in capacities:
+            up, do = utilisation(matrix, *capacities[label])
+            utilisations[(label, 'up')] = up
+            utilisations[(label, 'do')] = do
+            summary.append(pd.Series({'mean_up': np.nanmean(up) if np.isfinite(up).any() else np.nan,
+                                      'mean_do': np.nanmean(do) if np.isfinite(do).any() else np.nan,
+                                      'full_up': int(np.sum(up >= 1 - 1e-6)),
+                                      'full_do': int(np.sum(do >= 1 - 1e-6)),
+                                      'max_backlog': backlogs[label].max(initial=0),
+                                      'min_backlog': backlogs[label].min(initial=0)}, name=label))
+
+    result['backlog'] = pd.DataFrame(backlogs, index=index)
+    result['distances'] = pd.concat(distances, axis=1) if distances else pd.DataFrame()
+    result['latency'] = pd.DataFrame(latencies)
+    if utilisations:
+        result['utilisation'] = pd.DataFrame(utilisations, index=index)
+        result['utilisation_summary'] = pd.DataFrame(summary)
+
+    return result
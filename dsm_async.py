@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent CBC solves of many DSM models with asyncio.
+
+Every model is written to an LP file and solved by its own CBC subprocess.
+The subprocesses share a core budget: a job with `threads` threads only
+starts when that many cores are free, so the machine is never
+oversubscribed. Jobs exceeding their timeout are killed, cancelling the
+orchestration kills all running CBC processes. Results are streamed as the
+solves complete, the solution of each job is loaded back into its Pyomo
+model (variable values and model.solver_status) if its status is accepted,
+by default only optimal solutions.
+
+    models = {name: oemof_dsm_test.build_model(data, datetimeindex, delay_time=name)
+              for name in ('1H', '2H', '4H')}
+    report = solve_many(models, cores=4, timeout=600)
+
+or inside a running event loop::
+
+    async for result in solve_concurrently(models, cores=4):
+        print(result.name, result.status, result.objective)
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from collections import namedtuple
+
+import pandas as pd
+
+
+JobResult = namedtuple('JobResult', ['name', 'status', 'objective', 'wait_time', 'solve_time', 'model'])
+
+
+########################################################################
+# ----------------------- Core budget ----------------------------------
+
+class CoreBudget:
+    """Cores shared by all running solver processes"""
+
+    def __init__(self, cores):
+        self.cores = cores
+        self.free = cores
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, n):
+        if n > self.cores:
+            raise ValueError('A job with {} threads exceeds the budget of {} cores.'.format(n, self.cores))
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.free >= n)
+            self.free -= n
+
+    async def release(self, n):
+        async with self._condition:
+            self.free += n
+            self._condition.notify_all()
+
+
+########################################################################
+# ----------------------- LP files and solutions -----------------------
+
+def write_lp(model, filename):
+    """Write `model` as LP file, return the symbol map (LP name -> variable)"""
+    _, smap_id = model.write(filename, format='lp', io_options={'symbolic_solver_labels': False})
+    return model.solutions.symbol_map[smap_id]
+
+
+ACCEPT = ('Optimal',)
+
+
+def load_solution(model, symbol_map, filename, accept=ACCEPT):
+    """Read a CBC solution file (printingOptions all) into the variables of `model`.
+
+    The variable values are only loaded if the status is in `accept`, e.g.
+    `('Optimal', 'Stopped on time')` to also keep the incumbent of a solve
+    stopped by its time limit. model.solver_status is always set.
+
+    Returns
+    -------
+    status: str
+        CBC status (the status line up to ' - '), e.g. 'Optimal', 'Infeasible'
+    objective: float
+        objective value reported by CBC (None if not given)
+    """
+    with open(filename) as f:
+        header = f.readline()
+        lines = f.readlines()
+
+    status = header.split(' - ')[0].strip()
+    objective = None
+    if 'objective value' in header:
+        objective = float(header.rsplit('objective value', 1)[1].split()[0])
+
+    model.solver_status = status
+    if status not in accept:
+        return status, objective
+
+    for line in lines:
+        # infeasible rows and columns are flagged with '**'
+        tokens = line.replace('**', ' ').split()
+        if len(tokens) < 3:
+            continue
+        var = symbol_map.bySymbol.get(tokens[1])
+        if isinstance(var, weakref.ref):
+            var = var()
+        if var is None or not hasattr(var, 'fixed') or var.fixed:
+            continue
+        var.value = float(tokens[2])
+
+    return status, objective
+
+
+########################################################################
+# ----------------------- Jobs -----------------------------------------
+
+async def _solve_job(name, model, budget, threads, timeout, executor, workdir, cbc, options, accept):
+    """Write, solve and load one model, return its JobResult"""
+    loop = asyncio.get_running_loop()
+    lp_file = os.path.join(workdir, '{}.lp'.format(name))
+    sol_file = os.path.join(workdir, '{}.sol'.format(name))
+
+    # writing the LP file is pure Python, keep the event loop responsive
+    symbol_map = await loop.run_in_executor(executor, write_lp, model, lp_file)
+
+    start = time.perf_counter()
+    await budget.acquire(threads)
+    wait_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            cbc, lp_file, '-threads', str(threads), *options, '-solve', '-printingOptions', 'all', '-solu', sol_file,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            process.kill()
+            await process.wait()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return JobResult(name, 'timeout', None, wait_time, time.perf_counter() - start, model)
+    finally:
+        await budget.release(threads)
+    solve_time = time.perf_counter() - start
+
+    if process.returncode != 0 or not os.path.exists(sol_file):
+        return JobResult(name, 'error (cbc exit code {})'.format(process.returncode), None, wait_time, solve_time,
+                         model)
+
+    status, objective = await loop.run_in_executor(executor, load_solution, model, symbol_map, sol_file, accept)
+    return JobResult(name, status, objective, wait_time, solve_time, model)
+
+
+async def solve_concurrently(models, cores=None, threads=1, timeout=None, cbc='cbc', options=(), workdir=None,
+                             accept=ACCEPT):
+    """Solve `models` with concurrent CBC processes and yield a JobResult per completed job.
+
+    Parameters
+    ----------
+    models: dict
+        name -> built model
+    cores: int
+        core budget of all running CBC processes, defaults to the number of
+        cores of the machine
+    threads: int
+        threads (= cores) per CBC process
+    timeout: float
+        seconds per solve (without waiting for free cores), the process is
+        killed afterwards and the job reported with status 'timeout'
+    cbc: str
+        CBC executable
+    options: sequence of str
+        further CBC options, e.g. ('-ratio', '0.01')
+    workdir: str
+        directory of the LP and solution files, defaults to a temporary
+        directory which is removed afterwards
+    accept: sequence of str
+        CBC statuses whose solution is loaded into the model, see
+        load_solution
+    """
+    budget = CoreBudget(cores or os.cpu_count() or 1)
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='dsm_async_')
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    tasks = [asyncio.ensure_future(_solve_job(name, model, budget, threads, timeout, executor, workdir, cbc,
+                                              list(options), tuple(accept)))
+             for name, model in models.items()]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown(wait=True)
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def solve_many(models, callback=None, **kwargs):
+    """Blocking wrapper of :func:`solve_concurrently`.
+
+    Parameters
+    ----------
+    models: dict
+        name -> built model
+    callback: callable
+        called with each JobResult as soon as its solve completed
+    kwargs:
+        passed to :func:`solve_concurrently`
+
+    Returns
+    -------
+    pandas.DataFrame
+        status, objective, waiting and solve time per job in order of
+        completion, the solutions are loaded into the models
+    """
+    async def run():
+        rows = []
+        async for result in solve_concurrently(models, **kwargs):
+            if callback is not None:
+                callback(result)
+            rows.append(result._asdict())
+        return rows
+
+    loop = asyncio.new_event_loop()
+    try:
+        rows = loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    return pd.DataFrame(rows, columns=JobResult._fields).drop(columns='model').set_index('name')
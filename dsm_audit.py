@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Feasibility audit of a solved DSM model.
+
+The solution is read into arrays once (one pass over each variable) and
+all rows are checked vectorised:
+
+    balance         energy balance of every bus (inflows = outflows)
+    demand          flow into the DSM component = demand + shift up - shift down (Eq. 1)
+    compensation    DSMup[t] = sum of DSMdo[t, tt] (Eq. 7), shifts only within the delay time
+    cap_up          DSMup[t] <= Cap_up[t] (Eq. 8)
+    cap_do          sum of DSMdo[t, tt] over t <= Cap_do[tt] (Eq. 9)
+    C2              DSMup[tt] + sum of DSMdo[t, tt] <= max(Cap_up, Cap_do) (Eq. 10), also if built lazily
+    negative        DSMup >= 0
+    interval        sum of DSMupdown over each shift interval = 0 (potential method)
+    bounds          -Cap_do[t] <= DSMupdown[t] <= Cap_up[t] (potential method)
+
+Every row violated by more than `tol` is reported with its timestamp:
+
+    violations = audit(model)
+    if not violations.empty:
+        print(violations.groupby(['check', 'component'])['violation'].max())
+"""
+
+import numpy as np
+import pandas as pd
+
+from oemof import solph
+
+import oemof_DSM as oemof_dsm
+import dsm_results
+
+
+COLUMNS = ['check', 'component', 'timestep', 'timestamp', 'value', 'limit', 'violation']
+
+
+def _report(check, component, value, limit, violation, tol, timestep=None):
+    """Rows of the violations > tol as DataFrame (without timestamps)"""
+    violation = np.asarray(violation, dtype=np.float64)
+    rows = np.flatnonzero(violation > tol)
+    if timestep is None:
+        timestep = np.arange(len(violation))
+    return pd.DataFrame({'check': check,
+                         'component': str(component),
+                         'timestep': np.asarray(timestep)[rows],
+                         'value': np.broadcast_to(value, violation.shape)[rows],
+                         'limit': np.broadcast_to(limit, violation.shape)[rows],
+                         'violation': violation[rows]})
+
+
+def _values(values, keys):
+    """Values of the keys in `values` (var.extract_values()), missing keys and unset values are 0"""
+    return np.array([values.get(key) or 0.0 for key in keys], dtype=np.float64)
+
+
+def flow_values(model):
+    """Flows of the solution: list of (source, target) and array (flows x timesteps)"""
+    n_steps = len(model.TIMESTEPS)
+    pairs = sorted(model.FLOWS, key=lambda p: (str(p[0]), str(p[1])))
+    position = {pair: i for i, pair in enumerate(pairs)}
+    flows = np.zeros((len(pairs), n_steps))
+    for (i, o, t), value in model.flow.extract_values().items():
+        flows[position[i, o], t] = value or 0.0
+    return pairs, flows
+
+
+########################################################################
+# ----------------------- Array checks ---------------------------------
+
+def check_balance(pairs, flows, tol=1e-6):
+    """Energy balance of all buses, inflows - outflows = 0"""
+    buses = sorted({n for pair in pairs for n in pair if isinstance(n, solph.Bus)}, key=str)
+    incidence = np.zeros((len(buses), len(pairs)))
+    for b, bus in enumerate(buses):
+        for f, (i, o) in enumerate(pairs):
+            if o is bus:
+                incidence[b, f] += 1
+            if i is bus:
+                incidence[b, f] -= 1
+    balance = incidence @ flows
+    return [_report('balance', bus, balance[b], 0.0, np.abs(balance[b]), tol) for b, bus in enumerate(buses)]
+
+
+def check_delay(label, flow, demand, up, shifts, c_up, c_do, tol=1e-6):
+    """Checks of a delay component (Eq. 1, 7 - 10) on arrays.
+
+    Parameters
+    ----------
+    flow, demand, up: array
+        inflow, demand and DSMup per timestep
+    shifts: dsm_results.ShiftMatrix
+        DSMdo of the component
+    c_up, c_do: array
+        capacities per timestep
+    """
+    out = shifts.row_sums()
+    down = shifts.col_sums()
+    c_max = np.maximum(c_up, c_do)
+    reports = [
+        _report('demand', label, flow, demand + up - down, np.abs(flow - demand - up + down), tol),
+        _report('compensation', label, up, out, np.abs(up - out), tol),
+        _report('cap_up', label, up, c_up, up - c_up, tol),
+        _report('cap_do', label, down, c_do, down - c_do, tol),
+        _report('C2', label, up + down, c_max, up + down - c_max, tol),
+        _report('negative', label, up, 0.0, -up, tol),
+    ]
+
+    # single shifts out of the delay window, reported at the timestep of the shift up
+    outside = np.abs(shifts.distance) > shifts.delay_time
+    reports.append(_report('compensation', label, shifts.value, 0.0, np.where(outside, np.abs(shifts.value), 0.0),
+                           tol, shifts.t))
+    return reports
+
+
+def check_potential(label, flow, demand, updown, c_up, c_do, shift_interval, tol=1e-6):
+    """Checks of a potential component (Eq. 1, bounds, interval balance) on arrays"""
+    n_steps = len(flow)
+    starts = np.arange(0, n_steps, shift_interval)
+    interval = np.add.reduceat(updown, starts) if n_steps else np.zeros(0)
+    return [
+        _report('demand', label, flow, demand + updown, np.abs(flow - demand - updown), tol),
+        _report('bounds', label, updown, c_up, updown - c_up, tol),
+        _report('bounds', label, updown, -c_do, -c_do - updown, tol),
+        _report('interval', label, interval, 0.0, np.abs(interval), tol, starts),
+    ]
+
+
+########################################################################
+# ----------------------- Model audit ----------------------------------
+
+def audit(model, tol=1e-6):
+    """Check the solution of `model` against the energy balances and the DSM equations.
+
+    The capacities are scaled by `model.capacity_scale` (set by
+    dsm_solve.capacity_sweep), so the last point of a sweep is checked
+    against the limits it was solved with.
+
+    Parameters
+    ----------
+    model: solph.Model
+        solved model
+    tol: float
+        absolute tolerance, smaller violations are not reported
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per violation: check, component, timestep, timestamp,
+        value, limit and violation (amount beyond the limit), empty if the
+        solution is feasible
+    """
+    n_steps = len(model.TIMESTEPS)
+    timesteps = list(model.TIMESTEPS)
+    pairs, flows = flow_values(model)
+    position = {pair: i for i, pair in enumerate(pairs)}
+
+    reports = check_balance(pairs, flows, tol)
+    scale = getattr(model, 'capacity_scale', 1.0)
+
+    block = model.component(oemof_dsm.SinkDsmDelayBlock.__name__)
+    if block is not None:
+        stored = model.es.results.get('dsm_shifts') or {}
+        values = block.DSMup.extract_values()
+        for g in block.DSM:
+            up = _values(values, [(g, t) for t in timesteps])
+            shifts = stored[g.label] if g.label in stored else dsm_results.ShiftMatrix.from_block(block, g)
+            reports += check_delay(g.label, flows[position[g.inflow, g]], g.demand_array, up, shifts,
+                                   scale * g.c_up_array, scale * g.c_do_array, tol)
+
+    block = model.component(oemof_dsm.SinkDsmPotentialBlock.__name__)
+    if block is not None:
+        values = block.DSMupdown.extract_values()
+        for g in block.DSM:
+            updown = _values(values, [(g, t) for t in timesteps])
+            reports += check_potential(g.label, flows[position[g.inflow, g]], g.demand_array, updown,
+                                       scale * g.c_up_array, scale * g.c_do_array, g.shift_interval, tol)
+
+    violations = pd.concat(reports, ignore_index=True) if reports else pd.DataFrame(columns=COLUMNS)
+    timeindex = model.es.timeindex[:n_steps]
+    violations['timestamp'] = timeindex[violations['timestep'].values] if len(violations) else pd.NaT
+    return violations[COLUMNS].sort_values(['timestep', 'check', 'component']).reset_index(drop=True)
+
+
+def summary(violations):
+    """Number and maximum of the violations per check and component"""
+    return violations.groupby(['check', 'component'])['violation'].agg(['count', 'max'])
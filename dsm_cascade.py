@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Coarse-to-fine solve cascade for models with DSM components.
+
+The model is solved on resampled data first (e.g. 4-hourly, then hourly).
+Timesteps without load shifting in a coarse solution - widened by the delay
+time - get a DSM capacity of zero on the next finer level. The DSM presolve
+(see oemof_DSM.presolve_report) then drops their variables and rows, so the
+full resolution is only optimised around active shift periods.
+
+Example (data as read in oemof_dsm_test.py, e.g. with 15-minute resolution)::
+
+    import oemof_dsm_test
+    model, report = cascade(oemof_dsm_test.build_model, data.iloc[:35040], compare=True)
+"""
+
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from pyomo.environ import value
+
+import oemof_DSM as oemof_dsm
+import dsm_solve
+
+
+########################################################################
+# ----------------------- Activity of a solution -----------------------
+
+def active_timesteps(model, tol=1e-6):
+    """Timesteps in which any DSM component of the solved `model` shifts load (bool array)."""
+    active = np.zeros(len(model.TIMESTEPS), dtype=bool)
+
+    block = model.component(oemof_dsm.SinkDsmDelayBlock.__name__)
+    if block is not None:
+        for g in block.DSM:
+            for t in model.TIMESTEPS:
+                active[t] |= value(block._dsm_up(g, t) + block._dsm_do(g, t)) > tol
+
+    block = model.component(oemof_dsm.SinkDsmPotentialBlock.__name__)
+    if block is not None:
+        for (g, t), var in block.DSMupdown.items():
+            active[t] |= abs(var.value) > tol
+
+    return active
+
+
+def _max_shift(model):
+    """Longest delay time / shift interval of all DSM components in timesteps"""
+    steps = [0]
+    for block_type, name in ((oemof_dsm.SinkDsmDelayBlock, 'delay_time'),
+                             (oemof_dsm.SinkDsmPotentialBlock, 'shift_interval')):
+        block = model.component(block_type.__name__)
+        if block is not None:
+            steps += [getattr(g, name) for g in block.DSM]
+    return max(steps)
+
+
+def widen(active, steps):
+    """Mark all timesteps within `steps` around an active timestep as active."""
+    if steps <= 0:
+        return active.copy()
+    return np.convolve(active.astype(int), np.ones(2 * steps + 1, dtype=int), mode='same') > 0
+
+
+########################################################################
+# ----------------------- Cascade --------------------------------------
+
+def cascade(build, data, levels=('4H', '1H'), solver='cbc', capacity_columns=('Cap_up', 'Cap_do'),
+            margin=None, tol=1e-6, compare=False, solve_kwargs=None):
+    """Solve `data` from coarse to fine resolution.
+
+    Parameters
+    ----------
+    build: callable
+        build(data, datetimeindex) returns the unsolved model,
+        e.g. oemof_dsm_test.build_model
+    data: pandas.DataFrame
+        input data with a DatetimeIndex in full resolution
+    levels: sequence of str
+        resampling rules of the coarse levels, coarsest first. The full
+        resolution is solved last.
+    solver: str
+        solver name
+    capacity_columns: sequence of str
+        columns of `data` set to zero outside active periods
+    margin: time span
+        periods around active timesteps kept on the next level. Defaults to
+        the longest delay time (shift interval) of the level's DSM components.
+    tol: float
+        load shifts below `tol` count as inactive
+    compare: bool
+        solve the full resolution directly as well and report the gap
+    solve_kwargs: dict
+        passed to the solver
+
+    Returns
+    -------
+    model: solph.Model
+        solved model in full resolution
+    report: pandas.DataFrame
+        timesteps, free and active timesteps, build/solve time and objective
+        per level, the cascade total and (compare=True) the direct solve with
+        the objective gap
+    """
+    capacity_columns = list(capacity_columns)
+    mask = pd.Series(True, index=data.index)
+    rows = []
+
+    for rule in list(levels) + [None]:
+        if rule is None:
+            level_data = data.copy()
+            level_mask = mask.values
+        else:
+            level_data = data.resample(rule).mean()
+            level_mask = mask.resample(rule).max().astype(bool).values
+        level_data.loc[~level_mask, capacity_columns] = 0
+
+        t0 = time.perf_counter()
+        model = build(level_data, level_data.index)
+        build_time = time.perf_counter() - t0
+        solve_time = dsm_solve.solve(model, solver=solver, solve_kwargs=solve_kwargs)
+
+        active = active_timesteps(model, tol)
+        rows.append({'level': rule or 'full',
+                     'timesteps': len(level_data),
+                     'free_timesteps': int(level_mask.sum()),
+                     'active_timesteps': int(active.sum()),
+                     'build_time': build_time,
+                     'solve_time': solve_time,
+                     'objective': model.objective()})
+
+        if rule is not None:
+            step = oemof_dsm.timestep_length(level_data.index)
+            if margin is None:
+                steps = _max_shift(model)
+            else:
+                steps = int(math.ceil(pd.Timedelta(margin) / step))
+            active = pd.Series(widen(active, steps), index=level_data.index)
+            mask = active.reindex(data.index, method='ffill').fillna(False).astype(bool)
+
+    report = pd.DataFrame(rows).set_index('level')
+    report.loc['cascade'] = pd.Series({'timesteps': len(data),
+                                       'build_time': report['build_time'].sum(),
+                                       'solve_time': report['solve_time'].sum(),
+                                       'objective': model.objective()})
+
+    if compare:
+        t0 = time.perf_counter()
+        direct = build(data, data.index)
+        build_time = time.perf_counter() - t0
+        solve_time = dsm_solve.solve(direct, solver=solver, solve_kwargs=solve_kwargs)
+        report.loc['direct'] = pd.Series({'timesteps': len(data),
+                                          'active_timesteps': int(active_timesteps(direct, tol).sum()),
+                                          'build_time': build_time,
+                                          'solve_time': solve_time,
+                                          'objective': direct.objective()})
+        report['gap'] = (report['objective'] - direct.objective()) / abs(direct.objective())
+
+    report['total_time'] = report['build_time'] + report['solve_time']
+
+    return model, report
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Catalogue of the scenarios of a results store, indexed by their parameters.
+
+The comparison notebooks walk the dump directories, read every CSV and
+grow the comparison tables row by row with DataFrame.append. The catalogue
+keeps one row per scenario of a dsm_store.ResultStore with its parameters
+(delay_time, shift_interval, aggregation, capacity_scale, ...), objective
+and timeindex in `<root>/catalogue.json`, which is only updated for
+scenarios saved since the last scan. Queries select scenarios on the
+parameters without reading any results, the sequences of the selection
+are read column-wise from Parquet into one scenario x time x variable
+array:
+
+    catalogue = Catalogue('results')
+    catalogue.import_legacy('dsm_data_dumps/aggregation')
+    selection = catalogue.query(delay_time=['2H', '4H'], aggregation='raw')
+    array = catalogue.load(['dsm_tot', 'dsm_acum'], selection, start='2013-03-01', end='2013-04-01')
+    array.values.shape    # (scenarios, timesteps, variables)
+    catalogue.compare(['demand_el', 'dsm_tot', 'excess'], selection)
+"""
+
+import fnmatch
+import json
+import os
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import dsm_store
+
+
+INDEX_FILE = 'catalogue.json'
+LEGACY_COMPONENT = 'dsm_data'
+
+# parameter name -> patterns of the file names of the legacy dumps, e.g. 'vgl_delay_12h-interval_24h'
+NAME_PATTERNS = {
+    'delay_time': r'delay(?:_time)?[_-]?(\d+(?:\.\d+)?[a-zA-Z]*)',
+    'shift_interval': r'(?:shift_)?interval[_-]?(\d+(?:\.\d+)?[a-zA-Z]*)',
+    'aggregation': r'(?:aggregation|agg)[_-]?([a-zA-Z0-9]+)',
+    'capacity_scale': r'(?:capacity_scale|cap_scale|scale)[_-]?(\d+(?:\.\d+)?)',
+}
+
+
+# parameters compared as time spans, '2H', '2h' and '120min' are equal
+DURATIONS = ('delay_time', 'shift_interval', 'recovery_time')
+
+
+def _duration(value):
+    """Time span of a duration given as string with unit (e.g. '2H'), other values unchanged"""
+    if not isinstance(value, str) or not re.search('[a-zA-Z]', value):
+        return value
+    for text in (value, value.lower()):
+        try:
+            with warnings.catch_warnings():
+                # upper case units like 'H' are deprecated in pandas
+                warnings.simplefilter('ignore')
+                return pd.Timedelta(text)
+        except ValueError:
+            continue
+    return value
+
+
+def params_from_name(name):
+    """Parameters encoded in the file name of a legacy dump (see NAME_PATTERNS)"""
+    params = {}
+    for param, pattern in NAME_PATTERNS.items():
+        match = re.search(pattern, name, flags=re.IGNORECASE)
+        if match:
+            value = match.group(1)
+            try:
+                value = float(value) if param == 'capacity_scale' else value
+            except ValueError:
+                pass
+            params[param] = value
+    return params
+
+
+class ScenarioArray:
+    """Sequences of several scenarios as one array.
+
+    Parameters
+    ----------
+    values: numpy.ndarray
+        (scenarios, timesteps, variables), NaN where a scenario has no value
+    scenarios: list of str
+    timeindex: pandas.DatetimeIndex
+    variables: list of str
+    """
+
+    def __init__(self, values, scenarios, timeindex, variables):
+        self.values = values
+        self.scenarios = list(scenarios)
+        self.timeindex = timeindex
+        self.variables = list(variables)
+
+    def __repr__(self):
+        return '<ScenarioArray {} scenarios x {} timesteps x {} variables>'.format(*self.values.shape)
+
+    def sel(self, variable):
+        """One variable as DataFrame (timesteps x scenarios)"""
+        return pd.DataFrame(self.values[:, :, self.variables.index(variable)].T,
+                            index=self.timeindex, columns=self.scenarios)
+
+    def to_frame(self):
+        """All values as DataFrame, columns (scenario, variable)"""
+        n_scenarios, n_steps, n_variables = self.values.shape
+        columns = pd.MultiIndex.from_product([self.scenarios, self.variables], names=['scenario', 'variable'])
+        return pd.DataFrame(self.values.transpose(1, 0, 2).reshape(n_steps, n_scenarios * n_variables),
+                            index=self.timeindex, columns=columns)
+
+
+class Catalogue:
+    """Parameter index of the scenarios of a ResultStore
+
+    Parameters
+    ----------
+    store: dsm_store.ResultStore or str
+        the store or its root directory
+    """
+
+    def __init__(self, store):
+        self.store = store if isinstance(store, dsm_store.ResultStore) else dsm_store.ResultStore(store)
+        self._records = {}
+        self._read_index()
+        self.refresh()
+
+    @property
+    def index_file(self):
+        return os.path.join(self.store.root, INDEX_FILE)
+
+    # ----------------------- Index ------------------------------------
+
+    def _read_index(self):
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                self._records = {r['scenario']: r for r in json.load(f)}
+
+    def _write_index(self):
+        os.makedirs(self.store.root, exist_ok=True)
+        with open(self.index_file, 'w') as f:
+            json.dump(list(self._records.values()), f)
+
+    def _record(self, directory, mtime):
+        with open(os.path.join(self.store.root, directory, 'metadata.json')) as f:
+            metadata = json.load(f)
+        return {'scenario': metadata['scenario'],
+                'directory': directory,
+                'mtime': mtime,
+                'params': metadata['params'],
+                'objective': metadata['objective'],
+                'start': metadata['timeindex']['start'],
+                'periods': metadata['timeindex']['periods'],
+                'freq': metadata['timeindex']['freq'],
+                'columns': {column: component for component, info in metadata['components'].items()
+                            for column in info['columns']}}
+
+    def refresh(self):
+        """Index scenarios which were saved or changed since the last scan, drop removed ones"""
+        changed = False
+        seen = set()
+        root = self.store.root
+        directories = os.listdir(root) if os.path.isdir(root) else []
+        known = {r['directory']: r for r in self._records.values()}
+        for directory in directories:
+            filename = os.path.join(root, directory, 'metadata.json')
+            if not os.path.exists(filename):
+                continue
+            mtime = os.path.getmtime(filename)
+            record = known.get(directory)
+            if record is None or record['mtime'] != mtime:
+                record = self._record(directory, mtime)
+                self._records[record['scenario']] = record
+                changed = True
+            seen.add(record['scenario'])
+
+        for scenario in set(self._records) - seen:
+            del self._records[scenario]
+            changed = True
+        if changed:
+            self._write_index()
+        return self
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, scenario):
+        return scenario in self._records
+
+    @property
+    def table(self):
+        """Scenarios x (parameters, objective, start, periods, freq)"""
+        records = sorted(self._records.values(), key=lambda r: r['scenario'])
+        df = pd.DataFrame([dict(r['params'], objective=r['objective'], start=r['start'], periods=r['periods'],
+                                freq=r['freq']) for r in records],
+                          index=pd.Index([r['scenario'] for r in records], name='scenario'))
+        return df
+
+    def variables(self, scenario=None):
+        """Stored columns (variable -> component) of one scenario or of all scenarios"""
+        if scenario is not None:
+            return dict(self._records[scenario]['columns'])
+        columns = {}
+        for record in self._records.values():
+            columns.update(record['columns'])
+        return columns
+
+    # ----------------------- Queries ----------------------------------
+
+    def query(self, expr=None, **filters):
+        """Scenarios matching all filters.
+
+        Parameters
+        ----------
+        expr: str
+            pandas query on the table, e.g. 'periods > 1000 and objective < 2e6'
+        filters:
+            parameter=value, a list of values (any of them) or a callable
+            returning True for the selected values. Scenarios without the
+            parameter are not selected. Durations (DURATIONS) given as
+            strings are compared as time spans.
+
+        Returns
+        -------
+        list of str
+        """
+        table = self.table
+        mask = pd.Series(True, index=table.index)
+        for param, value in filters.items():
+            if param not in table.columns:
+                return []
+            column = table[param]
+            if param.split(':')[-1] in DURATIONS and not callable(value):
+                column = column.map(_duration)
+                value = [_duration(v) for v in value] if isinstance(value, (list, tuple, set)) else _duration(value)
+            if callable(value):
+                mask &= column.map(lambda v: v == v and bool(value(v)))
+            elif isinstance(value, (list, tuple, set)):
+                mask &= column.isin(list(value))
+            else:
+                mask &= column == value
+        table = table[mask]
+        if expr is not None:
+            table = table.query(expr)
+        return list(table.index)
+
+    def select(self, pattern):
+        """Scenarios whose name matches the shell pattern, e.g. '*delay*'"""
+        return sorted(s for s in self._records if fnmatch.fnmatch(s, pattern))
+
+    # ----------------------- Loading ----------------------------------
+
+    def load(self, variables, scenarios=None, start=None, end=None):
+        """Sequences of `variables` of several scenarios in one ScenarioArray.
+
+        Only the needed columns and row groups are read. The timeindex is the
+        union of the timeindexes of the scenarios (usually all are equal).
+
+        Parameters
+        ----------
+        variables: list of str
+            stored column names, e.g. 'bus_elec->demand_dsm:flow' or the
+            columns of imported dumps ('dsm_tot', 'excess', ...)
+        scenarios: list of str
+            defaults to all scenarios
+        start, end:
+            time range [start, end)
+        """
+        variables = list(variables)
+        scenarios = sorted(self._records) if scenarios is None else list(scenarios)
+
+        frames = []
+        for scenario in scenarios:
+            columns = self._records[scenario]['columns']
+            components = {}
+            for variable in variables:
+                if variable in columns:
+                    components.setdefault(columns[variable], []).append(variable)
+            parts = [self.store.load(scenario, component, columns=names, start=start, end=end)
+                     for component, names in components.items()]
+            frames.append(pd.concat(parts, axis=1) if parts else None)
+
+        timeindex = None
+        for df in frames:
+            if df is not None:
+                timeindex = df.index if timeindex is None or timeindex.equals(df.index) else timeindex.union(df.index)
+        if timeindex is None:
+            timeindex = pd.DatetimeIndex([], name='timestamp')
+
+        values = np.full((len(scenarios), len(timeindex), len(variables)), np.nan)
+        for i, df in enumerate(frames):
+            if df is None:
+                continue
+            rows = slice(None) if df.index.equals(timeindex) else timeindex.get_indexer(df.index)
+            for j, variable in enumerate(variables):
+                if variable in df.columns:
+                    values[i, rows, j] = df[variable].values
+
+        return ScenarioArray(values, scenarios, timeindex, variables)
+
+    def totals(self, variables, scenarios=None, start=None, end=None, absolute=False):
+        """Sum over time of each variable, scenarios x variables"""
+        array = self.load(variables, scenarios, start, end)
+        values = np.abs(array.values) if absolute else array.values
+        return pd.DataFrame(np.nansum(values, axis=1), index=pd.Index(array.scenarios, name='scenario'),
+                            columns=array.variables)
+
+    def compare(self, variables, scenarios=None, start=None, end=None, absolute=False):
+        """Parameters and objective joined with the totals of `variables`"""
+        totals = self.totals(variables, scenarios, start, end, absolute)
+        return self.table.loc[totals.index].join(totals)
+
+    # ----------------------- Legacy dumps -----------------------------
+
+    def import_legacy(self, folder, pattern='*.csv', params=params_from_name, sep=';', decimal=',',
+                      tz=None, overwrite=False):
+        """Import the CSV dumps below `folder` (see Comparisson/*.ipynb) as scenarios.
+
+        The scenario is the file name without extension (prefixed with its
+        subdirectory), the columns are stored as component 'dsm_data'.
+
+        Parameters
+        ----------
+        params: callable
+            file name -> dict of parameters, see params_from_name
+        sep, decimal:
+            format of the dumps, plot_dsm writes ',' and '.'
+        tz: str
+            time zone the timestamps of the dumps are converted to, e.g.
+            'Europe/Berlin' for dumps written in UTC. The index is stored
+            without time zone like the model results (None keeps the
+            timestamps as they are)
+        overwrite: bool
+            import files whose scenario exists already
+
+        Returns
+        -------
+        list of str
+            imported scenarios
+        """
+        imported = []
+        for path, _, names in os.walk(folder):
+            for name in sorted(fnmatch.filter(names, pattern)):
+                relative = os.path.relpath(os.path.join(path, name), folder)
+                scenario = os.path.splitext(relative)[0].replace(os.sep, '/')
+                if scenario in self._records and not overwrite:
+                    continue
+
+                df = pd.read_csv(os.path.join(path, name), sep=sep, decimal=decimal, encoding='utf-8', index_col=0)
+                df.index = pd.to_datetime(df.index, utc=tz is not None)
+                if tz is not None:
+                    df.index = df.index.tz_convert(tz).tz_localize(None)
+                self.store.save_frame(scenario, LEGACY_COMPONENT, df,
+                                      params=dict(params(scenario) if params else {}, source=relative))
+                imported.append(scenario)
+
+        self.refresh()
+        return imported
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Duals (shadow prices) of the bus balance and the DSM constraints.
+
+Duals are only returned by the solver if the model has a dual suffix, so
+call receive_duals(model) before solving:
+
+    model = oemof_dsm_test.build_model(data, datetimeindex)
+    receive_duals(model)
+    model.solve(solver='cbc')
+    duals = dsm_duals(model)
+    values = dsm_values(model)
+
+All duals of a constraint are read from the suffix in one pass and arranged
+with pandas (index timesteps, columns component labels), rows removed by
+the DSM presolve are non-binding and get a dual of zero. The values are
+the duals as returned by the solver, i.e. weighted with the timeincrement
+of the objective. For a minimisation the duals of <= rows are <= 0.
+"""
+
+import numpy as np
+import pandas as pd
+
+from pyomo.environ import Suffix
+
+import oemof_DSM as oemof_dsm
+
+
+# constraints of the DSM blocks: name in the result -> (block, constraint)
+DSM_CONSTRAINTS = {
+    'dsmupdo': (oemof_dsm.SinkDsmDelayBlock, 'dsmupdo_constraint'),
+    'dsmup': (oemof_dsm.SinkDsmDelayBlock, 'dsmup_constraint'),
+    'dsmdo': (oemof_dsm.SinkDsmDelayBlock, 'dsmdo_constraint'),
+    'C2': (oemof_dsm.SinkDsmDelayBlock, 'C2_constraint'),
+    'dsm_sum': (oemof_dsm.SinkDsmPotentialBlock, 'dsm_sum_constraint'),
+}
+
+
+def receive_duals(model):
+    """Let the solver return the duals of `model` (call before solving)"""
+    if hasattr(model, 'receive_duals'):
+        model.receive_duals()
+    elif model.component('dual') is None:
+        model.dual = Suffix(direction=Suffix.IMPORT)
+
+
+def constraint_duals(model, constraint):
+    """Duals of a constraint indexed by (node, timestep) as DataFrame (timesteps x labels)
+
+    Parameters
+    ----------
+    model: solph.Model
+        solved model with dual suffix
+    constraint: pyomo Constraint
+        e.g. model.Bus.balance or block.dsmup_constraint
+
+    Returns
+    -------
+    pandas.DataFrame
+        duals with the timeindex of the energy system as index and the node
+        labels as columns
+    """
+    if model.component('dual') is None:
+        raise ValueError('The model has no dual suffix, call receive_duals(model) before solving.')
+
+    n_steps = len(model.TIMESTEPS)
+    keys = list(constraint.keys())
+    if not keys:
+        return pd.DataFrame(index=model.es.timeindex[:n_steps])
+
+    duals = np.fromiter(map(model.dual.get, constraint.values(), [np.nan] * len(keys)),
+                        dtype=np.float64, count=len(keys))
+
+    index = pd.MultiIndex.from_tuples(keys, names=['node', 'timestep'])
+    index = index.set_levels(index.levels[0].map(str), level=0)
+    df = pd.Series(duals, index=index).unstack('node')
+
+    # rows removed by the presolve are non-binding
+    df = df.reindex(range(n_steps)).fillna(0)
+    df.index = model.es.timeindex[:n_steps]
+    df.columns.name = None
+
+    return df
+
+
+def bus_prices(model):
+    """Duals of the bus balances (timesteps x bus labels)"""
+    return constraint_duals(model, model.Bus.balance)
+
+
+def dsm_duals(model):
+    """Duals of all constraints of the DSM blocks in `model`.
+
+    Returns
+    -------
+    dict
+        'balance' (bus balances) and the keys of DSM_CONSTRAINTS whose block
+        exists in the model -> DataFrame (timesteps x labels)
+    """
+    duals = {'balance': bus_prices(model)}
+    for name, (block_type, constraint) in DSM_CONSTRAINTS.items():
+        block = model.component(block_type.__name__)
+        if block is not None:
+            duals[name] = constraint_duals(model, getattr(block, constraint))
+    return duals
+
+
+def dsm_values(model):
+    """Capacity and shift values of all DSM components (timesteps x (value, label)).
+
+    capacity_up / capacity_do: value of one more unit of upward / downward
+    capacity (-dual of Eq. 8 / 9), capacity_max: value of one more unit of
+    the total capacity (-dual of C2, Eq. 10). shift: value of one unit of
+    load shifted into / out of the timestep, i.e. the price of the
+    component's bus.
+    """
+    duals = dsm_duals(model)
+    frames = {}
+
+    for name, column in (('dsmup', 'capacity_up'), ('dsmdo', 'capacity_do'), ('C2', 'capacity_max')):
+        if name in duals:
+            frames[column] = -duals[name]
+
+    shift = {}
+    for block_type in (oemof_dsm.SinkDsmDelayBlock, oemof_dsm.SinkDsmPotentialBlock):
+        block = model.component(block_type.__name__)
+        if block is not None:
+            for g in block.DSM:
+                shift[str(g)] = duals['balance'][str(g.inflow)]
+    frames['shift'] = pd.DataFrame(shift, index=duals['balance'].index)
+
+    return pd.concat(frames, axis=1)
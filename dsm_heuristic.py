@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Heuristic DSM dispatch in pure NumPy for screening and baselines.
+
+Works on the inputs of oemof_dsm_test.create_model (demand_el, wind, pv,
+Cap_up, Cap_do) and a merit order of dispatchable generators. Load is shifted
+from expensive timesteps (shortage, expensive plants) to cheap ones (surplus,
+cheap plants) within the delay time (method='delay') or within the shift
+interval (method='potential'). The capacity limits of the respective DSM
+block are respected (Eq. 7 - 10 resp. the bounds of DSMupdown), so every
+result is a feasible, but not necessarily optimal solution of the LP.
+
+Example::
+
+    result = dispatch(data.demand_el, data.wind, data.pv, data.Cap_up, data.Cap_do, delay_time=2)
+    print(result.cost)
+"""
+
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import oemof_DSM as oemof_dsm
+
+
+# generators of oemof_dsm_test.create_energysystem as (nominal_value, variable_costs)
+TEST_MERIT_ORDER = [(10000, 10), (10000, 20)]
+
+Dispatch = namedtuple('Dispatch', ['demand_dsm', 'dsm_up', 'dsm_do', 'band', 'cost'])
+
+
+########################################################################
+# ----------------------- Merit order ----------------------------------
+
+def _merit_order(merit_order, excess_costs, shortage_costs):
+    """Breakpoints of the residual load and slopes of the (convex) cost curve in between"""
+    merit_order = sorted(merit_order, key=lambda plant: plant[1])
+    breaks = np.concatenate([[0], np.cumsum([cap for cap, _ in merit_order])]).astype(np.float64)
+    slopes = np.array([-excess_costs] + [cost for _, cost in merit_order] + [shortage_costs], dtype=np.float64)
+    return breaks, slopes
+
+
+def dispatch_cost(residual, merit_order=TEST_MERIT_ORDER, excess_costs=1, shortage_costs=200):
+    """Cost of covering the residual load per timestep with the merit order.
+
+    Negative residual load is excess, residual load above the total capacity
+    of the merit order is shortage.
+    """
+    residual = np.asarray(residual, dtype=np.float64)
+    breaks, slopes = _merit_order(merit_order, excess_costs, shortage_costs)
+
+    cost = excess_costs * np.clip(-residual, 0, None)
+    for k in range(len(breaks) - 1):
+        cost += slopes[k + 1] * np.clip(residual - breaks[k], 0, breaks[k + 1] - breaks[k])
+    cost += shortage_costs * np.clip(residual - breaks[-1], 0, None)
+
+    return cost
+
+
+########################################################################
+# ----------------------- Pairs of timesteps ---------------------------
+
+def conflict_free_pairs(n_steps, max_distance, interval=None):
+    """Yield (d, t): timesteps t and t + d which can be shifted in one vectorised step.
+
+    For each distance |d| <= max_distance the timesteps are split into
+    alternating blocks of length |d|. Taking t from every other block only,
+    no timestep appears twice (neither as t nor as t + d). With `interval`,
+    only pairs within the same interval [k * interval, (k + 1) * interval)
+    are yielded.
+    """
+    for dist in range(1, max_distance + 1):
+        for d in (dist, -dist):
+            for parity in (0, 1):
+                t = np.arange(max(0, -d), min(n_steps, n_steps - d))
+                t = t[(t // dist) % 2 == parity]
+                if interval is not None:
+                    t = t[t // interval == (t + d) // interval]
+                yield d, t
+
+
+########################################################################
+# ----------------------- Dispatch -------------------------------------
+
+def dispatch(demand_el, wind, pv, c_up, c_do, delay_time=None, shift_interval=None,
+             merit_order=TEST_MERIT_ORDER, excess_costs=1, shortage_costs=200, demand_costs=1,
+             timeincrement=1, max_passes=50, tol=1e-9):
+    """Greedy DSM dispatch against the merit order.
+
+    Load is moved between two timesteps as long as the marginal cost saved
+    in the timestep of the downward shift exceeds the marginal cost of the
+    upward shift. Each move stops at the next breakpoint of the merit order
+    or at a capacity limit, so the cost of the pair falls in every step.
+
+    Parameters
+    ----------
+    demand_el, wind, pv: array
+        demand and fixed feed-in per timestep
+    c_up, c_do: array or float
+        DSM capacity up and down
+    delay_time: int
+        delay time in timesteps (method='delay')
+    shift_interval: int
+        shift interval in timesteps (method='potential'), used if no
+        delay_time is given
+    merit_order: list of tuple
+        (nominal_value, variable_costs) of the dispatchable generators
+    excess_costs, shortage_costs, demand_costs: float
+        variable costs of excess, shortage and the DSM inflow
+    timeincrement: float
+        length of a timestep in hours (weights the cost as in solph)
+    max_passes: int
+        maximum number of sweeps over all pairs
+    tol: float
+        minimum cost saving per unit and minimum energy moved
+
+    Returns
+    -------
+    Dispatch
+        demand_dsm, dsm_up, dsm_do, band (delay: see dsm_solve, potential: None)
+        and the total cost (comparable to the objective of the LP)
+    """
+    demand_el = np.asarray(demand_el, dtype=np.float64)
+    n_steps = len(demand_el)
+    residual = demand_el - np.asarray(wind, dtype=np.float64) - np.asarray(pv, dtype=np.float64)
+    c_up = oemof_dsm.sequence_array(c_up, n_steps)
+    c_do = oemof_dsm.sequence_array(c_do, n_steps)
+    c_max = np.maximum(c_up, c_do)
+
+    if delay_time is not None:
+        max_distance, interval = delay_time, None
+        band = np.zeros((n_steps, 2 * delay_time + 1))
+    elif shift_interval is not None:
+        max_distance, interval = shift_interval - 1, shift_interval
+        band = None
+    else:
+        raise ValueError('Either delay_time or shift_interval must be given.')
+
+    breaks, slopes = _merit_order(merit_order, excess_costs, shortage_costs)
+    up = np.zeros(n_steps)
+    down = np.zeros(n_steps)
+
+    for _ in range(max_passes):
+        moved = 0.0
+        for d, t in conflict_free_pairs(n_steps, max_distance, interval):
+            tt = t + d
+
+            # marginal cost of more load in t and of less load in tt, distance to the next breakpoint
+            k_up = np.searchsorted(breaks, residual[t], side='right')
+            k_do = np.searchsorted(breaks, residual[tt], side='left')
+            saving = slopes[k_do] - slopes[k_up]
+            head_up = np.append(breaks, np.inf)[k_up] - residual[t]
+            head_do = residual[tt] - np.append(-np.inf, breaks)[k_do]
+
+            if band is not None:
+                free_up = np.minimum(c_up[t] - up[t], c_max[t] - up[t] - down[t])
+                free_do = np.minimum(c_do[tt] - down[tt], c_max[tt] - up[tt] - down[tt])
+            else:
+                # potential method: only the net shift is bounded
+                free_up = c_up[t] - (up[t] - down[t])
+                free_do = c_do[tt] + (up[tt] - down[tt])
+
+            amount = np.minimum(np.minimum(free_up, free_do), np.minimum(head_up, head_do))
+            amount = np.where(saving > tol, np.clip(amount, 0, None), 0)
+
+            up[t] += amount
+            down[tt] += amount
+            residual[t] += amount
+            residual[tt] -= amount
+            if band is not None:
+                band[t, d + delay_time] += amount
+            moved += amount.sum()
+
+        if moved <= tol:
+            break
+
+    if band is None:
+        net = up - down
+        up, down = np.clip(net, 0, None), np.clip(-net, 0, None)
+
+    demand_dsm = demand_el + up - down
+    cost = timeincrement * (dispatch_cost(residual, merit_order, excess_costs, shortage_costs).sum()
+                            + demand_costs * demand_dsm.sum())
+
+    return Dispatch(demand_dsm, up, down, band, cost)
+
+
+########################################################################
+# ----------------------- Comparison with the LP -----------------------
+
+def compare_with_lp(build, data, datetimeindex, solver='cbc', repeat=10, **kwargs):
+    """Cost gap and runtime of the heuristic against the LP solution.
+
+    Parameters
+    ----------
+    build: callable
+        build(data, datetimeindex) returns the unsolved model with one DSM
+        component, e.g. oemof_dsm_test.build_model
+    data: pandas.DataFrame
+        input data with the columns demand_el, wind, pv, Cap_up and Cap_do
+    datetimeindex: pandas.DatetimeIndex
+        timesteps to optimise
+    solver: str
+        solver for the LP
+    repeat: int
+        number of heuristic runs for the timing
+    kwargs:
+        passed to :func:`dispatch` (merit order, costs)
+
+    Returns
+    -------
+    pandas.Series
+        costs, gap ((heuristic - LP) / LP) and run times in seconds
+    """
+    model = build(data, datetimeindex)
+    start = time.perf_counter()
+    model.solve(solver=solver, solve_kwargs={'tee': False})
+    lp_time = time.perf_counter() - start
+
+    # delay time / shift interval in timesteps as converted by the DSM block
+    block = model.component(oemof_dsm.SinkDsmDelayBlock.__name__)
+    if block is not None:
+        kwargs.setdefault('delay_time', next(iter(block.DSM)).delay_time)
+    else:
+        block = model.component(oemof_dsm.SinkDsmPotentialBlock.__name__)
+        kwargs.setdefault('shift_interval', next(iter(block.DSM)).shift_interval)
+    kwargs.setdefault('timeincrement', model.timeincrement[0])
+
+    inputs = [data[column][datetimeindex].values for column in ('demand_el', 'wind', 'pv', 'Cap_up', 'Cap_do')]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = dispatch(*inputs, **kwargs)
+    heuristic_time = (time.perf_counter() - start) / repeat
+
+    return pd.Series({'lp_cost': model.objective(),
+                      'heuristic_cost': result.cost,
+                      'gap': (result.cost - model.objective()) / abs(model.objective()),
+                      'lp_time': lp_time,
+                      'heuristic_time': heuristic_time})
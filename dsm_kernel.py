@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+DSM model on the Pyomo kernel layer with matrix constraints.
+
+SinkDsmDelayBlock and SinkDsmPotentialBlock build indexed AML components
+(Var, Constraint with BuildAction), i.e. one component data object and one
+expression tree per variable and row. KernelModel builds the same rows for
+a single-bus energy system (see SingleBusSystem) as one sparse
+matrix: all variables are lightweight pyomo.kernel variables in one list,
+the rows are two matrix_constraints (equalities and inequalities) holding
+the coefficients in CSR arrays. The index sets are computed vectorised with
+the presolve of oemof_DSM, so the model has the same DSM variables and rows
+(Eq. 1, 7 - 10 of the delay method, the interval balance of the potential
+method) as the solph model:
+
+    es = oemof_dsm_test.create_energysystem(data, datetimeindex)
+    model = KernelModel(es)
+    model.solve('cbc')
+    model.objective(), model.sequences(), model.shift_matrices()
+
+Differences to the solph model: transformer chains source -> fuel bus ->
+transformer are one generator variable with the summed costs (the same
+optimum with fewer variables), fixed flows are part of the balance rhs and
+C2 rows are always built (lazy_c2 is ignored).
+
+compare(build_es) reports build time and traced memory of both models.
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+import pyomo.kernel as pmo
+from pyomo.core.expr.numeric_expr import LinearExpression
+from pyomo.core.kernel.matrix_constraint import matrix_constraint
+
+from oemof import solph
+
+import oemof_DSM as oemof_dsm
+import dsm_results
+
+
+########################################################################
+# ----------------------- Topology -------------------------------------
+
+class UnsupportedTopology(ValueError):
+    """The energy system is no single-bus system (see SingleBusSystem)"""
+
+
+def _flow_arrays(flow, n_steps):
+    """Fixed value or (capacity, variable costs) of a flow as arrays"""
+    for attribute in ('investment', 'nonconvex', 'summed_max', 'summed_min'):
+        if getattr(flow, attribute, None) is not None:
+            raise UnsupportedTopology('Flows with {} are not supported.'.format(attribute))
+
+    costs = oemof_dsm.sequence_array(flow.variable_costs, n_steps)
+    if flow.fixed:
+        return flow.nominal_value * oemof_dsm.sequence_array(flow.actual_value, n_steps), costs
+
+    if np.any(oemof_dsm.sequence_array(flow.min, n_steps) > 0):
+        raise UnsupportedTopology('Flows with a minimum are not supported.')
+    if flow.nominal_value is None:
+        capacity = np.full(n_steps, np.inf)
+    else:
+        capacity = flow.nominal_value * oemof_dsm.sequence_array(flow.max, n_steps)
+
+    return capacity, costs
+
+
+def _chain(transformer, bus, n_steps):
+    """Capacity and costs per unit output of a chain source -> bus -> transformer -> bus"""
+    if len(transformer.inputs) != 1 or len(transformer.outputs) != 1:
+        raise UnsupportedTopology('Transformer "{}" has more than one input or output.'.format(transformer))
+    fuel_bus = list(transformer.inputs)[0]
+    if len(fuel_bus.inputs) != 1 or len(fuel_bus.outputs) != 1:
+        raise UnsupportedTopology('Bus "{}" is no simple fuel bus.'.format(fuel_bus))
+    source = list(fuel_bus.inputs)[0]
+    if not isinstance(source, solph.Source) or source.outputs[fuel_bus].fixed:
+        raise UnsupportedTopology('Bus "{}" is not fed by a dispatchable source.'.format(fuel_bus))
+
+    # input = output * cf_in / cf_out
+    ratio = (oemof_dsm.sequence_array(transformer.conversion_factors[fuel_bus], n_steps)
+             / oemof_dsm.sequence_array(transformer.conversion_factors[bus], n_steps))
+
+    source_cap, source_costs = _flow_arrays(source.outputs[fuel_bus], n_steps)
+    input_cap, input_costs = _flow_arrays(transformer.inputs[fuel_bus], n_steps)
+    output_cap, output_costs = _flow_arrays(transformer.outputs[bus], n_steps)
+
+    capacity = np.minimum(np.minimum(source_cap, input_cap) / ratio, output_cap)
+    costs = (source_costs + input_costs) * ratio + output_costs
+
+    return capacity, costs
+
+
+class SingleBusSystem:
+    """Generators, fixed feed-in/demand, excess sinks and DSM at one bus.
+
+    Raises UnsupportedTopology if the energy system has any other component
+    or a SinkDsm whose method is not in `methods`.
+    """
+
+    def __init__(self, es, methods=('delay',)):
+        self.timeindex = es.timeindex
+        self.n_steps = n_steps = len(es.timeindex)
+        self.timeincrement = oemof_dsm.timestep_length(es.timeindex) / pd.Timedelta(1, 'h')
+
+        dsm = [n for n in es.nodes if isinstance(n, oemof_dsm.SinkDsm)]
+        if not dsm:
+            raise UnsupportedTopology('The energy system contains no SinkDsm.')
+        if any(g.method not in methods or len(g.inputs) != 1 for g in dsm):
+            raise UnsupportedTopology('Only SinkDsm with method "{}" and one input are supported.'.format(
+                '", "'.join(methods)))
+        buses = {list(g.inputs)[0] for g in dsm}
+        if len(buses) != 1:
+            raise UnsupportedTopology('All SinkDsm must be connected to the same bus.')
+        self.bus = bus = buses.pop()
+
+        self.fixed = np.zeros(n_steps)
+        self.generators = []
+        self.excess = []
+        self.dsm = []
+        self.constant_costs = 0.0
+        chained = set()
+
+        for node, flow in bus.inputs.items():
+            if isinstance(node, solph.Source) and len(node.outputs) == 1:
+                value, costs = _flow_arrays(flow, n_steps)
+                if flow.fixed:
+                    self.fixed += value
+                    self.constant_costs += (costs * value).sum()
+                else:
+                    self.generators.append((node.label, value, costs))
+            elif isinstance(node, solph.Transformer):
+                capacity, costs = _chain(node, bus, n_steps)
+                self.generators.append((node.label, capacity, costs))
+                fuel_bus = list(node.inputs)[0]
+                chained |= {node, fuel_bus, list(fuel_bus.inputs)[0]}
+            else:
+                raise UnsupportedTopology('Input "{}" of bus "{}" is not supported.'.format(node, bus))
+
+        for node, flow in bus.outputs.items():
+            if isinstance(node, oemof_dsm.SinkDsm):
+                node.set_timeindex(es.timeindex)
+                node.set_arrays(n_steps)
+                _, costs = _flow_arrays(flow, n_steps)
+                self.dsm.append((node, costs))
+                self.constant_costs += (costs * node.demand_array).sum()
+            elif isinstance(node, solph.Sink) and len(node.inputs) == 1:
+                value, costs = _flow_arrays(flow, n_steps)
+                if flow.fixed:
+                    self.fixed -= value
+                    self.constant_costs += (costs * value).sum()
+                elif np.all(np.isinf(value)):
+                    self.excess.append((node.label, costs))
+                else:
+                    raise UnsupportedTopology('Sinks with a capacity are not supported.')
+            else:
+                raise UnsupportedTopology('Output "{}" of bus "{}" is not supported.'.format(node, bus))
+
+        others = set(es.nodes) - chained - {bus} - set(bus.inputs) - set(bus.outputs)
+        if others:
+            raise UnsupportedTopology('Nodes {} are not connected to bus "{}".'.format(sorted(map(str, others)), bus))
+
+        self.constant_costs *= self.timeincrement
+
+    def demand(self):
+        """Residual demand at the bus (demand of all sinks - fixed feed-in)"""
+        return sum(g.demand_array for g, _ in self.dsm) - self.fixed
+
+
+########################################################################
+# ----------------------- Kernel model ---------------------------------
+
+class _Rows:
+    """Sparse rows collected as COO triplets"""
+
+    def __init__(self):
+        self.n_rows = 0
+        self.lb = []
+        self.ub = []
+        self.triplets = []
+
+    def new(self, lb, ub):
+        """Add rows with bounds `lb` and `ub` (arrays, -inf / inf for no bound), return their numbers"""
+        lb = np.asarray(lb, dtype=np.float64)
+        ub = np.asarray(ub, dtype=np.float64)
+        rows = np.arange(self.n_rows, self.n_rows + len(lb))
+        self.n_rows += len(lb)
+        self.lb.append(lb)
+        self.ub.append(ub)
+        return rows
+
+    def add(self, rows, columns, values):
+        rows, columns = np.broadcast_arrays(rows, columns)
+        self.triplets.append((rows, columns, np.broadcast_to(np.asarray(values, dtype=np.float64), rows.shape)))
+
+    def matrix(self, n_columns):
+        if self.triplets:
+            rows, columns, values = (np.concatenate(a) for a in zip(*self.triplets))
+        else:
+            rows = columns = values = np.zeros(0)
+        return scipy.sparse.csr_matrix((values, (rows, columns)), shape=(self.n_rows, n_columns))
+
+
+class KernelModel(pmo.block):
+    """Single-bus DSM model as pyomo.kernel block with matrix constraints.
+
+    Parameters
+    ----------
+    es: solph.EnergySystem
+        energy system with one electrical bus (see SingleBusSystem)
+        and SinkDsm components of method 'delay' or 'potential'
+    """
+
+    def __init__(self, es):
+        super().__init__()
+        start = time.perf_counter()
+
+        system = SingleBusSystem(es, methods=('delay', 'potential'))
+        n_steps = system.n_steps
+        steps = np.arange(n_steps)
+
+        self._system = system
+        self._columns = {}
+        self._dsm = {}
+        lower = []
+        upper = []
+        costs = []
+        rows = _Rows()
+
+        def columns(name, lb, ub, cost=0.0):
+            """Add variables, return their column numbers"""
+            first = sum(len(b) for b in lower)
+            n = len(lb)
+            lower.append(np.asarray(lb, dtype=np.float64))
+            upper.append(np.asarray(ub, dtype=np.float64))
+            costs.append(np.broadcast_to(np.asarray(cost, dtype=np.float64), (n,)) * system.timeincrement)
+            self._columns[name] = slice(first, first + n)
+            return np.arange(first, first + n)
+
+        # bus balance: generators - excess - DSM flows = - fixed feed-in / demand
+        balance = rows.new(-system.fixed, -system.fixed)
+        for label, capacity, cost in system.generators:
+            rows.add(balance, columns(label, np.zeros(n_steps), capacity, cost), 1.0)
+        for label, cost in system.excess:
+            rows.add(balance, columns(label, np.zeros(n_steps), np.full(n_steps, np.inf), cost), -1.0)
+
+        constant = system.constant_costs
+        for g, cost in system.dsm:
+            flow = columns(g.label, np.zeros(n_steps), np.full(n_steps, np.inf), cost)
+            rows.add(balance, flow, -1.0)
+            # SingleBusSystem counts the DSM flow costs of the demand as constant
+            constant -= (cost * g.demand_array).sum() * system.timeincrement
+
+            # Eq. 1: flow = demand + DSM
+            relation = rows.new(g.demand_array, g.demand_array)
+            rows.add(relation, flow, 1.0)
+
+            if g.method == 'delay':
+                keep_up = g.c_up_array > 0 if g.presolve else np.ones(n_steps, dtype=bool)
+                keep_do = g.c_do_array > 0 if g.presolve else np.ones(n_steps, dtype=bool)
+                t, tt = oemof_dsm._band_pairs(keep_up, keep_do, g.delay_time)
+                has_up = np.bincount(t, minlength=n_steps) > 0
+                has_do = np.bincount(tt, minlength=n_steps) > 0
+                t_up = np.flatnonzero(has_up)
+                t_do = np.flatnonzero(has_do)
+
+                up = columns((g.label, 'DSMup'), np.zeros(len(t_up)), np.full(len(t_up), np.inf))
+                do = columns((g.label, 'DSMdo'), np.zeros(len(t)), np.full(len(t), np.inf))
+                up_of = np.full(n_steps, -1)
+                up_of[t_up] = up
+                self._dsm[g.label] = (g, t, tt, t_up)
+
+                rows.add(relation[t_up], up, -1.0)
+                rows.add(relation[tt], do, 1.0)
+
+                # Eq. 7: DSMup[t] = sum of DSMdo[t, tt]
+                row_of = np.full(n_steps, -1)
+                row_of[t_up] = rows.new(np.zeros(len(t_up)), np.zeros(len(t_up)))
+                rows.add(row_of[t_up], up, 1.0)
+                rows.add(row_of[t], do, -1.0)
+
+                # Eq. 8: DSMup[t] <= c_up[t]
+                rows.add(rows.new(np.full(len(t_up), -np.inf), g.c_up_array[t_up]), up, 1.0)
+
+                # Eq. 9: sum of DSMdo[t, tt] over t <= c_do[tt]
+                row_of = np.full(n_steps, -1)
+                row_of[t_do] = rows.new(np.full(len(t_do), -np.inf), g.c_do_array[t_do])
+                rows.add(row_of[tt], do, 1.0)
+
+                # Eq. 10: DSMup[tt] + sum of DSMdo[t, tt] <= max(c_up[tt], c_do[tt])
+                t_c2 = np.flatnonzero(has_up & has_do) if g.presolve else steps
+                row_of = np.full(n_steps, -1)
+                row_of[t_c2] = rows.new(np.full(len(t_c2), -np.inf), g.c_max_array[t_c2])
+                c2_up = t_c2[has_up[t_c2]]
+                rows.add(row_of[c2_up], up_of[c2_up], 1.0)
+                c2_do = row_of[tt] >= 0
+                rows.add(row_of[tt[c2_do]], do[c2_do], 1.0)
+
+            else:
+                t_ud = np.flatnonzero((g.c_up_array > 0) | (g.c_do_array > 0)) if g.presolve else steps
+                updown = columns((g.label, 'DSMupdown'), -g.c_do_array[t_ud], g.c_up_array[t_ud])
+                self._dsm[g.label] = (g, t_ud)
+                rows.add(relation[t_ud], updown, -1.0)
+
+                # interval balance, once per interval (presolve) or once per timestep
+                interval = t_ud // g.shift_interval
+                if g.presolve:
+                    intervals, position = np.unique(interval, return_inverse=True)
+                    balance_rows = rows.new(np.zeros(len(intervals)), np.zeros(len(intervals)))
+                    rows.add(balance_rows[position], updown, 1.0)
+                else:
+                    balance_rows = rows.new(np.zeros(n_steps), np.zeros(n_steps))
+                    for start in range(0, n_steps, g.shift_interval):
+                        members = updown[interval == start // g.shift_interval]
+                        timesteps = balance_rows[start:start + g.shift_interval]
+                        rows.add(np.repeat(timesteps, len(members)), np.tile(members, len(timesteps)), 1.0)
+
+        lower = np.concatenate(lower)
+        upper = np.concatenate(upper)
+        costs = np.concatenate(costs)
+
+        self.x = pmo.variable_list(pmo.variable(lb=lb, ub=None if np.isinf(ub) else ub)
+                                   for lb, ub in zip(lower.tolist(), upper.tolist()))
+        # equality rows and inequality rows (infinite bounds are no bounds)
+        matrix = rows.matrix(len(self.x))
+        lb = np.concatenate(rows.lb)
+        ub = np.concatenate(rows.ub)
+        equality = lb == ub
+        self.equalities = (matrix_constraint(matrix[equality], rhs=lb[equality], x=self.x)
+                           if equality.any() else pmo.constraint_list())
+        self.inequalities = (matrix_constraint(matrix[~equality], lb=lb[~equality], ub=ub[~equality], x=self.x)
+                             if not equality.all() else pmo.constraint_list())
+        nonzero = np.flatnonzero(costs)
+        self.obj = pmo.objective(LinearExpression(constant=constant, linear_coefs=costs[nonzero].tolist(),
+                                                  linear_vars=[self.x[i] for i in nonzero.tolist()]))
+
+        self.build_time = time.perf_counter() - start
+
+    # ----------------------- Solve and results ------------------------
+
+    def solve(self, solver='cbc', solve_kwargs=None):
+        """Solve with `solver`, return the solver results"""
+        return pmo.SolverFactory(solver).solve(self, **(solve_kwargs or {}))
+
+    def objective(self):
+        return pmo.value(self.obj)
+
+    @property
+    def n_variables(self):
+        return len(self.x)
+
+    @property
+    def n_constraints(self):
+        return len(self.equalities) + len(self.inequalities)
+
+    def _values(self):
+        return np.array([v.value if v.value is not None else 0.0 for v in self.x])
+
+    def sequences(self):
+        """Flows and DSM variables per timestep (labels as columns, (label, variable) for DSM)"""
+        values = self._values()
+        n_steps = self._system.n_steps
+        sequences = {}
+        for name, columns in self._columns.items():
+            if isinstance(name, tuple) and name[1] == 'DSMdo':
+                g, t, tt, _ = self._dsm[name[0]]
+                sequences[(name[0], 'dsm_do')] = np.bincount(tt, weights=values[columns], minlength=n_steps)
+            elif isinstance(name, tuple):
+                timesteps = self._dsm[name[0]][-1]
+                sequence = np.zeros(n_steps)
+                sequence[timesteps] = values[columns]
+                sequences[name] = sequence
+            else:
+                sequences[name] = values[columns]
+        return pd.DataFrame(sequences, index=self._system.timeindex[:n_steps])
+
+    def shift_matrices(self, tol=1e-9):
+        """ShiftMatrix of every delay component (label -> ShiftMatrix)"""
+        values = self._values()
+        matrices = {}
+        for label, entry in self._dsm.items():
+            if entry[0].method != 'delay':
+                continue
+            g, t, tt, _ = entry
+            shifted = values[self._columns[(label, 'DSMdo')]]
+            keep = shifted > tol
+            matrices[label] = dsm_results.ShiftMatrix(t[keep], tt[keep], shifted[keep], self._system.n_steps,
+                                                      g.delay_time, label,
+                                                      self._system.timeindex[:self._system.n_steps])
+        return matrices
+
+
+########################################################################
+# ----------------------- Comparison -----------------------------------
+
+def _measure(build):
+    """Build time (without tracing) and traced memory of `build()`"""
+    start = time.perf_counter()
+    build()
+    build_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        model = build()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return model, build_time, current, peak
+
+
+def compare(build_es, solver=None, solve_kwargs=None):
+    """Build time and memory of the solph model and the KernelModel of the same energy system.
+
+    Parameters
+    ----------
+    build_es: callable
+        returns a new energy system, e.g.
+        lambda: oemof_dsm_test.create_energysystem(data, datetimeindex)
+    solver: str
+        solve both models and compare the objectives
+
+    Returns
+    -------
+    pandas.DataFrame
+        rows 'solph' and 'kernel': build time (s), traced memory after the
+        build and peak (MB), variables, constraints, bytes per variable
+        and the objective
+    """
+    rows = {}
+    for name, build in (('solph', lambda: solph.Model(build_es())), ('kernel', lambda: KernelModel(build_es()))):
+        model, build_time, current, peak = _measure(build)
+        if name == 'solph':
+            n_variables, n_constraints = model.nvariables(), model.nconstraints()
+        else:
+            n_variables, n_constraints = model.n_variables, model.n_constraints
+        row = {'build_time': build_time,
+               'memory': current / 1e6,
+               'peak_memory': peak / 1e6,
+               'variables': n_variables,
+               'constraints': n_constraints,
+               'bytes_per_variable': current / n_variables}
+        if solver is not None:
+            if name == 'solph':
+                model.solve(solver=solver, solve_kwargs=solve_kwargs or {})
+            else:
+                model.solve(solver, solve_kwargs)
+            row['objective'] = model.objective()
+        rows[name] = row
+
+    return pd.DataFrame(rows).T
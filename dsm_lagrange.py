@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Temporal Lagrangian decomposition of delay DSM models.
+
+The horizon is split into windows which are solved in parallel worker
+processes (see dsm_parallel). Load shifts of the delay method couple the
+windows: a shift up in t may be compensated in tt = t +- L, i.e. in the
+neighbouring window. These shifts DSMdo[g, t, tt] across a window boundary
+are duplicated:
+
+    X[g, t, tt]  in the window of t (enters Eq. 7 of t)
+    Y[g, t, tt]  in the window of tt (enters Eq. 1, 9 and 10 of tt)
+
+The coupling X = Y is relaxed with the multiplier price[g, t, tt], i.e. the
+window of t pays price * X and the window of tt receives price * Y. The sum of
+the relaxed window objectives is a lower bound of the monolithic objective,
+the multipliers are improved with subgradient steps (Polyak step size, a
+diminishing step as long as no feasible upper bound has been found).
+
+Primal feasibility is recovered by fixing X = Y = min(X, Y) in both windows
+and solving them again. The recovered solution is feasible for the monolithic
+model, its objective is an upper bound. The iteration stops when the gap
+between both bounds is below `tol`.
+
+The windows are built with presolve=False so that Eq. 1, 7, 9 and 10 exist
+for every timestep of the window.
+
+Example::
+
+    import oemof_dsm_test
+    result = lagrange(oemof_dsm_test.build_model, data, datetimeindex, window='30D', compare=True)
+    print(result.report.tail())
+"""
+
+import math
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from oemof import outputlib
+from pyomo.environ import Set, Param, Var, Objective, NonNegativeReals, minimize, value
+
+import oemof_DSM as oemof_dsm
+import dsm_parallel
+import dsm_solve
+
+
+LagrangeResult = namedtuple('LagrangeResult', ['objective', 'bound', 'prices', 'report', 'results', 'monolithic'])
+
+
+########################################################################
+# ----------------------- Window sub-problem ---------------------------
+
+class WindowProblem:
+    """Model of one window with the crossing shifts X and Y, kept in a worker process.
+
+    Parameters
+    ----------
+    build: callable
+        build(data, datetimeindex, presolve=False) returns the unsolved model
+    data: pandas.DataFrame
+        input data
+    datetimeindex: pandas.DatetimeIndex
+        timesteps of the whole horizon
+    start, stop: int
+        first and last + 1 timestep of the window in `datetimeindex`
+    solver: str
+        solver name
+    solve_kwargs: dict
+        passed to the solver
+    """
+
+    def __init__(self, build, data, datetimeindex, start, stop, solver='cbc', solve_kwargs=None):
+        self.start = start
+        self.solver = solver
+        self.solve_kwargs = solve_kwargs or {'tee': False}
+        n_total = len(datetimeindex)
+
+        self.model = m = build(data, datetimeindex[start:stop], presolve=False)
+        block = dsm_solve._dsm_block(m, oemof_dsm.SinkDsmDelayBlock)
+
+        # crossing shifts with local t and global tt (X) / global t and local tt (Y)
+        out_index = []
+        in_index = []
+        for g in block.DSM:
+            for t in m.TIMESTEPS:
+                t_global = start + t
+                for tt_global in range(max(0, t_global - g.delay_time), min(n_total, t_global + g.delay_time + 1)):
+                    if not start <= tt_global < stop:
+                        out_index.append((g, t, tt_global))
+                        in_index.append((g, tt_global, t))
+
+        m.CROSS_OUT = Set(dimen=3, initialize=out_index, ordered=True)
+        m.CROSS_IN = Set(dimen=3, initialize=in_index, ordered=True)
+        m.cross_out = Var(m.CROSS_OUT, within=NonNegativeReals)
+        m.cross_in = Var(m.CROSS_IN, within=NonNegativeReals)
+        m.cross_price_out = Param(m.CROSS_OUT, mutable=True, initialize=0)
+        m.cross_price_in = Param(m.CROSS_IN, mutable=True, initialize=0)
+
+        # keys (label, global t, global tt) for the coordination
+        self.out_keys = {(g.label, start + t, tt): (g, t, tt) for g, t, tt in out_index}
+        self.in_keys = {(g.label, t, start + tt): (g, t, tt) for g, t, tt in in_index}
+
+        out_sum = {}
+        for g, t, tt in out_index:
+            out_sum[g, t] = out_sum.get((g, t), 0) + m.cross_out[g, t, tt]
+        in_sum = {}
+        for g, t, tt in in_index:
+            in_sum[g, tt] = in_sum.get((g, tt), 0) + m.cross_in[g, t, tt]
+
+        # Eq. 7: the shift up in t is also compensated by X
+        for (g, t), x in out_sum.items():
+            block.dsmupdo_constraint[g, t].set_value(
+                block.DSMup[g, t] == sum(block.DSMdo[g, t, tt] for tt in block.do_out[g][t]) + x)
+
+        # Eq. 1, 9, 10: Y is a shift down in tt
+        for (g, tt), y in in_sum.items():
+            block.input_output_relation[g, tt].set_value(
+                m.flow[g.inflow, g, tt] == g.demand_array[tt] + block._dsm_up(g, tt) - block._dsm_do(g, tt) - y)
+            block.dsmdo_constraint[g, tt].set_value(block._dsm_do(g, tt) + y <= g.c_do_array[tt])
+            if (g, tt) in block.C2_constraint:
+                block.C2_constraint[g, tt].set_value(
+                    block._dsm_up(g, tt) + block._dsm_do(g, tt) + y <= g.c_max_array[tt])
+
+        self.cost = m.objective.expr
+        m.del_component(m.objective)
+        m.objective = Objective(sense=minimize, expr=self.cost
+                                + sum(m.cross_price_out[i] * m.cross_out[i] for i in m.CROSS_OUT)
+                                - sum(m.cross_price_in[i] * m.cross_in[i] for i in m.CROSS_IN))
+
+    def crossings(self):
+        """Keys (label, t, tt) of the crossing shifts X and Y"""
+        return {'out': list(self.out_keys), 'in': list(self.in_keys)}
+
+    def solve(self, prices=None, fixed=None):
+        """Solve with the multipliers `prices` or with all crossing shifts fixed to `fixed` (key -> value)"""
+        m = self.model
+        prices = prices or {}
+
+        for keys, var, price in ((self.out_keys, m.cross_out, m.cross_price_out),
+                                 (self.in_keys, m.cross_in, m.cross_price_in)):
+            for key, index in keys.items():
+                price[index] = prices.get(key, 0)
+                if fixed is None:
+                    var[index].unfix()
+                else:
+                    var[index].fix(fixed.get(key, 0))
+
+        start = time.perf_counter()
+        results = m.solve(solver=self.solver, solve_kwargs=self.solve_kwargs)
+        solve_time = time.perf_counter() - start
+
+        return {'status': str(results.solver.termination_condition),
+                'objective': value(m.objective),
+                'cost': value(self.cost),
+                'out': {key: m.cross_out[index].value or 0 for key, index in self.out_keys.items()},
+                'in': {key: m.cross_in[index].value or 0 for key, index in self.in_keys.items()},
+                'solve_time': solve_time}
+
+    def results(self):
+        """Results of the last solve with string keys"""
+        return outputlib.views.convert_keys_to_strings(outputlib.processing.results(self.model))
+
+
+########################################################################
+# ----------------------- Coordination ---------------------------------
+
+def _windows(datetimeindex, window):
+    """(start, stop) of the windows of length `window` (time span or number of timesteps)"""
+    if isinstance(window, int):
+        steps = window
+    else:
+        steps = int(math.ceil(pd.Timedelta(window) / oemof_dsm.timestep_length(datetimeindex)))
+    return [(start, min(start + steps, len(datetimeindex))) for start in range(0, len(datetimeindex), steps)]
+
+
+def lagrange(build, data, datetimeindex, window='30D', solver='cbc', tol=1e-4, max_iter=50, theta=1.0,
+             patience=3, step0=1.0, compare=False, processes=None, solve_kwargs=None, callback=None):
+    """Solve the horizon window by window with Lagrangian relaxation of the boundary shifts.
+
+    Parameters
+    ----------
+    build: callable
+        build(data, datetimeindex, **dsm_kwargs) returns the unsolved model,
+        e.g. oemof_dsm_test.build_model. Must be picklable.
+    data: pandas.DataFrame
+        input data
+    datetimeindex: pandas.DatetimeIndex
+        timesteps to optimise
+    window: time span or int
+        length of a window (e.g. '30D' or a number of timesteps)
+    solver: str
+        solver name
+    tol: float
+        relative gap between upper and lower bound to stop at
+    max_iter: int
+        maximum number of subgradient iterations
+    theta: float
+        initial factor of the Polyak step, halved after `patience`
+        iterations without improvement of the lower bound
+    step0: float
+        length of the price change (costs per unit of energy) in the
+        first iteration without a feasible upper bound; until one is found
+        the k-th step changes the prices by step0 / k along the subgradient
+    compare: bool
+        solve the monolithic model as well and report the gap to it
+    processes: int
+        number of worker processes, defaults to the number of cores
+    solve_kwargs: dict
+        passed to the solver
+    callback: callable
+        called with the report row (dict) after every iteration
+
+    Returns
+    -------
+    LagrangeResult
+        objective (best upper bound), bound (best lower bound), prices
+        (multipliers by (label, t, tt)), report (per iteration: bounds, gap,
+        norm of X - Y, step, times), results (window -> results of the best
+        recovered solution, string keys) and objective and solve time of
+        the monolithic model (compare=True, else None)
+    """
+    windows = _windows(datetimeindex, window)
+    problems = {k: (build, data, datetimeindex, start, stop, solver, solve_kwargs)
+                for k, (start, stop) in enumerate(windows)}
+
+    rows = []
+    best_upper, best_lower = math.inf, -math.inf
+    best_fixed = None
+    stalled = 0
+    start_time = time.perf_counter()
+
+    with dsm_parallel.WorkerPool(WindowProblem, problems, processes) as pool:
+        crossings = pool.call('crossings')
+        prices = {key: 0.0 for reply in crossings.values() for key in reply['out']}
+
+        for iteration in range(1, max_iter + 1):
+            relaxed = pool.call('solve', {k: {'prices': prices} for k in problems})
+            lower = sum(reply['objective'] for reply in relaxed.values())
+
+            x = {key: val for reply in relaxed.values() for key, val in reply['out'].items()}
+            y = {key: val for reply in relaxed.values() for key, val in reply['in'].items()}
+            subgradient = {key: x[key] - y.get(key, 0) for key in prices}
+            norm = sum(s ** 2 for s in subgradient.values())
+
+            # primal recovery
+            fixed = {key: min(x[key], y.get(key, 0)) for key in prices}
+            recovered = pool.call('solve', {k: {'prices': prices, 'fixed': fixed} for k in problems})
+            feasible = all(reply['status'] == 'optimal' for reply in recovered.values())
+            upper = sum(reply['cost'] for reply in recovered.values()) if feasible else math.inf
+
+            if upper < best_upper:
+                best_upper, best_fixed = upper, fixed
+            if lower > best_lower + 1e-9 * abs(best_lower if math.isfinite(best_lower) else 1):
+                best_lower, stalled = lower, 0
+            else:
+                stalled += 1
+                if stalled >= patience:
+                    theta, stalled = theta / 2, 0
+
+            gap = (best_upper - best_lower) / abs(best_upper) if math.isfinite(best_upper) else math.inf
+            if norm == 0:
+                step = 0.0
+            elif math.isfinite(best_upper):
+                step = theta * (best_upper - lower) / norm
+            else:
+                # no target for the Polyak step yet
+                step = step0 / (iteration * math.sqrt(norm))
+            row = {'iteration': iteration,
+                   'lower_bound': lower,
+                   'upper_bound': upper,
+                   'best_lower_bound': best_lower,
+                   'best_upper_bound': best_upper,
+                   'gap': gap,
+                   'coupling_residual': math.sqrt(norm),
+                   'step': step,
+                   'max_solve_time': max(reply['solve_time'] for reply in list(relaxed.values())
+                                         + list(recovered.values())),
+                   'wall_time': time.perf_counter() - start_time}
+            rows.append(row)
+            if callback is not None:
+                callback(row)
+
+            if gap <= tol or norm == 0:
+                break
+            prices = {key: prices[key] + step * subgradient[key] for key in prices}
+
+        if best_fixed is not None:
+            pool.call('solve', {k: {'fixed': best_fixed} for k in problems})
+        results = pool.call('results')
+
+    report = pd.DataFrame(rows).set_index('iteration')
+    prices = pd.Series(prices, dtype=float)
+    if not prices.empty:
+        prices.index.names = ['label', 't', 'tt']
+
+    monolithic = None
+    if compare:
+        model = build(data, datetimeindex)
+        solve_time = dsm_solve.solve(model, solver=solver, solve_kwargs=solve_kwargs)
+        monolithic = pd.Series({'objective': model.objective(), 'solve_time': solve_time})
+        report['monolithic_gap'] = (report['best_upper_bound'] - monolithic['objective']) / abs(monolithic['objective'])
+
+    return LagrangeResult(best_upper, best_lower, prices, report, results, monolithic)
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Memory accounting of built DSM models.
+
+memory_report walks all components of a built model and sums the sizes
+(sys.getsizeof) of the objects each of them owns: the component, its
+containers and its data objects with everything reachable from them
+(bounds, values, expression trees of the rows). The walk stops at objects
+owned by other components (e.g. the variables in a constraint expression),
+at oemof nodes and at shared global objects, so every byte is counted once.
+Data of the DSM blocks indexed by a SinkDsm is attributed to that
+component:
+
+    report = memory_report(model)
+    report.groupby('block')['bytes'].sum()
+    report.groupby(['owner', 'type'])['bytes'].sum()
+
+measure_build builds a model under tracemalloc and attributes the
+allocations to the _create phase of each DSM block (and of further block
+types if given):
+
+    model, phases = measure_build(es)
+
+Both return DataFrames, e.g. for tracking the memory over commits.
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+import types
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from oemof import solph
+from oemof.network import Node
+
+from pyomo.core.base.component import Component, ComponentData
+
+import oemof_DSM as oemof_dsm
+
+
+DSM_BLOCKS = (oemof_dsm.SinkDsmDelayBlock, oemof_dsm.SinkDsmPotentialBlock)
+
+_SKIP = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+         weakref.ref, Node, solph.EnergySystem)
+
+
+def _slots(cls):
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        names.extend([slots] if isinstance(slots, str) else slots)
+    return names
+
+
+def deep_sizeof(obj, owner=None, seen=None):
+    """Bytes of `obj` and all objects reachable from it.
+
+    Parameters
+    ----------
+    owner: pyomo Component
+        component data and components not owned by `owner` are not entered
+    seen: set
+        ids of objects already counted (shared between calls to count
+        shared objects once)
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP):
+            continue
+        if isinstance(obj, Component) and obj is not owner:
+            continue
+        if isinstance(obj, ComponentData) and obj.parent_component() is not owner:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, int, float, complex, bool, np.ndarray)) or obj is None:
+            continue
+        else:
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for name in _slots(type(obj)):
+                if name not in ('__dict__', '__weakref__') and hasattr(obj, name):
+                    stack.append(getattr(obj, name))
+    return size
+
+
+def _owner(index):
+    """SinkDsm a data object is indexed by (first index element) or None"""
+    first = index[0] if isinstance(index, tuple) and index else index
+    return first.label if isinstance(first, oemof_dsm.SinkDsm) else None
+
+
+########################################################################
+# ----------------------- Walk of a built model ------------------------
+
+def memory_report(model, sample=None, seed=0):
+    """Approximate bytes per component of a built model.
+
+    Parameters
+    ----------
+    model: solph.Model
+        built model
+    sample: int
+        measure only this many data objects per component (and owner) and
+        extrapolate, for large models
+    seed: int
+        seed of the sample
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per component and owner: block ('' for the model itself),
+        component, type (Var, Constraint, Set, ...), owner (label of the
+        SinkDsm or None), elements and bytes
+    """
+    rng = random.Random(seed)
+    seen = set()
+    rows = []
+
+    for component in model.component_objects(descend_into=True):
+        block = component.parent_block()
+        block_name = '' if block is model else block.name
+        kind = (getattr(component, 'ctype', None) or component.type()).__name__
+        values = list(component.values()) if component.is_indexed() else []
+
+        # the component without its data objects, which are counted per owner below
+        fresh = {id(v) for v in values} - seen
+        seen |= fresh
+        overhead = deep_sizeof(component, component, seen)
+        seen -= fresh
+
+        groups = {}
+        for index, value in zip(component.keys() if values else (), values):
+            groups.setdefault(_owner(index), []).append(value)
+        if not groups:
+            groups[None] = []
+
+        for owner, values in groups.items():
+            measured = values
+            if sample is not None and len(values) > sample:
+                measured = rng.sample(values, sample)
+            size = sum(deep_sizeof(v, component, seen) for v in measured)
+            if measured is not values and measured:
+                size = size * len(values) / len(measured)
+            rows.append({'block': block_name,
+                         'component': component.local_name,
+                         'type': kind,
+                         'owner': owner,
+                         'elements': len(values) if component.is_indexed() else 1,
+                         'bytes': int(size)})
+        if list(groups) == [None]:
+            rows[-1]['bytes'] += overhead
+        else:
+            # index and containers shared by all owners
+            rows.append({'block': block_name, 'component': component.local_name, 'type': kind, 'owner': None,
+                         'elements': 0, 'bytes': overhead})
+
+    return pd.DataFrame(rows, columns=['block', 'component', 'type', 'owner', 'elements', 'bytes'])
+
+
+def summary(report):
+    """Bytes per block and type, per DSM component and per element type"""
+    dsm = report[report['owner'].notnull()]
+    return {'block': report.groupby('block')['bytes'].sum().sort_values(ascending=False),
+            'type': report.groupby('type')['bytes'].sum().sort_values(ascending=False),
+            'component': dsm.groupby(['owner', 'component'])['bytes'].sum(),
+            'per_element': per_element(report)}
+
+
+def per_element(report):
+    """Mean bytes per variable and per constraint (e.g. for dsm_size.BYTES_PER_*)"""
+    totals = report.groupby('type')[['bytes', 'elements']].sum()
+    totals = totals[totals['elements'] > 0]
+    return totals['bytes'] / totals['elements']
+
+
+########################################################################
+# ----------------------- Tracing of the build -------------------------
+
+@contextmanager
+def trace_create(block_types=DSM_BLOCKS):
+    """Record time and traced memory of every _create call of `block_types`.
+
+    Yields a list which is filled with one dict per call: block, allocated
+    (bytes still allocated after _create), peak (bytes above the start
+    during _create, Python >= 3.9) and time.
+    """
+    records = []
+    originals = {cls: cls.__dict__.get('_create') for cls in block_types}
+
+    def wrap(cls, create):
+        def _create(self, group=None):
+            if not tracemalloc.is_tracing():
+                return create(self, group)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            start = time.perf_counter()
+            try:
+                return create(self, group)
+            finally:
+                after, peak = tracemalloc.get_traced_memory()
+                records.append({'block': cls.__name__,
+                                'components': len(group) if group else 0,
+                                'allocated': after - before,
+                                'peak': peak - before if hasattr(tracemalloc, 'reset_peak') else np.nan,
+                                'time': time.perf_counter() - start,
+                                # the peak is reset, keep it for the peak of the whole build
+                                'absolute_peak': peak})
+        return _create
+
+    for cls in block_types:
+        cls._create = wrap(cls, cls._create)
+    try:
+        yield records
+    finally:
+        for cls, create in originals.items():
+            if create is None:
+                del cls._create
+            else:
+                cls._create = create
+
+
+def measure_build(es, block_types=DSM_BLOCKS, model_class=solph.Model, **kwargs):
+    """Build model_class(es) under tracemalloc.
+
+    Returns
+    -------
+    model: solph.Model
+        the built model
+    phases: pandas.DataFrame
+        one row per _create call of `block_types` and a row 'model' with the
+        whole build: allocated and peak memory (bytes) and time (s)
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        with trace_create(block_types) as records:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            start = time.perf_counter()
+            model = model_class(es, **kwargs)
+            elapsed = time.perf_counter() - start
+            after, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    peak = max([peak] + [r['absolute_peak'] for r in records])
+    records.append({'block': 'model', 'components': len(es.nodes), 'allocated': after - before,
+                    'peak': peak - before, 'time': elapsed})
+    phases = pd.DataFrame(records).set_index('block')
+    return model, phases.drop(columns='absolute_peak', errors='ignore')
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent worker processes for decomposed DSM models.
+
+Each sub-problem (a region, a time window, ...) is built once in a worker
+process and kept there, so only the coordination data (prices, targets)
+and the results travel through the pipes in every iteration:
+
+    with WorkerPool(RegionProblem, {'north': args_north, 'south': args_south}) as pool:
+        replies = pool.call('solve', {'north': {'prices': ...}, 'south': {...}})
+
+`factory(*args)` creates the sub-problem in the worker; `pool.call(method,
+payloads)` calls `method(**payload)` of every sub-problem and returns the
+replies by key. The sub-problems of one worker are processed one after the
+other, the workers in parallel.
+"""
+
+import os
+import multiprocessing
+import traceback
+
+
+class _Failure:
+    """Traceback of an exception raised in a worker"""
+
+    def __init__(self, key):
+        self.key = key
+        self.traceback = traceback.format_exc()
+
+
+def _serve(conn, factory, items):
+    """Worker loop: build the sub-problems, then answer calls until None is received"""
+    problems = {}
+    try:
+        for key, args in items:
+            problems[key] = factory(*args)
+        conn.send(None)
+    except Exception:
+        conn.send(_Failure(key))
+        return
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        method, payloads = message
+        replies = {}
+        try:
+            for key, payload in payloads.items():
+                replies[key] = getattr(problems[key], method)(**payload)
+        except Exception:
+            replies = _Failure(key)
+        conn.send(replies)
+
+    conn.close()
+
+
+class WorkerPool:
+    """Sub-problems distributed over persistent worker processes.
+
+    Parameters
+    ----------
+    factory: callable
+        factory(*args) creates a sub-problem. Must be picklable, i.e. a class
+        or function defined at module level.
+    problems: dict
+        key -> args of the sub-problem
+    processes: int
+        number of worker processes, defaults to the number of cores (at most
+        one per sub-problem)
+    """
+
+    def __init__(self, factory, problems, processes=None):
+        keys = list(problems)
+        processes = max(1, min(processes or os.cpu_count() or 1, len(keys)))
+        context = multiprocessing.get_context()
+
+        self.workers = []
+        for i in range(processes):
+            items = [(key, problems[key]) for key in keys[i::processes]]
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(child, factory, items), daemon=True)
+            process.start()
+            child.close()
+            self.workers.append((process, parent, [key for key, _ in items]))
+
+        try:
+            for _, conn, _ in self.workers:
+                self._receive(conn)
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def _receive(conn):
+        reply = conn.recv()
+        if isinstance(reply, _Failure):
+            raise RuntimeError('Sub-problem "{}" failed in its worker:\n{}'.format(reply.key, reply.traceback))
+        return reply
+
+    def call(self, method, payloads=None):
+        """Call `method(**payloads[key])` of all sub-problems in parallel and return the replies by key"""
+        payloads = payloads or {}
+        for _, conn, keys in self.workers:
+            conn.send((method, {key: payloads.get(key, {}) for key in keys}))
+
+        replies = {}
+        failure = None
+        for _, conn, _ in self.workers:
+            try:
+                replies.update(self._receive(conn))
+            except RuntimeError as e:
+                # receive from all workers to keep the pipes in sync
+                failure = failure or e
+        if failure is not None:
+            raise failure
+
+        return replies
+
+    def close(self):
+        """Stop the worker processes"""
+        for process, conn, _ in self.workers:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for process, _, _ in self.workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
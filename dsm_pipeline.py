@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Pipelined sweeps: build, solve and extract stages in their own threads.
+
+A sweep usually runs read -> create_model -> CBC -> extract_results -> plot
+for one scenario after the other, so the CPU idles while CBC runs and CBC
+idles while Python builds the next model. Here every stage is a thread and
+the stages are connected by bounded queues:
+
+    build     read the data (cached), create the energy system and build the model
+    solve     CBC (the solver process runs outside the GIL), progress events
+    extract   process, audit and store the results, optionally extract and plot
+
+While scenario n is solved, scenario n + 1 is built and scenario n - 1 is
+extracted, so the throughput approaches the speed of the slowest stage.
+`queue_size` bounds the number of built models waiting for the solver
+(each holds a full Pyomo model in memory). Every stage works on its own
+model; there is one thread per stage, for several concurrent CBC
+processes see dsm_async.
+
+    scenarios = {'delay_{}'.format(d): {'data': 'recovery.csv', 'timesteps': 8760, 'dsm': {'delay_time': d}}
+                 for d in ('1H', '2H', '4H', '8H')}
+    report = Pipeline('sweep').run(scenarios)
+
+A scenario is a dict with the keys data (DataFrame or CSV file as read by
+oemof_dsm_test.read_data), timesteps (default: all), freq and start of the
+timestamps, dsm (keyword arguments of SinkDsm), params (stored in addition
+to the DSM parameters of the built model, e.g. the aggregation) and plot.
+
+A failing stage or callback marks its scenario as failed in the report, the
+other scenarios go on. If a stage thread dies nevertheless, run raises a
+RuntimeError instead of waiting for it.
+"""
+
+import os
+import queue
+import threading
+import time
+import traceback
+
+import pandas as pd
+
+import oemof_dsm_test
+import dsm_solverlog
+import plot_dsm as pltdsm
+
+
+STAGES = ('build', 'solve', 'extract')
+
+# end of the scenarios, passed through all stages
+_DONE = object()
+
+
+def _last_line(text):
+    return text.strip().split('\n')[-1]
+
+
+class Job:
+    """One scenario on its way through the stages"""
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.spec = spec
+        self.data = None
+        self.datetimeindex = None
+        self.model = None
+        self.events = None
+        self.error = None
+        self.times = {}
+        self.waits = {}
+        self.ready = time.perf_counter()
+        self.result = {}
+
+
+class Pipeline:
+    """Build, solve and extract stages connected by bounded queues.
+
+    Parameters
+    ----------
+    directory: str
+        results directory, one subdirectory per scenario
+    store: str
+        dsm_store root, defaults to `<directory>/results`
+    solver: str
+        solver name
+    solve_kwargs: dict
+        passed to the solver
+    queue_size: int
+        models waiting between two stages
+    plot: bool
+        extract and plot every scenario (can be overridden per scenario)
+    callback: callable
+        called with the report row (dict) of each finished scenario
+    keep_models: bool
+        keep the solved models (`models`), otherwise they are released
+        after the extract stage
+    backend: str
+        matplotlib backend to switch to for the plots, e.g. 'Agg' (figures
+        are only saved, pyplot is used from the extract thread). The
+        backend is set for the whole process, by default it is left to
+        the caller.
+    """
+
+    def __init__(self, directory, store=None, solver='cbc', solve_kwargs=None, queue_size=1, plot=False,
+                 callback=None, keep_models=False, backend=None):
+        self.directory = os.path.abspath(directory)
+        self.store = store or os.path.join(self.directory, 'results')
+        self.solver = solver
+        self.solve_kwargs = solve_kwargs
+        self.queue_size = queue_size
+        self.plot = plot
+        self.callback = callback
+        self.keep_models = keep_models
+        self.models = {}
+        self.wall_time = None
+        self._data = {}
+        self._rows = []
+        self._dead = {}
+        self._lock = threading.Lock()
+        if backend is not None:
+            import matplotlib
+            matplotlib.use(backend)
+
+    # ----------------------- Stages -----------------------------------
+
+    def read_data(self, data, freq='H', start='1/1/2013'):
+        """Input data (DataFrame or CSV file, cached)"""
+        if isinstance(data, pd.DataFrame):
+            return data
+        key = (os.path.abspath(data), os.path.getmtime(data), freq, start)
+        if key not in self._data:
+            self._data[key] = oemof_dsm_test.read_data(data, freq=freq, start=start)
+        return self._data[key]
+
+    def build(self, job):
+        spec = job.spec
+        job.data = self.read_data(spec['data'], freq=spec.get('freq', 'H'), start=spec.get('start', '1/1/2013'))
+        job.datetimeindex = job.data.index[:spec.get('timesteps') or len(job.data)]
+        job.model = oemof_dsm_test.build_model(job.data, job.datetimeindex, **spec.get('dsm', {}))
+
+    def solve(self, job):
+        directory = os.path.join(self.directory, job.name)
+        os.makedirs(directory, exist_ok=True)
+        job.events = dsm_solverlog.solve_with_progress(job.model, solver=self.solver,
+                                                       jsonl=os.path.join(directory, 'solver_progress.jsonl'),
+                                                       solve_kwargs=self.solve_kwargs)
+
+    def extract(self, job):
+        directory = os.path.join(self.directory, job.name) + '/'
+        # the store records the DSM parameters of the built model, defaults included
+        model = oemof_dsm_test.save_results(job.model, directory, self.store, job.name, job.events,
+                                            params=job.spec.get('params'))
+        job.result = {'objective': model.objective(), 'violations': len(model.es.results['audit'])}
+
+        if job.spec.get('plot', self.plot):
+            os.makedirs(directory + 'Grafiken', exist_ok=True)
+            df_gesamt = pltdsm.extract_results(model, job.data, job.datetimeindex, directory)
+            pltdsm.plot(df_gesamt, job.datetimeindex, directory, len(job.datetimeindex), job.name)
+            plt, _ = pltdsm._pyplot()
+            plt.close('all')
+
+    # ----------------------- Threads ----------------------------------
+
+    def _stage(self, name, inbox, outbox):
+        try:
+            self._work(name, inbox, outbox)
+        except BaseException:
+            # reported by run
+            self._dead[name] = traceback.format_exc()
+
+    def _work(self, name, inbox, outbox):
+        work = getattr(self, name)
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                if outbox is not None:
+                    outbox.put(_DONE)
+                return
+
+            start = time.perf_counter()
+            job.waits[name] = start - job.ready
+            if job.error is None:
+                try:
+                    work(job)
+                except Exception:
+                    job.error = (name, traceback.format_exc())
+                job.times[name] = time.perf_counter() - start
+            job.ready = time.perf_counter()
+
+            if outbox is not None:
+                # blocks while the next stage is busy and its queue is full
+                outbox.put(job)
+            else:
+                self._finish(job)
+
+    def _finish(self, job):
+        try:
+            row = {'scenario': job.name,
+                   'status': 'done' if job.error is None else 'failed ({})'.format(job.error[0])}
+            row.update(job.result)
+            for stage in STAGES:
+                row[stage] = job.times.get(stage)
+                row['wait_' + stage] = job.waits.get(stage)
+            row['error'] = _last_line(job.error[1]) if job.error else None
+        except Exception:
+            row = {'scenario': job.name, 'status': 'failed (report)', 'error': _last_line(traceback.format_exc())}
+
+        with self._lock:
+            self._rows.append(row)
+            if self.keep_models and job.model is not None:
+                self.models[job.name] = job.model
+        job.model = job.data = None
+        if self.callback is not None:
+            try:
+                self.callback(row)
+            except Exception:
+                row['callback_error'] = _last_line(traceback.format_exc())
+
+    def _check(self):
+        """Raise if a stage thread died"""
+        if self._dead:
+            name, error = next(iter(self._dead.items()))
+            raise RuntimeError('The {} stage of the pipeline died, the sweep is aborted:\n{}'.format(name, error))
+
+    def _put(self, inbox, item):
+        """Put `item` into the queue of the first stage, without blocking on a dead stage"""
+        while True:
+            try:
+                inbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                self._check()
+
+    def run(self, scenarios):
+        """Run all scenarios (name -> dict, see module docstring) through the stages.
+
+        Returns
+        -------
+        pandas.DataFrame
+            per scenario in order of completion: status, objective, number
+            of audit violations, seconds spent in and waiting for each
+            stage and the last lines of the errors of the scenario and of
+            the callback; the wall time of the sweep is kept as `wall_time`
+
+        Raises RuntimeError if a stage thread died.
+        """
+        self._rows = []
+        self._dead = {}
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in STAGES]
+        threads = [threading.Thread(target=self._stage, name='dsm_pipeline_' + stage, daemon=True,
+                                    args=(stage, queues[i], queues[i + 1] if i + 1 < len(STAGES) else None))
+                   for i, stage in enumerate(STAGES)]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for name, spec in scenarios.items():
+            self._put(queues[0], Job(name, spec))
+        self._put(queues[0], _DONE)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.1)
+                self._check()
+        self._check()
+        self.wall_time = time.perf_counter() - start
+
+        columns = ['scenario', 'status', 'objective', 'violations'] + list(STAGES) \
+            + ['wait_' + s for s in STAGES] + ['error', 'callback_error']
+        return pd.DataFrame(self._rows).reindex(columns=columns).set_index('scenario')
+
+    @staticmethod
+    def bottleneck(report):
+        """Stage with the largest total time and the sum of the stage times (sequential run time)"""
+        totals = report[list(STAGES)].sum()
+        return totals.idxmax(), totals.sum()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse representation of the solved DSM shift matrix.
+
+DSMdo[g, t, tt] of a delay component is a T x T matrix with at most 2L+1
+diagonals of which only a few entries are nonzero after the solve. A
+ShiftMatrix keeps the nonzero entries only, as triplets
+
+    t     timestep of the shift up (origin, row)
+    tt    timestep of the compensating shift down (target, column)
+    value shifted energy
+
+so its memory scales with the number of nonzero shifts instead of T ** 2.
+
+    shifts = shift_matrices(model)['demand_dsm']
+    shifts.row_sums()    # DSMup per timestep
+    shifts.col_sums()    # shift down (dsm_do) per timestep
+    shifts.distance_histogram()
+"""
+
+import numpy as np
+import pandas as pd
+
+import oemof_DSM as oemof_dsm
+
+
+class ShiftMatrix:
+    """Nonzero load shifts of one delay component as (t, tt, value) triplets.
+
+    Parameters
+    ----------
+    t, tt: array of int
+        origin (shift up) and target (shift down) timesteps
+    value: array of float
+        shifted energy
+    n_steps: int
+        number of timesteps
+    delay_time: int
+        delay time of the component in timesteps
+    label: str
+        label of the component
+    timeindex: pandas.DatetimeIndex
+        timesteps of the model
+    """
+
+    def __init__(self, t, tt, value, n_steps, delay_time, label=None, timeindex=None):
+        order = np.lexsort((tt, t))
+        self.t = np.asarray(t, dtype=np.int32)[order]
+        self.tt = np.asarray(tt, dtype=np.int32)[order]
+        self.value = np.asarray(value, dtype=np.float64)[order]
+        self.n_steps = n_steps
+        self.delay_time = delay_time
+        self.label = label
+        self.timeindex = timeindex
+
+    @classmethod
+    def from_block(cls, block, g, tol=1e-9):
+        """Nonzero DSMdo[g, t, tt] of the solved SinkDsmDelayBlock `block`"""
+        m = block.parent_block()
+        triplets = [(t, tt, block.DSMdo[g, t, tt].value)
+                    for t in m.TIMESTEPS for tt in block.do_out[g][t]
+                    if (block.DSMdo[g, t, tt].value or 0) > tol]
+        t, tt, value = zip(*triplets) if triplets else ((), (), ())
+        return cls(t, tt, value, len(m.TIMESTEPS), g.delay_time, g.label, m.es.timeindex[:len(m.TIMESTEPS)])
+
+    @classmethod
+    def from_band(cls, band, tol=1e-9, label=None, timeindex=None):
+        """Shift matrix of a band (see dsm_solve, band[t, L + d] = DSMdo[g, t, t + d])"""
+        n_steps, width = band.shape
+        delay_time = (width - 1) // 2
+        t, k = np.nonzero(band > tol)
+        tt = t + k - delay_time
+        # band entries beyond the horizon are no shifts
+        inside = (tt >= 0) & (tt < n_steps)
+        return cls(t[inside], tt[inside], band[t[inside], k[inside]], n_steps, delay_time, label, timeindex)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __repr__(self):
+        return '<ShiftMatrix {}: {} x {}, {} nonzero shifts>'.format(self.label, self.n_steps, self.n_steps, len(self))
+
+    @property
+    def nbytes(self):
+        """Memory of the triplets in bytes"""
+        return self.t.nbytes + self.tt.nbytes + self.value.nbytes
+
+    @property
+    def distance(self):
+        """Shift distance tt - t of each entry in timesteps"""
+        return self.tt - self.t
+
+    def row_sums(self):
+        """Energy shifted up per timestep t (DSMup)"""
+        return np.bincount(self.t, weights=self.value, minlength=self.n_steps)
+
+    def col_sums(self):
+        """Energy shifted down per timestep tt (dsm_do)"""
+        return np.bincount(self.tt, weights=self.value, minlength=self.n_steps)
+
+    def distance_histogram(self):
+        """Shifted energy per shift distance -L ... L (negative: shift down before the shift up)"""
+        counts = np.bincount(self.distance + self.delay_time, weights=self.value,
+                             minlength=2 * self.delay_time + 1)
+        return pd.Series(counts, index=pd.RangeIndex(-self.delay_time, self.delay_time + 1, name='distance'),
+                         name=self.label)
+
+    def to_band(self):
+        """Dense band (T, 2L+1) as used in dsm_solve"""
+        band = np.zeros((self.n_steps, 2 * self.delay_time + 1))
+        band[self.t, self.distance + self.delay_time] = self.value
+        return band
+
+    def to_frame(self):
+        """Triplets as DataFrame, with timestamps if the timeindex is known"""
+        df = pd.DataFrame({'t': self.t, 'tt': self.tt, 'value': self.value})
+        if self.timeindex is not None:
+            df['t'] = self.timeindex[self.t]
+            df['tt'] = self.timeindex[self.tt]
+        return df
+
+    def to_series(self, kind='row'):
+        """row_sums ('row') or col_sums ('col') as Series over the timeindex"""
+        sums = self.row_sums() if kind == 'row' else self.col_sums()
+        return pd.Series(sums, index=self.timeindex if self.timeindex is not None else None)
+
+
+def shift_matrices(model, tol=1e-9):
+    """ShiftMatrix of every delay component of the solved `model` (label -> ShiftMatrix)"""
+    block = model.component(oemof_dsm.SinkDsmDelayBlock.__name__)
+    if block is None:
+        return {}
+    return {g.label: ShiftMatrix.from_block(block, g, tol) for g in block.DSM}
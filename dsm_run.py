@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Solve-only entry point for headless batch runs.
+
+Builds and solves the test model of oemof_dsm_test and saves the results
+without plotting, so matplotlib is never imported. The import time, the
+peak memory and whether matplotlib was loaded are reported:
+
+    python dsm_run.py recovery-time/recovery.csv --timesteps 58
+
+`import_report()` measures the imports in fresh interpreters, e.g. to
+compare the solve-only imports with the plotting imports:
+
+    print(import_report())
+"""
+
+import time
+
+_start = time.perf_counter()
+
+import argparse
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+import oemof_dsm_test
+
+IMPORT_TIME = time.perf_counter() - _start
+
+
+# imports of a solve-only run and of a run with plots
+IMPORTS = {
+    'solve_only': 'import oemof_dsm_test',
+    'plotting': 'import oemof_dsm_test, plot_dsm; plot_dsm._pyplot()',
+}
+
+_MEASURE = """
+import resource, sys, time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'matplotlib' in sys.modules)
+"""
+
+
+def _peak_memory():
+    """Peak resident memory of this process in MB (None where resource is not available)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def import_report(imports=IMPORTS, repeat=3):
+    """Import time and peak memory of each statement in a fresh interpreter.
+
+    Parameters
+    ----------
+    imports: dict
+        name -> import statement(s)
+    repeat: int
+        number of interpreters per statement, the fastest run is reported
+
+    Returns
+    -------
+    pandas.DataFrame
+        import time (s), peak memory (MB) and whether matplotlib was loaded
+    """
+    scale = 1 if sys.platform == 'darwin' else 1024
+    rows = {}
+    for name, statement in imports.items():
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, '-c', _MEASURE.format(statement=statement)],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            seconds, maxrss, matplotlib = out.split()[-3:]
+            runs.append((float(seconds), int(maxrss) * scale / 1e6, matplotlib == 'True'))
+        seconds, memory, matplotlib = min(runs)
+        rows[name] = {'import_time': seconds, 'peak_memory_mb': memory, 'matplotlib': matplotlib}
+    return pd.DataFrame(rows).T
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Build and solve the DSM test model without plotting.')
+    parser.add_argument('data', help='input CSV (see oemof_dsm_test.read_data)')
+    parser.add_argument('--timesteps', type=int, default=None, help='number of timesteps (default: all)')
+    parser.add_argument('--freq', default='H', help='resolution of the input data')
+    parser.add_argument('--directory', default='./', help='directory of the LP file')
+    args = parser.parse_args(args)
+
+    data = oemof_dsm_test.read_data(args.data, freq=args.freq)
+    datetimeindex = data.index[:args.timesteps or len(data)]
+
+    start = time.perf_counter()
+    model = oemof_dsm_test.create_model(data, datetimeindex, args.directory)
+    model_time = time.perf_counter() - start
+
+    print('-----------------------------------------------------')
+    print('OBJ: ', model.objective())
+    print('import time: {:.2f} s, build + solve time: {:.2f} s'.format(IMPORT_TIME, model_time))
+    memory = _peak_memory()
+    print('peak memory: {} MB, matplotlib loaded: {}'.format(
+        '-' if memory is None else '{:.0f}'.format(memory), 'matplotlib' in sys.modules))
+    print('-----------------------------------------------------')
+
+    return model
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Size of a DSM model before it is built.
+
+The number of variables, constraints and nonzeros of the solph model is
+counted from the energy system alone: one flow variable per flow and
+timestep, the bus balances and transformer relations and, for every
+SinkDsm, the variables and rows its block will create. The DSM counts
+follow the presolve of oemof_DSM exactly (band |t - tt| <= L, timesteps
+without capacity skipped) and are computed with window sums instead of
+building the index sets, so a year of hourly data is estimated in
+milliseconds. The memory is approximated with the bytes per variable,
+constraint and nonzero of the Pyomo AML (BYTES_PER_*, rough values for
+CPython 3; dsm_memory.per_element measures them for a built model).
+
+    report = estimate(es)
+    print(report['total'])
+
+BudgetModel refuses (or warns about) models above a memory budget before
+anything is built. Without a budget it uses DEFAULT_BUDGET, a share of the
+memory available when the model is built; budget=None switches the check
+off:
+
+    model = BudgetModel(es, budget='8GB')
+"""
+
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from oemof import solph
+
+import oemof_DSM as oemof_dsm
+
+
+BYTES_PER_VARIABLE = 400
+BYTES_PER_CONSTRAINT = 600
+BYTES_PER_NONZERO = 120
+
+# budget of BudgetModel if none is given: 'auto' (AVAILABLE_SHARE of the
+# available memory), bytes, a string like '8GB' or None (no budget)
+DEFAULT_BUDGET = 'auto'
+AVAILABLE_SHARE = 0.8
+# 'auto' budget if the available memory is unknown
+FALLBACK_BUDGET = 4e9
+
+_UNITS = {'': 1, 'B': 1, 'KB': 1e3, 'MB': 1e6, 'GB': 1e9, 'TB': 1e12}
+
+
+class ModelTooLarge(MemoryError):
+    """The estimated memory of the model exceeds the budget"""
+
+
+def available_memory():
+    """Available physical memory in bytes (psutil or /proc/meminfo), None if unknown"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def default_budget():
+    """AVAILABLE_SHARE of the available memory, FALLBACK_BUDGET if that is unknown"""
+    available = available_memory()
+    return FALLBACK_BUDGET if available is None else AVAILABLE_SHARE * available
+
+
+def to_bytes(size):
+    """Bytes of a size given as number, string like '8GB', '500 MB' or 'auto' (default_budget)"""
+    if size is None or isinstance(size, (int, float, np.integer, np.floating)):
+        return size
+    if str(size).strip().lower() == 'auto':
+        return default_budget()
+    match = re.match(r'^\s*([\d.]+)\s*([KMGT]?B?)\s*$', str(size), flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError('Cannot read the size "{}", use e.g. "8GB".'.format(size))
+    return float(match.group(1)) * _UNITS[match.group(2).upper()]
+
+
+def _window_counts(keep, delay_time):
+    """Number of True in keep[t - L ... t + L] for every t"""
+    n_steps = len(keep)
+    cumulated = np.concatenate([[0], np.cumsum(keep)])
+    t = np.arange(n_steps)
+    return cumulated[np.minimum(t + delay_time + 1, n_steps)] - cumulated[np.maximum(t - delay_time, 0)]
+
+
+########################################################################
+# ----------------------- Counts ---------------------------------------
+
+def estimate_dsm(n_steps, c_up, c_do, method='delay', delay_time=3, shift_interval=24, presolve=True,
+                 lazy_c2=False):
+    """Variables, constraints and nonzeros of one SinkDsm block.
+
+    Parameters
+    ----------
+    n_steps: int
+        number of timesteps
+    c_up, c_do: scalar or array
+        capacities
+    delay_time, shift_interval: int
+        durations in timesteps
+    presolve, lazy_c2: bool
+        as in SinkDsm
+
+    Returns
+    -------
+    dict
+        variables, constraints, nonzeros and the counts per variable / row
+        (without the flow into the component)
+    """
+    c_up = oemof_dsm.sequence_array(c_up, n_steps)
+    c_do = oemof_dsm.sequence_array(c_do, n_steps)
+
+    if method == 'delay':
+        keep_up = c_up > 0 if presolve else np.ones(n_steps, dtype=bool)
+        keep_do = c_do > 0 if presolve else np.ones(n_steps, dtype=bool)
+        # shift down partners of each t, shift up partners of each tt
+        partners_do = np.where(keep_up, _window_counts(keep_do, delay_time), 0)
+        partners_up = np.where(keep_do, _window_counts(keep_up, delay_time), 0)
+        has_up = partners_do > 0
+        has_do = partners_up > 0
+        c2 = np.zeros(n_steps, dtype=bool) if lazy_c2 else (has_up & has_do if presolve else np.ones(n_steps, bool))
+
+        n_up = int(has_up.sum())
+        n_do = int(partners_do.sum())
+        counts = {'DSMup': n_up,
+                  'DSMdo': n_do,
+                  'input_output_relation': n_steps,
+                  'dsmupdo_constraint': n_up,
+                  'dsmup_constraint': n_up,
+                  'dsmdo_constraint': int(has_do.sum()),
+                  'C2_constraint': int(c2.sum())}
+        variables = n_up + n_do
+        nonzeros = (n_steps + n_up + n_do            # flow = demand + DSMup - DSMdo
+                    + n_up + n_do                    # Eq. 7
+                    + n_up                           # Eq. 8
+                    + n_do                           # Eq. 9
+                    + int((has_up & c2).sum()) + int(partners_up[c2].sum()))   # Eq. 10
+
+    else:
+        keep = (c_up > 0) | (c_do > 0) if presolve else np.ones(n_steps, dtype=bool)
+        n_updown = int(keep.sum())
+        starts = np.arange(n_steps) // shift_interval
+        per_interval = np.bincount(starts[keep], minlength=starts[-1] + 1 if n_steps else 0)
+        if presolve:
+            n_sum = int((per_interval > 0).sum())
+            nnz_sum = n_updown
+        else:
+            n_sum = n_steps
+            nnz_sum = int(per_interval[starts].sum())
+        counts = {'DSMupdown': n_updown,
+                  'input_output_relation': n_steps,
+                  'dsm_sum_constraint': n_sum}
+        variables = n_updown
+        nonzeros = n_steps + n_updown + nnz_sum
+
+    constraints = sum(v for k, v in counts.items() if not k.startswith('DSM'))
+    return dict(counts, variables=variables, constraints=constraints, nonzeros=nonzeros)
+
+
+def estimate(es, bytes_per_variable=None, bytes_per_constraint=None, bytes_per_nonzero=None):
+    """Variables, constraints, nonzeros and memory of solph.Model(es) without building it.
+
+    Parameters
+    ----------
+    es: solph.EnergySystem
+        energy system with timeindex
+    bytes_per_variable, bytes_per_constraint, bytes_per_nonzero: float
+        defaults to BYTES_PER_VARIABLE, BYTES_PER_CONSTRAINT and BYTES_PER_NONZERO
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per SinkDsm, 'flows' (flow variables, bus balances and
+        transformer relations) and 'total'; columns variables,
+        constraints, nonzeros, memory (bytes) and the DSM counts
+    """
+    bytes_per_variable = BYTES_PER_VARIABLE if bytes_per_variable is None else bytes_per_variable
+    bytes_per_constraint = BYTES_PER_CONSTRAINT if bytes_per_constraint is None else bytes_per_constraint
+    bytes_per_nonzero = BYTES_PER_NONZERO if bytes_per_nonzero is None else bytes_per_nonzero
+    n_steps = len(es.timeindex)
+
+    flows = es.flows()
+    buses = [n for n in es.nodes if isinstance(n, solph.Bus)]
+    transformers = [n for n in es.nodes if isinstance(n, solph.Transformer)]
+    relations = sum(len(n.inputs) * len(n.outputs) for n in transformers)
+    rows = {'flows': {'variables': len(flows) * n_steps,
+                      'constraints': (len(buses) + relations) * n_steps,
+                      'nonzeros': (sum(len(b.inputs) + len(b.outputs) for b in buses) + 2 * relations) * n_steps}}
+
+    for g in es.nodes:
+        if isinstance(g, oemof_dsm.SinkDsm):
+            g.set_timeindex(es.timeindex)
+            rows[g.label] = estimate_dsm(n_steps, g.c_up, g.c_do, g.method, g.delay_time, g.shift_interval,
+                                         g.presolve, g.lazy_c2)
+
+    report = pd.DataFrame.from_dict(rows, orient='index').fillna(0).astype(np.int64)
+    report.loc['total'] = report.sum()
+    report['memory'] = (report['variables'] * bytes_per_variable + report['constraints'] * bytes_per_constraint
+                        + report['nonzeros'] * bytes_per_nonzero)
+    first = ['variables', 'constraints', 'nonzeros', 'memory']
+    return report[first + [c for c in report.columns if c not in first]]
+
+
+########################################################################
+# ----------------------- Guardrail ------------------------------------
+
+def check_budget(es, budget=DEFAULT_BUDGET, action='raise'):
+    """Estimate `es` and raise ModelTooLarge ('raise') or warn ('warn') above `budget`.
+
+    `budget=None` only estimates.
+
+    Returns
+    -------
+    pandas.DataFrame
+        the estimate
+    """
+    report = estimate(es)
+    budget = to_bytes(budget)
+    if budget is not None and report.loc['total', 'memory'] > budget:
+        message = ('The model needs about {:.2f} GB ({} variables, {} constraints, {} nonzeros), '
+                   'the budget is {:.2f} GB.\n{}'.format(report.loc['total', 'memory'] / 1e9,
+                                                         report.loc['total', 'variables'],
+                                                         report.loc['total', 'constraints'],
+                                                         report.loc['total', 'nonzeros'],
+                                                         budget / 1e9, report[['variables', 'memory']]))
+        if action == 'raise':
+            raise ModelTooLarge(message)
+        warnings.warn(message)
+    return report
+
+
+class BudgetModel(solph.Model):
+    """solph.Model which checks the estimated size before it is built.
+
+    Parameters
+    ----------
+    energysystem: solph.EnergySystem
+    budget: int, float or str
+        memory budget in bytes, as string like '8GB' or 'auto' (a share of
+        the available memory), defaults to DEFAULT_BUDGET; None: no budget
+    on_exceed: str
+        'raise' (ModelTooLarge) or 'warn'
+
+    The estimate is kept as `size_estimate`.
+    """
+
+    def __init__(self, energysystem, budget=DEFAULT_BUDGET, on_exceed='raise', **kwargs):
+        if on_exceed not in ('raise', 'warn'):
+            raise ValueError('on_exceed must be "raise" or "warn".')
+        size_estimate = check_budget(energysystem, budget, on_exceed)
+        super().__init__(energysystem, **kwargs)
+        self.size_estimate = size_estimate
@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+"""
+Solve strategies for models containing DSM components (see oemof_DSM.py).
+
+Warm start: a cheap solution of the delay problem - taken from a solved
+potential-method model or from a greedy schedule - is written onto the
+DSMup/DSMdo variables of a delay model and passed to the solver as start
+(MIP start, or primal start for the LP where the solver supports it).
+
+Lazy C2: the C2 rows (Eq. 10) of components with lazy_c2=True are left out
+and only the rows violated by a solution are added, until none is left.
+
+Capacity sweep: the model is built once and solved for scaled DSM
+capacities by updating the right-hand sides of the capacity rows.
+
+Load shifts of the delay method are handled as banded arrays: for a component
+with delay time L the array `band` has the shape (T, 2L+1) and `band[t, L + d]`
+is the energy shifted up in timestep t and compensated in timestep t + d, i.e.
+the value of `DSMdo[g, t, t + d]`.
+"""
+
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from pyomo.environ import value
+from pyomo.opt import SolverFactory
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
+
+import oemof_DSM as oemof_dsm
+from dsm_heuristic import conflict_free_pairs
+
+
+########################################################################
+# ----------------------- Banded schedules -----------------------------
+
+def band_down(band):
+    """Return the downward shift per timestep (DSM_do) of a banded schedule."""
+    n_steps, width = band.shape
+    delay_time = width // 2
+    down = np.zeros(n_steps)
+    for k in range(width):
+        d = k - delay_time
+        t = np.arange(max(0, -d), min(n_steps, n_steps - d))
+        down[t + d] += band[t, k]
+    return down
+
+
+def match_shifts(up, down, delay_time):
+    """Pair upward and downward shifts within the delay time.
+
+    Shifts are matched greedily, shortest distance first. Energy that cannot
+    be compensated within `delay_time` is dropped, hence the returned band is
+    always feasible for the equations 7 - 10 if `up` and `down` are.
+
+    Parameters
+    ----------
+    up: array
+        upward load shift per timestep
+    down: array
+        downward load shift per timestep
+    delay_time: int
+        delay time in timesteps
+
+    Returns
+    -------
+    band: array of shape (T, 2 * delay_time + 1)
+    """
+    up = np.array(up, dtype=np.float64)
+    down = np.array(down, dtype=np.float64)
+    n_steps = len(up)
+    band = np.zeros((n_steps, 2 * delay_time + 1))
+
+    for dist in range(1, delay_time + 1):
+        for d in (-dist, dist):
+            t = np.arange(max(0, -d), min(n_steps, n_steps - d))
+            amount = np.minimum(up[t], down[t + d])
+            band[t, d + delay_time] += amount
+            up[t] -= amount
+            down[t + d] -= amount
+
+    return band
+
+
+def potential_to_delay(dsm_updown, delay_time):
+    """Map the solution `DSMupdown` of the potential method onto a delay band."""
+    dsm_updown = np.asarray(dsm_updown, dtype=np.float64)
+
+    return match_shifts(np.clip(dsm_updown, 0, None), np.clip(-dsm_updown, 0, None), delay_time)
+
+
+def greedy_schedule(residual, c_up, c_do, delay_time, passes=3):
+    """Greedy valley filling of the residual load within the delay time.
+
+    Load is moved from timesteps with a high residual load to timesteps with
+    a lower one as long as the capacity limits (equations 8 - 10) allow it.
+    Pairs of timesteps are shifted vectorised, see
+    :func:`dsm_heuristic.conflict_free_pairs`. Use :func:`dsm_heuristic.dispatch`
+    if the merit order is known.
+
+    Parameters
+    ----------
+    residual: array
+        residual load (demand - fixed feed-in) per timestep
+    c_up: array
+        DSM capacity up per timestep
+    c_do: array
+        DSM capacity down per timestep
+    delay_time: int
+        delay time in timesteps
+    passes: int
+        maximum number of sweeps over all distances
+
+    Returns
+    -------
+    band: array of shape (T, 2 * delay_time + 1)
+    """
+    residual = np.array(residual, dtype=np.float64)
+    n_steps = len(residual)
+    c_up = oemof_dsm.sequence_array(c_up, n_steps)
+    c_do = oemof_dsm.sequence_array(c_do, n_steps)
+    c_max = np.maximum(c_up, c_do)
+
+    band = np.zeros((n_steps, 2 * delay_time + 1))
+    up = np.zeros(n_steps)
+    down = np.zeros(n_steps)
+
+    for _ in range(passes):
+        moved = 0.0
+        for d, t in conflict_free_pairs(n_steps, delay_time):
+            tt = t + d
+
+            free_up = np.minimum(c_up[t] - up[t], c_max[t] - up[t] - down[t])
+            free_do = np.minimum(c_do[tt] - down[tt], c_max[tt] - up[tt] - down[tt])
+            gain = (residual[tt] - residual[t]) / 2
+            amount = np.clip(np.minimum(np.minimum(free_up, free_do), gain), 0, None)
+
+            band[t, d + delay_time] += amount
+            up[t] += amount
+            down[tt] += amount
+            residual[t] += amount
+            residual[tt] -= amount
+            moved += amount.sum()
+
+        if moved <= 0:
+            break
+
+    return band
+
+
+########################################################################
+# ----------------------- Warm start -----------------------------------
+
+def _dsm_block(model, block_type):
+    block = model.component(block_type.__name__)
+    if block is None:
+        raise ValueError('The model contains no {}.'.format(block_type.__name__))
+    return block
+
+
+def residual_load(model, g):
+    """Demand of DSM component `g` minus the fixed feed-in at its bus."""
+    residual = g.demand_array.copy()
+
+    for flow in g.inflow.inputs.values():
+        if flow.fixed:
+            residual -= flow.nominal_value * oemof_dsm.sequence_array(flow.actual_value, len(residual))
+
+    return residual
+
+
+def greedy_start(model):
+    """Greedy bands for all delay components of the (built) `model`."""
+    block = _dsm_block(model, oemof_dsm.SinkDsmDelayBlock)
+
+    return {g.label: greedy_schedule(residual_load(model, g), g.c_up_array, g.c_do_array, g.delay_time)
+            for g in block.DSM}
+
+
+def potential_start(potential_model, delay_model):
+    """Bands for `delay_model` from the solved `potential_model`.
+
+    Both models must contain the same DSM components (matched by label).
+    """
+    potential = _dsm_block(potential_model, oemof_dsm.SinkDsmPotentialBlock)
+    delay = _dsm_block(delay_model, oemof_dsm.SinkDsmDelayBlock)
+    delay_times = {g.label: g.delay_time for g in delay.DSM}
+
+    bands = {}
+    for g in potential.DSM:
+        if g.label in delay_times:
+            updown = [potential.DSMupdown[g, t].value if (g, t) in potential.DSMupdown else 0
+                      for t in potential_model.TIMESTEPS]
+            bands[g.label] = potential_to_delay(updown, delay_times[g.label])
+
+    return bands
+
+
+def set_initial_values(model, bands):
+    """Write banded schedules onto DSMup, DSMdo and the DSM inflow of `model`.
+
+    Parameters
+    ----------
+    model: solph.Model
+        built model containing a SinkDsmDelayBlock
+    bands: dict
+        label of the DSM component -> band, see module docstring
+    """
+    block = _dsm_block(model, oemof_dsm.SinkDsmDelayBlock)
+    n_steps = len(model.TIMESTEPS)
+
+    for g in block.DSM:
+        band = bands.get(g.label)
+        if band is None:
+            continue
+        if band.shape != (n_steps, 2 * g.delay_time + 1):
+            raise ValueError('Band of "{}" has shape {}, expected {}.'.format(
+                g.label, band.shape, (n_steps, 2 * g.delay_time + 1)))
+
+        # shifts on variables removed by the presolve are dropped
+        for t in model.TIMESTEPS:
+            for tt in block.do_out[g][t]:
+                block.DSMdo[g, t, tt].value = float(band[t, tt - t + g.delay_time])
+            if (g, t) in block.DSMup:
+                block.DSMup[g, t].value = sum(block.DSMdo[g, t, tt].value for tt in block.do_out[g][t])
+
+        for t in model.TIMESTEPS:
+            shift = value(block._dsm_up(g, t) - block._dsm_do(g, t))
+            model.flow[g.inflow, g, t].value = float(g.demand_array[t]) + shift
+
+
+def get_bands(model):
+    """Banded schedules of all delay components of the solved `model` (label -> band)."""
+    block = _dsm_block(model, oemof_dsm.SinkDsmDelayBlock)
+    n_steps = len(model.TIMESTEPS)
+
+    bands = {}
+    for g in block.DSM:
+        band = np.zeros((n_steps, 2 * g.delay_time + 1))
+        for t in model.TIMESTEPS:
+            for tt in block.do_out[g][t]:
+                band[t, tt - t + g.delay_time] = block.DSMdo[g, t, tt].value or 0
+        bands[g.label] = band
+
+    return bands
+
+
+def _start_vars(model):
+    block = _dsm_block(model, oemof_dsm.SinkDsmDelayBlock)
+    for var in (block.DSMup, block.DSMdo):
+        for v in var.values():
+            yield v
+    for g in block.DSM:
+        for t in model.TIMESTEPS:
+            yield model.flow[g.inflow, g, t]
+
+
+def _persistent_solve(opt, model, solve_kwargs):
+    """Reoptimize the instance of a persistent solver and store the results like Model.solve"""
+    results = opt.solve(**solve_kwargs)
+    model.es.results = results
+    model.solver_results = results
+    return results
+
+
+def solve(model, solver='cbc', warmstart=False, solve_kwargs=None):
+    """Solve `model` and return the wall time of the solve in seconds.
+
+    With `warmstart=True` the current variable values are handed to the
+    solver. Persistent solvers with variable attributes (gurobi_persistent)
+    receive them as primal start (PStart) which is used as LP crash basis,
+    all other solvers as MIP start if they support warm starts. Note that CBC
+    only uses MIP starts, so pure LPs will not profit from it.
+    """
+    solve_kwargs = dict({'tee': False}, **(solve_kwargs or {}))
+
+    opt = SolverFactory(solver)
+    start = time.perf_counter()
+
+    if isinstance(opt, PersistentSolver):
+        opt.set_instance(model)
+        if warmstart and hasattr(opt, 'set_var_attr'):
+            for var in _start_vars(model):
+                if var.value is not None:
+                    opt.set_var_attr(var, 'PStart', var.value)
+        elif warmstart:
+            solve_kwargs['warmstart'] = True
+        _persistent_solve(opt, model, solve_kwargs)
+    else:
+        if warmstart and opt.warm_start_capable():
+            solve_kwargs['warmstart'] = True
+        model.solve(solver=solver, solve_kwargs=solve_kwargs)
+
+    return time.perf_counter() - start
+
+
+def compare_warm_start(build, start, solver='cbc', solve_kwargs=None):
+    """Report the speedup of a warm started solve against a cold start.
+
+    Parameters
+    ----------
+    build: callable
+        returns a new, unsolved delay model, e.g.
+        `lambda: oemof_dsm_test.build_model(data, datetimeindex)`
+    start: callable
+        takes the built model and returns the bands, e.g. `greedy_start` or
+        `lambda m: potential_start(potential_model, m)`
+    solver: str
+        solver name for pyomo's SolverFactory
+    solve_kwargs: dict
+        passed to the solver
+
+    Returns
+    -------
+    pandas.Series
+        wall times, speedup (cold time / (start time + warm time)) and the
+        objective values of both solves
+    """
+    cold = build()
+    cold_time = solve(cold, solver=solver, solve_kwargs=solve_kwargs)
+
+    warm = build()
+    t0 = time.perf_counter()
+    set_initial_values(warm, start(warm))
+    start_time = time.perf_counter() - t0
+    warm_time = solve(warm, solver=solver, warmstart=True, solve_kwargs=solve_kwargs)
+
+    return pd.Series({'cold_time': cold_time,
+                      'start_time': start_time,
+                      'warm_time': warm_time,
+                      'speedup': cold_time / (start_time + warm_time),
+                      'cold_objective': cold.objective(),
+                      'warm_objective': warm.objective()})
+
+
+########################################################################
+# ----------------------- Lazy C2 rows ---------------------------------
+
+def solve_lazy_c2(model, solver='cbc', tol=1e-6, max_rounds=50, solve_kwargs=None):
+    """Cutting-plane loop over the C2 rows (Eq. 10) of components with lazy_c2=True.
+
+    The model is solved without (or with the already added) C2 rows, the
+    violated rows are added and the model is solved again until no row is
+    violated. A persistent solver (e.g. 'gurobi_persistent') keeps its
+    instance and only receives the new rows, so each round reoptimizes from
+    the previous basis. Other solvers reuse the built model, but solve from
+    scratch in each round.
+
+    Parameters
+    ----------
+    model: solph.Model
+        built model containing a SinkDsmDelayBlock
+    solver: str
+        solver name
+    tol: float
+        violations below `tol` are accepted
+    max_rounds: int
+        maximum number of solves
+    solve_kwargs: dict
+        passed to the solver
+
+    Returns
+    -------
+    pandas.DataFrame
+        solve time, objective and number of added rows per round
+    """
+    block = _dsm_block(model, oemof_dsm.SinkDsmDelayBlock)
+    solve_kwargs = dict({'tee': False}, **(solve_kwargs or {}))
+
+    opt = SolverFactory(solver)
+    persistent = isinstance(opt, PersistentSolver)
+    if persistent:
+        opt.set_instance(model)
+
+    rounds = []
+    for i in range(max_rounds):
+        start = time.perf_counter()
+        if persistent:
+            _persistent_solve(opt, model, solve_kwargs)
+        else:
+            model.solve(solver=solver, solve_kwargs=solve_kwargs)
+        solve_time = time.perf_counter() - start
+
+        added = block.add_violated_c2(tol)
+        if persistent:
+            for con in added:
+                opt.add_constraint(con)
+
+        rounds.append({'round': i,
+                       'solve_time': solve_time,
+                       'objective': model.objective(),
+                       'added_rows': len(added),
+                       'C2_rows': len(block.C2_constraint)})
+        if not added:
+            break
+    else:
+        raise RuntimeError('C2 rows still violated after {} rounds.'.format(max_rounds))
+
+    return pd.DataFrame(rounds).set_index('round')
+
+
+########################################################################
+# ----------------------- Capacity sweep -------------------------------
+
+def _capacity_rows(model):
+    """Capacity rows (Eq. 8, 9, 10) of the delay block with their unscaled right-hand side"""
+    block = model.component(oemof_dsm.SinkDsmDelayBlock.__name__)
+    if block is None:
+        return
+    for constraint, name in ((block.dsmup_constraint, 'c_up_array'),
+                             (block.dsmdo_constraint, 'c_do_array'),
+                             (block.C2_constraint, 'c_max_array')):
+        for (g, t), con in constraint.items():
+            yield con, getattr(g, name)[t]
+
+
+def _capacity_bounds(model):
+    """DSMupdown variables of the potential block with their unscaled bounds"""
+    block = model.component(oemof_dsm.SinkDsmPotentialBlock.__name__)
+    if block is None:
+        return
+    for (g, t), var in block.DSMupdown.items():
+        yield var, -g.c_do_array[t], g.c_up_array[t]
+
+
+def _shifted_energy(model):
+    """Sum of all upward load shifts of the solved `model`"""
+    energy = 0.0
+    block = model.component(oemof_dsm.SinkDsmDelayBlock.__name__)
+    if block is not None:
+        energy += sum(var.value or 0 for var in block.DSMup.values())
+    block = model.component(oemof_dsm.SinkDsmPotentialBlock.__name__)
+    if block is not None:
+        energy += sum(max(var.value or 0, 0) for var in block.DSMupdown.values())
+    return energy
+
+
+def capacity_sweep(model, factors, solver='cbc', solve_kwargs=None, collect=None, warmstart=True):
+    """Solve `model` for scaled DSM capacities without rebuilding it.
+
+    The right-hand sides of Eq. 8 - 10 (delay) and the bounds of DSMupdown
+    (potential) are set to factor * capacity of the SinkDsm components.
+    With a persistent solver the instance is kept and only the changed
+    right-hand sides and bounds are passed on, so every point is reoptimized
+    from the basis of the previous one (for gurobi_persistent e.g. with dual
+    simplex: `solve_kwargs={'options': {'Method': 1}}`). Other solvers reuse
+    the built model and, with `warmstart=True`, get the solution of the
+    previous point as warm start if they support one (e.g. cbc, glpk,
+    gurobi, cplex shell solvers). CBC only uses it as MIP start, so the
+    points of a pure LP are still solved from scratch. Solvers without warm
+    start solve every point from scratch, with a warning.
+
+    Timesteps with a capacity of zero were removed by the presolve and stay
+    without load shift for all factors.
+
+    Parameters
+    ----------
+    model: solph.Model
+        built model with DSM components
+    factors: sequence of float
+        capacity factors, e.g. `[0.5, 1, 2, 10, 100]`
+    solver: str
+        solver name
+    solve_kwargs: dict
+        passed to the solver
+    collect: callable
+        collect(model) returns a dict of additional values per point, e.g.
+        `lambda m: {'price': dsm_duals.bus_prices(m).mean().iloc[0]}`
+    warmstart: bool
+        start each point of a non-persistent solver from the solution of
+        the previous one
+
+    Returns
+    -------
+    pandas.DataFrame
+        update time, solve time, objective and shifted energy per factor,
+        and whether the point was warm started
+    """
+    solve_kwargs = dict({'tee': False}, **(solve_kwargs or {}))
+    rows = list(_capacity_rows(model))
+    bounds = list(_capacity_bounds(model))
+
+    opt = SolverFactory(solver)
+    persistent = isinstance(opt, PersistentSolver)
+    if persistent:
+        opt.set_instance(model)
+    elif warmstart and not opt.warm_start_capable():
+        warnings.warn('Solver "{}" is not persistent and supports no warm start, every point of the sweep is '
+                      'solved from scratch.'.format(solver))
+        warmstart = False
+
+    points = []
+    for i, factor in enumerate(factors):
+        start = time.perf_counter()
+        for con, rhs in rows:
+            if persistent and not hasattr(opt, 'set_linear_constraint_attr'):
+                opt.remove_constraint(con)
+            con.set_value((None, con.body, factor * rhs))
+            if persistent and hasattr(opt, 'set_linear_constraint_attr'):
+                opt.set_linear_constraint_attr(con, 'RHS', factor * rhs)
+            elif persistent:
+                opt.add_constraint(con)
+        for var, lb, ub in bounds:
+            var.setlb(factor * lb)
+            var.setub(factor * ub)
+            if persistent:
+                opt.update_var(var)
+        update_time = time.perf_counter() - start
+
+        # previous solution as start, from the second point on
+        warm = persistent or (warmstart and i > 0)
+        start = time.perf_counter()
+        if persistent:
+            _persistent_solve(opt, model, solve_kwargs)
+        else:
+            model.solve(solver=solver, solve_kwargs=dict(solve_kwargs, warmstart=True) if warm else solve_kwargs)
+        solve_time = time.perf_counter() - start
+
+        # recorded with the results, see dsm_store.model_params
+        model.capacity_scale = factor
+        point = {'factor': factor,
+                 'update_time': update_time,
+                 'solve_time': solve_time,
+                 'warm_start': warm,
+                 'objective': model.objective(),
+                 'shifted_energy': _shifted_energy(model)}
+        if collect is not None:
+            point.update(collect(model))
+        points.append(point)
+
+    return pd.DataFrame(points).set_index('factor')
+
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Live progress events from the CBC log.
+
+Pyomo keeps the output of a shell solver in memory and writes the log file
+only after the solver has exited. solve_with_progress therefore starts the
+solver process itself (in place of the Pyomo plugin's _execute_command, so
+Pyomo still writes the problem and reads the solution) and parses stdout
+line by line while CBC runs. Known CBC/CLP lines become events (dicts) with
+the seconds since the start of the solve:
+
+    presolve    rows, columns, elements and the number removed of each
+    iteration   simplex iteration, objective, primal / dual infeasibility
+    solution    integer solution found (objective)
+    progress    nodes, best solution, best possible bound and gap
+    result      status and objective, iterations and solver time
+    time        total CPU and wall clock seconds
+    exit        the solver process ended (return code), always the last event
+
+Each event is passed to `callback` and/or appended to a JSONL file as soon
+as its line appears. The events of a solve are returned and attached to
+es.results['meta']['solver_progress'] by oemof_dsm_test.create_model.
+
+    events = solve_with_progress(model, callback=print, jsonl='progress.jsonl')
+    print(phase_timings(events))
+"""
+
+import json
+import re
+import subprocess
+import sys
+import threading
+import time
+import warnings
+
+import pandas as pd
+
+from pyomo.opt import SolverFactory
+
+
+_NUMBER = r'([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)'
+_PREFIX = r'^(?:\w{3,4}\d{4}[IWE]\s+)?'
+
+PATTERNS = [
+    ('presolve', re.compile(_PREFIX + r'Presolve (\d+) \((-?\d+)\) rows, (\d+) \((-?\d+)\) columns'
+                            r' and (\d+) \((-?\d+)\) elements'),
+     ('rows', 'rows_removed', 'columns', 'columns_removed', 'elements', 'elements_removed')),
+    ('iteration', re.compile(_PREFIX + r'(\d+)\s+Obj\s+' + _NUMBER + r'(?:\s+Primal inf\s+' + _NUMBER
+                             + r'\s+\((\d+)\))?(?:\s+Dual inf\s+' + _NUMBER + r'\s+\((\d+)\))?'),
+     ('iteration', 'objective', 'primal_inf', 'primal_inf_count', 'dual_inf', 'dual_inf_count')),
+    ('solution', re.compile(_PREFIX + r'Integer solution of ' + _NUMBER + r' found'),
+     ('objective',)),
+    ('progress', re.compile(_PREFIX + r'After (\d+) nodes, (\d+) on tree, ' + _NUMBER + r' best solution,'
+                            r' best possible ' + _NUMBER),
+     ('nodes', 'open_nodes', 'best_solution', 'best_bound')),
+    ('result', re.compile(_PREFIX + r'(\w[\w ]*?) objective ' + _NUMBER + r' - (\d+) iterations time '
+                          + _NUMBER),
+     ('status', 'objective', 'iterations', 'solver_time')),
+    ('result', re.compile(_PREFIX + r'(\w[\w ]*?) - objective value ' + _NUMBER),
+     ('status', 'objective')),
+    ('time', re.compile(r'Total time \(CPU seconds\):\s+' + _NUMBER + r'\s+\(Wallclock seconds\):\s+' + _NUMBER),
+     ('cpu_time', 'wall_time')),
+]
+
+
+def _convert(text):
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+def parse_line(line):
+    """Event (dict) of a CBC log line or None"""
+    line = line.strip()
+    for kind, pattern, fields in PATTERNS:
+        match = pattern.search(line)
+        if match:
+            event = {'event': kind}
+            event.update({f: _convert(v) for f, v in zip(fields, match.groups()) if v is not None})
+            if kind == 'presolve':
+                # CBC reports the change, e.g. (-56)
+                for field in ('rows_removed', 'columns_removed', 'elements_removed'):
+                    event[field] = -event[field]
+            if kind == 'progress' and event['best_solution'] != 0:
+                event['gap'] = abs(event['best_solution'] - event['best_bound']) / abs(event['best_solution'])
+            return event
+    return None
+
+
+def _streaming_execute(opt, emit):
+    """Replacement of opt._execute_command which emits the events of each output line as it appears"""
+
+    def execute(command):
+        start = time.perf_counter()
+        log = []
+        process = subprocess.Popen(command.cmd, stdin=subprocess.PIPE if 'script' in command else None,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=command.env,
+                                   cwd=command.cwd if 'cwd' in command else None, universal_newlines=True,
+                                   bufsize=1)
+        timer = None
+        if getattr(opt, '_timelimit', None):
+            timer = threading.Timer(opt._timelimit + 5, process.kill)
+            timer.start()
+        try:
+            if 'script' in command:
+                process.stdin.write(command.script)
+                process.stdin.close()
+            for line in process.stdout:
+                log.append(line)
+                if opt._tee:
+                    sys.stdout.write(line)
+                event = parse_line(line)
+                if event is not None:
+                    event['time'] = time.perf_counter() - start
+                    emit(event)
+            rc = process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+        emit({'event': 'exit', 'returncode': rc, 'time': time.perf_counter() - start})
+        opt._last_solve_time = time.perf_counter() - start
+        return [rc, ''.join(log)]
+
+    return execute
+
+
+def arrived_live(events, tol=0.05):
+    """True if the events were emitted while the solver ran, not in one burst at its exit.
+
+    Needs at least one parsed event before the 'exit' event; a solve shorter
+    than `tol` seconds counts as live.
+    """
+    exits = [e['time'] for e in events if e['event'] == 'exit']
+    times = [e['time'] for e in events if e['event'] != 'exit']
+    if not exits or not times:
+        return False
+    return exits[-1] < tol or min(times) < exits[-1] - tol
+
+
+def solve_with_progress(model, solver='cbc', callback=None, jsonl=None, logfile=None, solve_kwargs=None,
+                        cmdline_options=None):
+    """Solve `model` and turn the solver output into progress events while it runs.
+
+    Solves like solph.Model.solve (LP file, results in model.es.results and
+    model.solver_results, a warning if the solve is not optimal), with a
+    shell solver plugin of Pyomo whose process is read line by line.
+
+    Parameters
+    ----------
+    model: solph.Model
+        built model
+    solver: str
+        solver name (the patterns match CBC/CLP output)
+    callback: callable
+        called with each event (dict)
+    jsonl: str
+        file the events are appended to, one JSON object per line
+    logfile: str
+        keep the solver log in this file (written after the solve)
+    solve_kwargs: dict
+        passed to the solver
+    cmdline_options: dict
+        command line options of the solver
+
+    Returns
+    -------
+    list of dict
+        all events of the solve, also stored as `model.solver_progress`
+    """
+    solve_kwargs = dict({'tee': False}, **(solve_kwargs or {}))
+    if logfile is not None:
+        solve_kwargs['logfile'] = logfile
+
+    opt = SolverFactory(solver, solver_io='lp')
+    if not hasattr(opt, '_execute_command'):
+        raise ValueError('Solver "{}" is no shell solver, its output cannot be read.'.format(solver))
+    for key, option in (cmdline_options or {}).items():
+        opt.options[key] = option
+
+    events = []
+    out = open(jsonl, 'a') if jsonl is not None else None
+
+    def emit(event):
+        events.append(event)
+        if out is not None:
+            out.write(json.dumps(event) + '\n')
+            out.flush()
+        if callback is not None:
+            callback(event)
+
+    # instance attribute, other solves are not affected
+    opt._execute_command = _streaming_execute(opt, emit)
+    try:
+        results = opt.solve(model, **solve_kwargs)
+    finally:
+        if out is not None:
+            out.close()
+
+    status = results['Solver'][0]['Status']
+    termination_condition = results['Solver'][0]['Termination condition']
+    if status != 'ok' or termination_condition != 'optimal':
+        warnings.warn('Optimization ended with status {0} and termination condition {1}'.format(
+            status, termination_condition), UserWarning)
+    model.es.results = results
+    model.solver_results = results
+
+    if len(events) > 1 and not arrived_live(events):
+        warnings.warn('The solver output arrived in one burst when the solver exited, the progress events '
+                      'were not live (is the output of "{}" buffered?).'.format(solver))
+    model.solver_progress = events
+    return events
+
+
+def phase_timings(events):
+    """Seconds spent until presolve, in the simplex / branch and bound phase and in total"""
+    df = pd.DataFrame(events)
+    if df.empty:
+        return pd.Series(dtype=float)
+
+    end = df['time'].max()
+    presolve = df.loc[df['event'] == 'presolve', 'time'].min() if (df['event'] == 'presolve').any() else 0.0
+    timings = {'presolve': presolve, 'optimisation': end - presolve, 'total': end}
+    if (df['event'] == 'time').any():
+        timings['solver_wall_time'] = df.loc[df['event'] == 'time', 'wall_time'].iloc[-1]
+    return pd.Series(timings)
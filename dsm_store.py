@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed columnar results store (Parquet) for solved DSM models.
+
+Replaces pickling the whole energy system with es.dump. Results are saved
+per scenario and component:
+
+    <root>/<scenario>/metadata.json              parameters, objective, meta results,
+                                                 scalars, solver progress, audit, file index
+    <root>/<scenario>/<component>.parquet        sequences of the component (timestamp + columns)
+    <root>/<scenario>/<component>.shifts.parquet sparse shift matrix (t, tt, value) of delay DSM
+
+A component holds the flows between it and the buses and its own
+variables, the columns are named 'wind->bus_elec:flow' or
+'demand_dsm:DSMup' (no dots, pyarrow reads them as nested fields). The
+T x T DSMdo columns are not stored, DSMdo is kept as sparse shift matrix
+(see dsm_results). The parameters are the ones the model was built with
+(see model_params), plus any given by the caller. Readers load only the
+columns and time ranges they need:
+
+    store = ResultStore('results')
+    store.save(model, 'delay_2H', params={'aggregation': 'raw'})
+    df = store.load('delay_2H', 'demand_dsm', columns=['bus_elec->demand_dsm:flow'],
+                    start='2013-06-01', end='2013-07-01')
+
+Parquet needs pyarrow (or fastparquet for reading without filters).
+"""
+
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from oemof import solph, outputlib
+
+import oemof_DSM as oemof_dsm
+import dsm_results
+
+
+FORMAT_VERSION = 1
+
+
+def _safe(name):
+    """File name of a scenario or component label"""
+    return re.sub(r'[^\w.=-]', '_', str(name))
+
+
+def _component(key):
+    """Component of a results key: the node which is not a bus"""
+    a, b = key
+    if b is None or isinstance(b, solph.Bus):
+        return a
+    return b
+
+
+def _column(key, variable):
+    a, b = key
+    if b is None:
+        return '{}:{}'.format(a, variable)
+    return '{}->{}:{}'.format(a, b, variable)
+
+
+def _jsonable(obj):
+    """Meta results and scalars of solph contain numpy types and pyomo objects"""
+    if isinstance(obj, dict):
+        return {str(k): _jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_jsonable(v) for v in obj]
+    if isinstance(obj, (np.integer, np.floating)):
+        return obj.item()
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    return str(obj)
+
+
+def model_params(model):
+    """Effective DSM parameters of `model`: SinkDsm.parameters() and the capacity scale.
+
+    With several SinkDsm components the names are prefixed with the label,
+    e.g. 'demand_dsm:delay_time'. The capacity scale is the factor last set
+    by dsm_solve.capacity_sweep (1 if the capacities were not scaled).
+    """
+    components = [g for g in model.es.nodes if isinstance(g, oemof_dsm.SinkDsm)]
+    params = {}
+    for g in components:
+        for name, value in g.parameters().items():
+            params[name if len(components) == 1 else '{}:{}'.format(g.label, name)] = value
+    if components:
+        params['capacity_scale'] = float(getattr(model, 'capacity_scale', 1.0))
+    return params
+
+
+class ResultStore:
+    """Parquet store of solved scenarios below `root`
+
+    Parameters
+    ----------
+    root: str
+        directory of the store
+    compression: str
+        Parquet compression codec ('zstd', 'snappy', 'gzip', ...)
+    row_group_size: int
+        timesteps per row group, the unit read when filtering by time
+    """
+
+    def __init__(self, root, compression='zstd', row_group_size=24 * 7):
+        self.root = root
+        self.compression = compression
+        self.row_group_size = row_group_size
+
+    def path(self, scenario, component=None, suffix='.parquet'):
+        directory = os.path.join(self.root, _safe(scenario))
+        if component is None:
+            return directory
+        return os.path.join(directory, _safe(component) + suffix)
+
+    # ----------------------- Writing ----------------------------------
+
+    def save(self, model, scenario, params=None, overwrite=True):
+        """Save the results of the solved `model` as `scenario`.
+
+        Uses model.es.results['main'] (and 'meta', 'dsm_shifts' if present),
+        results are processed if they are missing. The stored parameters
+        are model_params(model) updated with `params`.
+
+        Returns
+        -------
+        str
+            directory of the scenario
+        """
+        results = model.es.results
+        main = results['main'] if 'main' in results else outputlib.processing.results(model)
+        directory = self.path(scenario)
+        if os.path.exists(directory):
+            if not overwrite:
+                raise FileExistsError('Scenario "{}" exists in {}.'.format(scenario, self.root))
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+
+        columns = {}
+        scalars = {}
+        for key, value in main.items():
+            component = str(_component(key))
+            sequences = value.get('sequences')
+            if sequences is not None and not sequences.empty:
+                for variable in sequences.columns:
+                    if 'DSMdo' in str(variable):
+                        # stored as sparse shift matrix
+                        continue
+                    columns.setdefault(component, {})[_column(key, variable)] = sequences[variable]
+            if value.get('scalars') is not None and not value['scalars'].empty:
+                for variable, scalar in value['scalars'].items():
+                    scalars[_column(key, variable)] = scalar
+
+        files = {}
+        for component, series in columns.items():
+            df = pd.DataFrame(series)
+            df.index.name = 'timestamp'
+            df.reset_index().to_parquet(self.path(scenario, component), index=False,
+                                        compression=self.compression, row_group_size=self.row_group_size)
+            files[component] = {'file': os.path.basename(self.path(scenario, component)),
+                                'columns': list(df.columns)}
+
+        shifts = results['dsm_shifts'] if 'dsm_shifts' in results else dsm_results.shift_matrices(model)
+        shift_files = {}
+        for label, matrix in shifts.items():
+            filename = self.path(scenario, label, '.shifts.parquet')
+            pd.DataFrame({'t': matrix.t, 'tt': matrix.tt, 'value': matrix.value}).to_parquet(
+                filename, index=False, compression=self.compression)
+            shift_files[label] = {'file': os.path.basename(filename), 'n_steps': matrix.n_steps,
+                                  'delay_time': matrix.delay_time}
+
+        timeindex = model.es.timeindex[:len(model.TIMESTEPS)]
+        freq = str(oemof_dsm.timestep_length(timeindex)) if len(timeindex) > 1 else None
+        metadata = {'format_version': FORMAT_VERSION,
+                    'scenario': scenario,
+                    'params': _jsonable(dict(model_params(model), **(params or {}))),
+                    'objective': model.objective(),
+                    'timeindex': {'start': str(timeindex[0]), 'periods': len(timeindex), 'freq': freq},
+                    'components': files,
+                    'shifts': shift_files,
+                    'scalars': _jsonable(scalars),
+                    'meta': _jsonable(results['meta']) if 'meta' in results else {}}
+        if 'audit' in results:
+            # violations found by dsm_audit
+            metadata['audit'] = _jsonable(results['audit'].to_dict('records'))
+        with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+        return directory
+
+    def save_frame(self, scenario, component, df, params=None, objective=None, overwrite=True):
+        """Save the sequences `df` (timestamp index) as the only component of `scenario`.
+
+        For results which are no solved model, e.g. imported CSV dumps.
+        """
+        directory = self.path(scenario)
+        if os.path.exists(directory):
+            if not overwrite:
+                raise FileExistsError('Scenario "{}" exists in {}.'.format(scenario, self.root))
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+
+        df = df.copy()
+        df.columns = [str(c) for c in df.columns]
+        df.index.name = 'timestamp'
+        df.reset_index().to_parquet(self.path(scenario, component), index=False,
+                                    compression=self.compression, row_group_size=self.row_group_size)
+
+        timeindex = df.index
+        freq = str(oemof_dsm.timestep_length(timeindex)) if len(timeindex) > 1 else None
+        metadata = {'format_version': FORMAT_VERSION,
+                    'scenario': scenario,
+                    'params': _jsonable(params or {}),
+                    'objective': objective,
+                    'timeindex': {'start': str(timeindex[0]), 'periods': len(timeindex), 'freq': freq},
+                    'components': {component: {'file': os.path.basename(self.path(scenario, component)),
+                                               'columns': list(df.columns)}},
+                    'shifts': {},
+                    'scalars': {},
+                    'meta': {}}
+        with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+        return directory
+
+    # ----------------------- Reading ----------------------------------
+
+    def scenarios(self):
+        """Names of the stored scenarios"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(self.metadata(d)['scenario'] for d in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, d, 'metadata.json')))
+
+    def metadata(self, scenario):
+        """Metadata of `scenario` (dict)"""
+        with open(os.path.join(self.path(scenario), 'metadata.json')) as f:
+            return json.load(f)
+
+    def timeindex(self, scenario):
+        """Timeindex of `scenario`"""
+        info = self.metadata(scenario)['timeindex']
+        freq = pd.Timedelta(info['freq']) if info['freq'] else None
+        return pd.date_range(info['start'], periods=info['periods'], freq=freq)
+
+    def load(self, scenario, component, columns=None, start=None, end=None):
+        """Sequences of one component, reading only `columns` and the timesteps in [start, end)
+
+        Returns
+        -------
+        pandas.DataFrame
+            index timestamp, one column per variable
+        """
+        filters = []
+        if start is not None:
+            filters.append(('timestamp', '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append(('timestamp', '<', pd.Timestamp(end)))
+
+        df = pd.read_parquet(self.path(scenario, component),
+                             columns=None if columns is None else ['timestamp'] + list(columns),
+                             filters=filters or None)
+        return df.set_index('timestamp')
+
+    def shifts(self, scenario, label):
+        """Shift matrix (dsm_results.ShiftMatrix) of a delay component"""
+        info = self.metadata(scenario)['shifts'][label]
+        df = pd.read_parquet(self.path(scenario, label, '.shifts.parquet'))
+        return dsm_results.ShiftMatrix(df['t'].values, df['tt'].values, df['value'].values, info['n_steps'],
+                                       info['delay_time'], label, self.timeindex(scenario))
+
+    def disk_usage(self, scenario=None):
+        """Bytes on disk of one scenario or the whole store"""
+        directory = self.root if scenario is None else self.path(scenario)
+        return sum(os.path.getsize(os.path.join(path, name))
+                   for path, _, names in os.walk(directory) for name in names)
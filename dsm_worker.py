@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived worker that runs DSM scenario jobs from a queue directory.
+
+oemof, pyomo, pandas and matplotlib are imported once when the worker
+starts, input data is cached between jobs, so a job only costs build and
+solve time. Jobs are JSON files in `<queue>/incoming`, e.g.::
+
+    {"data": "/abs/path/recovery.csv", "timesteps": 58, "freq": "H",
+     "dsm": {"delay_time": "3H"}, "plot": false}
+
+Keys: data (CSV as read by oemof_dsm_test.read_data), timesteps (default:
+all), freq and start of the timestamps, dsm (keyword arguments of
+SinkDsm), plot (extract results and plot into the result directory) and
+directory (result directory, default `<queue>/results/<job>`).
+
+A job is moved to `running` while it runs. When it finishes, a result
+file is written to `done/<job>.json` (paths of the LP file, the results
+(dsm_store, scenario 'results') and the solver progress events, objective,
+timings), or to `failed/<job>.json` with the traceback.
+
+Start the worker and submit jobs::
+
+    python dsm_worker.py serve queue
+    python dsm_worker.py submit queue job.json
+"""
+
+import argparse
+import json
+import os
+import signal
+import time
+import traceback
+import uuid
+
+import pandas as pd
+
+import oemof_dsm_test
+import plot_dsm as pltdsm
+
+
+QUEUE_FOLDERS = ('incoming', 'running', 'done', 'failed', 'results')
+
+
+def _write_json(filename, content):
+    """Write atomically, i.e. readers never see a partial file"""
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(content, f, indent=2, default=str)
+    os.replace(tmp, filename)
+
+
+def make_queue(queue):
+    """Create the folders of a queue directory"""
+    for folder in QUEUE_FOLDERS:
+        os.makedirs(os.path.join(queue, folder), exist_ok=True)
+
+
+########################################################################
+# ----------------------- Worker ---------------------------------------
+
+class Worker:
+    """Runs the jobs of a queue directory one after the other.
+
+    Parameters
+    ----------
+    queue: str
+        queue directory (created if missing)
+    poll: float
+        seconds between two scans of the incoming folder
+    plotting: bool
+        import matplotlib at the start (plot_dsm only imports it when
+        plotting), set to False for solve-only workers
+    """
+
+    def __init__(self, queue, poll=0.2, plotting=True):
+        self.queue = queue
+        self.poll = poll
+        self.stopped = False
+        self._data = {}
+        make_queue(queue)
+        if plotting:
+            pltdsm._pyplot()
+
+    def stop(self, *args):
+        """Finish the current job and stop"""
+        self.stopped = True
+
+    def read_data(self, filename, freq='H', start='1/1/2013'):
+        """Input data, cached as long as the file does not change"""
+        key = (os.path.abspath(filename), os.path.getmtime(filename), freq, start)
+        if key not in self._data:
+            self._data[key] = oemof_dsm_test.read_data(filename, freq=freq, start=start)
+        return self._data[key]
+
+    def next_job(self):
+        """Claim the oldest incoming job, return its id or None"""
+        incoming = os.path.join(self.queue, 'incoming')
+        jobs = []
+        for name in os.listdir(incoming):
+            if name.endswith('.json'):
+                try:
+                    jobs.append((os.path.getmtime(os.path.join(incoming, name)), name))
+                except OSError:
+                    # claimed by another worker in the meantime
+                    continue
+
+        for _, name in sorted(jobs):
+            try:
+                # rename is atomic, so the job is claimed by one worker only
+                os.rename(os.path.join(incoming, name), os.path.join(self.queue, 'running', name))
+            except OSError:
+                continue
+            return name[:-len('.json')]
+        return None
+
+    def run_job(self, job_id, job):
+        """Build, solve and save one job, return the result description"""
+        start = time.perf_counter()
+        directory = os.path.abspath(job.get('directory') or os.path.join(self.queue, 'results', job_id))
+        os.makedirs(directory, exist_ok=True)
+
+        freq = job.get('freq', 'H')
+        data = self.read_data(job['data'], freq=freq, start=job.get('start', '1/1/2013'))
+        timesteps = job.get('timesteps') or len(data)
+        datetimeindex = data.index[:timesteps]
+        load_time = time.perf_counter() - start
+
+        model = oemof_dsm_test.create_model(data, datetimeindex, directory, store=directory, scenario='results',
+                                            progress_file=os.path.join(directory, 'solver_progress.jsonl'),
+                                            **job.get('dsm', {}))
+        model_time = time.perf_counter() - start - load_time
+
+        result = {'job': job_id,
+                  'status': 'done',
+                  'directory': directory,
+                  'lp': os.path.join(directory, 'abw_dsm_test.lp'),
+                  'store': os.path.join(directory, 'results'),
+                  'progress': os.path.join(directory, 'solver_progress.jsonl'),
+                  'objective': model.objective(),
+                  'violations': len(model.es.results['audit'])}
+
+        if job.get('plot'):
+            os.makedirs(os.path.join(directory, 'Grafiken'), exist_ok=True)
+            df_gesamt = pltdsm.extract_results(model, data, datetimeindex, directory + '/')
+            pltdsm.plot(df_gesamt, datetimeindex, directory + '/', timesteps, job_id)
+            result['plots'] = os.path.join(directory, 'Grafiken')
+
+        result['time'] = {'load': load_time, 'build_solve': model_time, 'total': time.perf_counter() - start}
+        return result
+
+    def serve(self, max_jobs=None):
+        """Run jobs until stopped (SIGINT/SIGTERM) or `max_jobs` are done"""
+        done = 0
+        while not self.stopped and (max_jobs is None or done < max_jobs):
+            job_id = self.next_job()
+            if job_id is None:
+                time.sleep(self.poll)
+                continue
+
+            running = os.path.join(self.queue, 'running', job_id + '.json')
+            try:
+                with open(running) as f:
+                    job = json.load(f)
+                result = self.run_job(job_id, job)
+                _write_json(os.path.join(self.queue, 'done', job_id + '.json'), result)
+            except Exception:
+                _write_json(os.path.join(self.queue, 'failed', job_id + '.json'),
+                            {'job': job_id, 'status': 'failed', 'traceback': traceback.format_exc()})
+            os.remove(running)
+            done += 1
+
+
+########################################################################
+# ----------------------- Client ---------------------------------------
+
+def submit(queue, job, wait=True, timeout=None, poll=0.1):
+    """Put `job` (dict) into the queue and optionally wait for its result.
+
+    Relative paths of `data` and `directory` are made absolute, so the
+    worker may run in another working directory.
+
+    Returns
+    -------
+    str or dict
+        the job id (wait=False) or the result description
+    """
+    make_queue(queue)
+    job = dict(job)
+    for key in ('data', 'directory'):
+        if job.get(key):
+            job[key] = os.path.abspath(job[key])
+
+    job_id = '{}-{}'.format(pd.Timestamp.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+    _write_json(os.path.join(queue, 'incoming', job_id + '.json'), job)
+    if not wait:
+        return job_id
+
+    start = time.monotonic()
+    while timeout is None or time.monotonic() - start < timeout:
+        for folder in ('done', 'failed'):
+            filename = os.path.join(queue, folder, job_id + '.json')
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    return json.load(f)
+        time.sleep(poll)
+
+    raise TimeoutError('Job {} not finished after {} s.'.format(job_id, timeout))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='run the worker')
+    serve_parser.add_argument('queue')
+    serve_parser.add_argument('--poll', type=float, default=0.2)
+    submit_parser = subparsers.add_parser('submit', help='submit a job file and wait for the result')
+    submit_parser.add_argument('queue')
+    submit_parser.add_argument('job')
+    submit_parser.add_argument('--timeout', type=float, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        worker = Worker(args.queue, poll=args.poll)
+        signal.signal(signal.SIGINT, worker.stop)
+        signal.signal(signal.SIGTERM, worker.stop)
+        worker.serve()
+    elif args.command == 'submit':
+        with open(args.job) as f:
+            print(json.dumps(submit(args.queue, json.load(f), timeout=args.timeout), indent=2))
+    else:
+        parser.print_help()
@@ -15,16 +15,113 @@ DIETER at DIW, Berlin, as well as in the (python (Pyomo)-based) energy system
 model urbs at TU Munich.
 """
 
+import math
+import warnings
+
+import numpy as np
+import pandas as pd
+
 from oemof import solph
 
 from pyomo.core.base.block import SimpleBlock
-from pyomo.environ import (Set, NonNegativeReals,Reals, Var, Constraint, BuildAction)
+from pyomo.environ import (Set, NonNegativeReals,Reals, Var, Constraint, BuildAction, value)
 from oemof.solph import sequence as solph_sequence
+from oemof.solph.plumbing import _Sequence
 
 
 ########################################################################
 # ----------------------- DSM Component --------------------------------
 
+def sequence_array(values, n_steps):
+    """Scalar or (solph) sequence as contiguous float64 array of length `n_steps`"""
+    if isinstance(values, _Sequence):
+        values = values.default
+    if np.ndim(values) == 0:
+        return np.full(n_steps, values, dtype=np.float64)
+
+    array = np.ascontiguousarray(np.asarray(values, dtype=np.float64)[:n_steps])
+    if len(array) < n_steps:
+        raise ValueError('Sequence has {} values, {} timesteps are needed.'.format(len(array), n_steps))
+    return array
+
+
+def _band_pairs(keep_up, keep_do, delay_time):
+    """Pairs (t, tt) with |t - tt| <= delay_time, keep_up[t] and keep_do[tt], sorted by t and tt"""
+    n_steps = len(keep_up)
+    t, tt = [], []
+    for d in range(-delay_time, delay_time + 1):
+        t_d = np.arange(max(0, -d), min(n_steps, n_steps - d))
+        t_d = t_d[keep_up[t_d] & keep_do[t_d + d]]
+        t.append(t_d)
+        tt.append(t_d + d)
+
+    t = np.concatenate(t)
+    tt = np.concatenate(tt)
+    order = np.lexsort((tt, t))
+    return t[order], tt[order]
+
+
+def _group(keys, values, n_steps):
+    """Split `values` sorted by `keys` into one list per key 0 ... n_steps - 1"""
+    counts = np.bincount(keys, minlength=n_steps)
+    return [v.tolist() for v in np.split(values, np.cumsum(counts)[:-1])]
+
+
+def timestep_length(timeindex):
+    """Length of one timestep of `timeindex` as pandas.Timedelta"""
+    if timeindex is None or len(timeindex) < 2:
+        raise ValueError('A timeindex with at least two timesteps is needed to convert time spans.')
+    if timeindex.freq is not None:
+        return pd.Timedelta(timeindex.freq)
+    return timeindex[1] - timeindex[0]
+
+
+def timespan_to_steps(duration, timeindex):
+    """Convert a duration into a number of timesteps of `timeindex`.
+
+    Numbers are taken as number of timesteps already (floats must be whole,
+    pandas.Timedelta would read them as nanoseconds). Time spans (anything
+    pandas.Timedelta understands, e.g. '3H' or datetime.timedelta) which are
+    no multiple of the timestep length are rounded up with a warning.
+    """
+    if duration is None or isinstance(duration, (int, np.integer)):
+        return duration
+    if isinstance(duration, (float, np.floating)):
+        if not float(duration).is_integer():
+            raise ValueError('Duration {} is no whole number of timesteps, give a time span like "90min" '
+                             'instead.'.format(duration))
+        return int(duration)
+
+    steps = pd.Timedelta(duration) / timestep_length(timeindex)
+    if not np.isclose(steps, round(steps)):
+        warnings.warn('Time span {} is no multiple of the timestep length {} and is rounded up to {} '
+                      'timesteps.'.format(duration, timestep_length(timeindex), math.ceil(steps)))
+        return int(math.ceil(steps))
+    return int(round(steps))
+
+
+def presolve_report(model):
+    """Number of variables and rows removed by the DSM presolve per component.
+
+    Parameters
+    ----------
+    model: solph.Model
+        built model with DSM components
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per DSM component, one column per variable and constraint
+    """
+    report = {}
+    for block_type in (SinkDsmDelayBlock, SinkDsmPotentialBlock):
+        block = model.component(block_type.__name__)
+        if block is not None:
+            report.update(block.presolve_report)
+
+    return pd.DataFrame.from_dict(report, orient='index').fillna(0).astype(int)
+
+
 class SinkDsm(solph.Sink):
     r""" A special sink component which modifies the input demand series.
 
@@ -46,10 +143,28 @@ class SinkDsm(solph.Sink):
                 The load-shift of the component must be compensated for in a predefined delay-time (3h by default).
                 DSM capacity can either be a fixed value or an hourly time series.
 
-    **shift_interval: int (only in method='potential')
+    **delay_time: int or time span (only in method='delay')
+        time in which a load shift must be compensated for
+        default=3 (timesteps)
+    **shift_interval: int or time span (only in method='potential')
         interval in between which total DSM  must be fully compensated for
-        default=24h
-    **
+        default=24 (timesteps)
+    **recovery_time: int or time span
+        minimum time in between two load shifts (not used in the constraints yet)
+        default=None
+
+    Durations given as numbers are numbers of timesteps. Time spans (e.g. '3H',
+    pandas.Timedelta) are converted with the timestep length of the energy
+    system's timeindex when the model is built (see :func:`timespan_to_steps`),
+    so 15-minute data keeps the same delay in hours.
+    **lazy_c2: bool (only in method='delay')
+        do not build the C2 rows (Eq. 10) upfront, they are added when violated
+        (see :func:`dsm_solve.solve_lazy_c2`)
+        default=False
+    **presolve: bool
+        skip DSM variables which are forced to zero by a capacity of zero and
+        all rows becoming trivially satisfied (see :func:`presolve_report`)
+        default=True
 
     Note: This component is still under development.
 
@@ -69,6 +184,32 @@ class SinkDsm(solph.Sink):
         self.method = kwargs.get('method', 'delay')
         self.shift_interval = kwargs.get('shift_interval', 24)
         self.delay_time = kwargs.get('delay_time', 3)
+        self.recovery_time = kwargs.get('recovery_time', None)
+        self.presolve = kwargs.get('presolve', True)
+        self.lazy_c2 = kwargs.get('lazy_c2', False)
+
+        # durations as given by the user, converted to timesteps in set_timeindex()
+        self._durations = {name: getattr(self, name) for name in ('delay_time', 'shift_interval', 'recovery_time')}
+
+    def parameters(self):
+        """DSM parameters of the component, durations as given by the user"""
+        return dict(self._durations, method=self.method, presolve=self.presolve, lazy_c2=self.lazy_c2)
+
+    def set_timeindex(self, timeindex):
+        """Convert durations given as time spans into timesteps of `timeindex`"""
+        for name, duration in self._durations.items():
+            setattr(self, name, timespan_to_steps(duration, timeindex))
+
+    def set_arrays(self, n_steps):
+        """Convert demand and capacities into float64 arrays of length `n_steps`.
+
+        The block rules index these arrays instead of the (pandas based)
+        sequences. c_max_array is the elementwise maximum of c_up and c_do (Eq. 10).
+        """
+        self.demand_array = sequence_array(self.demand, n_steps)
+        self.c_up_array = sequence_array(self.c_up, n_steps)
+        self.c_do_array = sequence_array(self.c_do, n_steps)
+        self.c_max_array = np.maximum(self.c_up_array, self.c_do_array)
 
     def constraint_group(self):
         possible_methods = ['delay', 'potential']
@@ -77,9 +218,9 @@ class SinkDsm(solph.Sink):
                              '"{}"'.format('","'.join(possible_methods)))
 
         if self.method == possible_methods[0]:
-            return SinkDsmPotentialBlock
-        else:
             return SinkDsmDelayBlock
+        else:
+            return SinkDsmPotentialBlock
 
 
 #######################################################################################
@@ -110,26 +251,59 @@ class SinkDsmPotentialBlock(SimpleBlock):
 
         m = self.parent_block()
 
-        # for all DSM components get inflow from bus_elec
+        # for all DSM components get inflow from bus_elec, durations in timesteps and input arrays
         for n in group:
             n.inflow = list(n.inputs)[0]
+            n.set_timeindex(m.es.timeindex)
+            n.set_arrays(len(m.TIMESTEPS))
+
+        #  ************* PRESOLVE *****************************
+
+        # With presolve=True DSMupdown is skipped if c_up and c_do are zero (bounds (0, 0)).
+        # The interval balance is added once per shift interval (instead of once per timestep)
+        # and dropped if no DSMupdown of the interval is left.
+
+        # first timestep of each shift interval -> timesteps of the interval with DSMupdown
+        self.intervals = {}
+        self.presolve_report = {}
+        updown_index = []
+
+        n_steps = len(m.TIMESTEPS)
+
+        for g in group:
+            timesteps = np.arange(n_steps)
+            if g.presolve:
+                timesteps = np.flatnonzero((g.c_up_array > 0) | (g.c_do_array > 0))
+            starts = (timesteps // g.shift_interval) * g.shift_interval
+
+            intervals = {}
+            if not g.presolve:
+                intervals = {start: [] for start in range(0, n_steps, g.shift_interval)}
+            for start, t in zip(starts.tolist(), timesteps.tolist()):
+                intervals.setdefault(start, []).append(t)
+            self.intervals[g] = intervals
+            updown_index += [(g, t) for t in timesteps.tolist()]
+
+            self.presolve_report[g.label] = {
+                'DSMupdown': n_steps - sum(len(tt) for tt in intervals.values()),
+                'dsm_sum_constraint': n_steps - len(intervals) if g.presolve else 0}
 
         #  ************* SETS *********************************
 
         # Set of DSM Components
         self.DSM = Set(initialize=[n for n in group])
 
+        # Index set of the DSM variable
+        self.DSMUPDOWN_INDEX = Set(dimen=2, initialize=updown_index, ordered=True)
+
         #  ************* VARIABLES *****************************
 
-        def dsm_capacity_bound_rule(block):
+        def dsm_capacity_bound_rule(block, g, t):
             """Rule definition for bounds(capacity) of DSM - Variable g in timestep t"""
-            for t in m.TIMESTEPS:
-                for g in group:
-                    bounds = (-g.c_do[t], g.c_up[t])
-                    return bounds
+            return -g.c_do_array[t], g.c_up_array[t]
 
         # Variable load shift down (MWh)
-        self.DSMupdown = Var(self.DSM, m.TIMESTEPS, initialize=0, within=Reals, bounds=dsm_capacity_bound_rule)
+        self.DSMupdown = Var(self.DSMUPDOWN_INDEX, initialize=0, within=Reals, bounds=dsm_capacity_bound_rule)
 
         #  ************* CONSTRAINTS *****************************
 
@@ -145,7 +319,9 @@ class SinkDsmPotentialBlock(SimpleBlock):
                     lhs = m.flow[g.inflow, g, t]
 
                     # Demand +- DSM
-                    rhs = g.demand[t] + self.DSMupdown[g, t]
+                    rhs = g.demand_array[t]
+                    if (g, t) in self.DSMupdown:
+                        rhs += self.DSMupdown[g, t]
 
                     # add constraint
                     block.input_output_relation.add((g, t), (lhs == rhs))
@@ -157,28 +333,17 @@ class SinkDsmPotentialBlock(SimpleBlock):
         def dsm_sum_constraint_rule(block):
             """
             Relation to compensate the total amount of positive and negative DSM in between the shift_interval.
-            2 Cases: A full interval is optimised or an incomplete one.
+            2 Cases: A full interval is optimised or an incomplete one (cut at the last timestep).
+            Without presolve the balance of an interval is added for each of its timesteps.
             """
             for t in m.TIMESTEPS:
                 for g in group:
 
-                    shft_intvl = g.shift_interval
-
-                    # full interval
-                    if (t // shft_intvl) < (m.TIMESTEPS._bounds[1] // shft_intvl):
-                        # DSM up/down
-                        lhs = sum(self.DSMupdown[g, tt] for tt in range((t // shft_intvl) * shft_intvl,
-                                                                        (t // shft_intvl + 1) * shft_intvl, 1))
-                        # value
-                        rhs = 0
-                        # add constraint
-                        block.dsm_sum_constraint.add((g, t), (lhs == rhs))
+                    start = (t // g.shift_interval) * g.shift_interval
 
-                    # incomplete interval
-                    else:
+                    if start in self.intervals[g] and (t == start or not g.presolve):
                         # DSM up/down
-                        lhs = sum(self.DSMupdown[g, tt] for tt in range((t // shft_intvl) * shft_intvl,
-                                                                        m.TIMESTEPS._bounds[1] + 1, 1))
+                        lhs = sum(self.DSMupdown[g, tt] for tt in self.intervals[g][start])
                         # value
                         rhs = 0
                         # add constraint
@@ -237,28 +402,84 @@ class SinkDsmDelayBlock(SimpleBlock):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def _dsm_up(self, g, t):
+        """DSMup[g, t] or 0 if the variable was removed by the presolve"""
+        if (g, t) in self.DSMup:
+            return self.DSMup[g, t]
+        return 0
+
+    def _dsm_do(self, g, tt):
+        """Sum of all downward shifts in timestep tt"""
+        return sum(self.DSMdo[g, t, tt] for t in self.do_in[g][tt])
+
     def _create(self, group=None):
         if group is None:
             return None
 
         m = self.parent_block()
 
-        # for all DSM components get inflow from bus_elec
+        # for all DSM components get inflow from bus_elec, durations in timesteps and input arrays
         for n in group:
             n.inflow = list(n.inputs)[0]
+            n.set_timeindex(m.es.timeindex)
+            n.set_arrays(len(m.TIMESTEPS))
+
+        #  ************* PRESOLVE *****************************
+
+        # Load shifts are only possible within the delay time, i.e. in a band around t = tt.
+        # With presolve=True variables forced to zero by a capacity of zero are skipped, too:
+        # DSMdo[g, t, tt] needs c_up[t] > 0 (Eq. 7, 8) and c_do[tt] > 0 (Eq. 9), DSMup[g, t]
+        # needs at least one DSMdo[g, t, tt]. Rows without variables are trivially satisfied,
+        # C2 (Eq. 10) is redundant to Eq. 8 or 9 if DSMup or all DSMdo of a timestep are missing.
+        n_steps = len(m.TIMESTEPS)
+
+        # timesteps tt compensating a shift up in t / timesteps t compensated in tt
+        self.do_out = {}
+        self.do_in = {}
+        self.presolve_report = {}
+        up_index = []
+        do_index = []
+
+        for g in group:
+            if g.presolve:
+                t, tt = _band_pairs(g.c_up_array > 0, g.c_do_array > 0, g.delay_time)
+            else:
+                t, tt = _band_pairs(np.ones(n_steps, dtype=bool), np.ones(n_steps, dtype=bool), g.delay_time)
+
+            self.do_out[g] = _group(t, tt, n_steps)
+            order = np.lexsort((t, tt))
+            self.do_in[g] = _group(tt[order], t[order], n_steps)
+
+            do_index += [(g, t_do, tt_do) for t_do, tt_do in zip(t.tolist(), tt.tolist())]
+            has_up = np.bincount(t, minlength=n_steps) > 0
+            up_index += [(g, t_up) for t_up in np.flatnonzero(has_up).tolist()]
+
+            band = sum(max(0, n_steps - abs(d)) for d in range(-g.delay_time, g.delay_time + 1))
+            n_do = int((np.bincount(tt, minlength=n_steps) > 0).sum())
+            self.presolve_report[g.label] = {
+                'DSMup': n_steps - int(has_up.sum()),
+                'DSMdo': band - len(t),
+                'dsmupdo_constraint': n_steps - int(has_up.sum()),
+                'dsmup_constraint': n_steps - int(has_up.sum()),
+                'dsmdo_constraint': n_steps - n_do,
+                'C2_constraint': sum(1 for t_c2 in m.TIMESTEPS if not self._has_c2(g, t_c2))}
 
         #  ************* SETS *********************************
 
         # Set of DSM Components
         self.DSM = Set(initialize=[g for g in group])
 
+        # Index sets of the DSM variables
+        self.DSMUP_INDEX = Set(dimen=2, initialize=up_index, ordered=True)
+        self.DSMDO_INDEX = Set(dimen=3, initialize=do_index, ordered=True)
+
         #  ************* VARIABLES *****************************
 
         # Variable load shift down (MWh)
-        self.DSMdo = Var(self.DSM, m.TIMESTEPS, m.TIMESTEPS, initialize=0, within=NonNegativeReals)
+        self.DSMdo = Var(self.DSMDO_INDEX, initialize=0, within=NonNegativeReals)
 
         # Variable load shift up(MWh)
-        self.DSMup = Var(self.DSM, m.TIMESTEPS, initialize=0, within=NonNegativeReals)
+        self.DSMup = Var(self.DSMUP_INDEX, initialize=0, within=NonNegativeReals)
 
         #  ************* CONSTRAINTS *****************************
 
@@ -271,37 +492,12 @@ class SinkDsmDelayBlock(SimpleBlock):
             for t in m.TIMESTEPS:
                 for g in group:
 
-                    # first time steps: 0 + delay time
-                    if t <= g.delay_time:
-
-                        # Generator loads from bus
-                        lhs = m.flow[g.inflow, g, t]
-                        # Demand +- DSM
-                        rhs = g.demand[t] + self.DSMup[g, t] - sum(
-                            self.DSMdo[g, tt, t] for tt in range(t + g.delay_time + 1))
-                        # add constraint
-                        block.input_output_relation.add((g, t), (lhs == rhs))
-
-                    # main use case
-                    elif g.delay_time < t <= m.TIMESTEPS._bounds[1] - g.delay_time:
-
-                        # Generator loads from bus
-                        lhs = m.flow[g.inflow, g, t]
-                        # Demand +- DSM
-                        rhs = g.demand[t] + self.DSMup[g, t] - sum(
-                            self.DSMdo[g, tt, t] for tt in range(t - g.delay_time, t + g.delay_time + 1))
-                        # add constraint
-                        block.input_output_relation.add((g, t), (lhs == rhs))
-
-                    # last time steps: end - delay time
-                    else:
-                        # Generator loads from bus
-                        lhs = m.flow[g.inflow, g, t]
-                        # Demand +- DSM
-                        rhs = g.demand[t] + self.DSMup[g, t] - sum(
-                            self.DSMdo[g, tt, t] for tt in range(t - g.delay_time, m.TIMESTEPS._bounds[1] + 1))
-                        # add constraint
-                        block.input_output_relation.add((g, t), (lhs == rhs))
+                    # Generator loads from bus
+                    lhs = m.flow[g.inflow, g, t]
+                    # Demand +- DSM
+                    rhs = g.demand_array[t] + self._dsm_up(g, t) - self._dsm_do(g, t)
+                    # add constraint
+                    block.input_output_relation.add((g, t), (lhs == rhs))
 
         self.input_output_relation = Constraint(group, m.TIMESTEPS, noruleinit=True)
         self.input_output_relation_build = BuildAction(rule=_input_output_relation_rule)
@@ -317,33 +513,12 @@ class SinkDsmDelayBlock(SimpleBlock):
             for t in m.TIMESTEPS:
                 for g in group:
 
-                    # first time steps: 0 + delay time
-                    if t <= g.delay_time:
-
-                        # DSM up
-                        lhs = self.DSMup[g, t]
-                        # DSM down
-                        rhs = sum(self.DSMdo[g, t, tt] for tt in range(t + g.delay_time + 1))
-                        # add constraint
-                        block.dsmupdo_constraint.add((g, t), (lhs == rhs))
-
-                    # main use case
-                    elif g.delay_time < t <= m.TIMESTEPS._bounds[1] - g.delay_time:
-
-                        # DSM up
-                        lhs = self.DSMup[g, t]
-                        # DSM down
-                        rhs = sum(self.DSMdo[g, t, tt] for tt in range(t - g.delay_time, t + g.delay_time + 1))
-                        # add constraint
-                        block.dsmupdo_constraint.add((g, t), (lhs == rhs))
-
-                    # last time steps: end - delay time
-                    else:
+                    if self.do_out[g][t]:
 
                         # DSM up
                         lhs = self.DSMup[g, t]
                         # DSM down
-                        rhs = sum(self.DSMdo[g, t, tt] for tt in range(t - g.delay_time, m.TIMESTEPS._bounds[1] + 1))
+                        rhs = sum(self.DSMdo[g, t, tt] for tt in self.do_out[g][t])
                         # add constraint
                         block.dsmupdo_constraint.add((g, t), (lhs == rhs))
 
@@ -359,12 +534,15 @@ class SinkDsmDelayBlock(SimpleBlock):
 
             for t in m.TIMESTEPS:
                 for g in group:
-                    # DSM up
-                    lhs = self.DSMup[g, t]
-                    # Capacity DSMup
-                    rhs = g.c_up[t]
-                    # add constraint
-                    block.dsmup_constraint.add((g, t), (lhs <= rhs))
+
+                    if (g, t) in self.DSMup:
+
+                        # DSM up
+                        lhs = self.DSMup[g, t]
+                        # Capacity DSMup
+                        rhs = g.c_up_array[t]
+                        # add constraint
+                        block.dsmup_constraint.add((g, t), (lhs <= rhs))
 
         self.dsmup_constraint = Constraint(group, m.TIMESTEPS, noruleinit=True)
         self.dsmup_constraint_build = BuildAction(rule=dsmup_constraint_rule)
@@ -379,33 +557,12 @@ class SinkDsmDelayBlock(SimpleBlock):
             for tt in m.TIMESTEPS:
                 for g in group:
 
-                    # first times steps: 0 + delay time
-                    if tt <= g.delay_time:
+                    if self.do_in[g][tt]:
 
                         # DSM down
-                        lhs = sum(self.DSMdo[g, t, tt] for t in range(tt + g.delay_time + 1))
+                        lhs = self._dsm_do(g, tt)
                         # Capacity DSM down
-                        rhs = g.c_do[tt]
-                        # add constraint
-                        block.dsmdo_constraint.add((g, tt), (lhs <= rhs))
-
-                    # main use case
-                    elif g.delay_time < tt <= m.TIMESTEPS._bounds[1] - g.delay_time:
-
-                        # DSM down
-                        lhs = sum(self.DSMdo[g, t, tt] for t in range(tt - g.delay_time, tt + g.delay_time + 1))
-                        # Capacity DSM down
-                        rhs = g.c_do[tt]
-                        # add constraint
-                        block.dsmdo_constraint.add((g, tt), (lhs <= rhs))
-
-                    # last time steps: end - delay time
-                    else:
-
-                        # DSM down
-                        lhs = sum(self.DSMdo[g, t, tt] for t in range(tt - g.delay_time, m.TIMESTEPS._bounds[1] + 1))
-                        # Capacity DSM down
-                        rhs = g.c_do[tt]
+                        rhs = g.c_do_array[tt]
                         # add constraint
                         block.dsmdo_constraint.add((g, tt), (lhs <= rhs))
 
@@ -423,37 +580,56 @@ class SinkDsmDelayBlock(SimpleBlock):
             for tt in m.TIMESTEPS:
                 for g in group:
 
-                    # first times steps: 0 + delay time
-                    if tt <= g.delay_time:
+                    # with lazy_c2 the rows are added by add_violated_c2() after a solve
+                    if self._has_c2(g, tt) and not g.lazy_c2:
 
                         # DSM up/down
-                        lhs = self.DSMup[g, tt] + sum(self.DSMdo[g, t, tt] for t in range(tt + g.delay_time + 1))
+                        lhs = self._dsm_up(g, tt) + self._dsm_do(g, tt)
                         # max capacity at tt
-                        rhs = max(g.c_up[tt], g.c_do[tt])
+                        rhs = g.c_max_array[tt]
                         # add constraint
                         block.C2_constraint.add((g, tt), (lhs <= rhs))
 
-                    elif g.delay_time < tt <= m.TIMESTEPS._bounds[1] - g.delay_time:
+        self.C2_constraint = Constraint(group, m.TIMESTEPS, noruleinit=True)
+        self.C2_constraint_build = BuildAction(rule=C2_constraint_rule)
 
-                        # DSM up/down
-                        lhs = self.DSMup[g, tt] + sum(
-                            self.DSMdo[g, t, tt] for t in range(tt - g.delay_time, tt + g.delay_time + 1))
-                        # max capacity at tt
-                        rhs = max(g.c_up[tt], g.c_do[tt])
-                        # add constraint
-                        block.C2_constraint.add((g, tt), (lhs <= rhs))
+    def _has_c2(self, g, tt):
+        """C2 is only needed if shifts up and down are both possible in tt"""
+        return not g.presolve or bool(self.do_out[g][tt] and self.do_in[g][tt])
 
-                    else:
+    def add_violated_c2(self, tol=1e-6):
+        """Add the C2 rows (Eq. 10) violated by the current solution.
 
-                        # DSM up/down
-                        lhs = self.DSMup[g, tt] + sum(
-                            self.DSMdo[g, t, tt] for t in range(tt - g.delay_time, m.TIMESTEPS._bounds[1] + 1))
-                        # max capacity at tt
-                        rhs = max(g.c_up[tt], g.c_do[tt])
-                        # add constraint
-                        block.C2_constraint.add((g, tt), (lhs <= rhs))
+        Only components with lazy_c2=True are checked, rows which already
+        exist are skipped.
 
-        self.C2_constraint = Constraint(group, m.TIMESTEPS, noruleinit=True)
-        self.C2_constraint_build = BuildAction(rule=C2_constraint_rule)
+        Parameters
+        ----------
+        tol: float
+            rows violated by less than `tol` are not added
+
+        Returns
+        -------
+        list
+            the added constraint data objects (e.g. for a persistent solver)
+        """
+        m = self.parent_block()
+        added = []
+
+        for g in self.DSM:
+            if not g.lazy_c2:
+                continue
+
+            for tt in m.TIMESTEPS:
+                if (g, tt) in self.C2_constraint or not self._has_c2(g, tt):
+                    continue
+
+                # DSM up/down
+                lhs = self._dsm_up(g, tt) + self._dsm_do(g, tt)
+                # max capacity at tt
+                rhs = g.c_max_array[tt]
 
+                if value(lhs) > rhs + tol:
+                    added.append(self.C2_constraint.add((g, tt), (lhs <= rhs)))
 
+        return added
@@ -1,13 +1,20 @@
 from oemof import solph, outputlib
 from oemof.network import Node
 import pandas as pd
+import importlib.util
 import os
+import warnings
 
 ### DSM Component
 #import oemof_DSM_component_JK as oemof_dsm
 #import oemof_DSM_component as oemof_dsm
 #import oemof_DSM_component_iow as oemof_dsm
 import oemof_DSM as oemof_dsm
+import dsm_solverlog
+import dsm_results
+import dsm_audit
+import dsm_size
+import dsm_store
 
 # plotting
 import plot_dsm as pltdsm
@@ -17,7 +24,12 @@ import plot_dsm as pltdsm
 # MODEL
 
 
-def create_model(data, datetimeindex):
+def create_energysystem(data, datetimeindex, **dsm_kwargs):
+    """Create the test energy system with one DSM sink.
+
+    Keyword arguments are passed to :class:`SinkDsm` and override the
+    default DSM parameters (e.g. `method='potential'`).
+    """
 
     # Create Energy System
     es = solph.EnergySystem(timeindex=datetimeindex)
@@ -77,15 +89,14 @@ def create_model(data, datetimeindex):
                               )
 
     # Create DSM
+    dsm_params = dict(delay_time='2H', recovery_time='10H', shift_interval='6H', method='delay')
+    dsm_params.update(dsm_kwargs)
     demand_dsm = oemof_dsm.SinkDsm(label='demand_dsm',
                                    inputs={b_elec: solph.Flow(variable_costs=1)},
                                    c_up=data['Cap_up'][datetimeindex],
                                    c_do=data['Cap_do'][datetimeindex],
-                                   delay_time=2,
                                    demand=data['demand_el'][datetimeindex],
-                                   recovery_time=10,
-                                   shift_interval=6,
-                                   method='delay'
+                                   **dsm_params
                                    )
 
     # Backup excess / shortage
@@ -99,104 +110,160 @@ def create_model(data, datetimeindex):
                                          variable_costs=200)}
                                  )
 
+    return es
+
+
+def build_model(data, datetimeindex, budget=dsm_size.DEFAULT_BUDGET, **dsm_kwargs):
+    """Create the energy system and build the (unsolved) model.
+
+    A model whose estimated memory exceeds `budget` (bytes, e.g. '8GB' or
+    'auto', see dsm_size; None: no check) is not built, ModelTooLarge is
+    raised instead.
+    """
+
+    es = create_energysystem(data, datetimeindex, **dsm_kwargs)
+
+    return dsm_size.BudgetModel(es, budget=budget)
+
+
+def read_data(filename, freq='H', start='1/1/2013'):
+    """Read the input data and replace its timestamps by a regular index with frequency `freq`."""
+
+    data = pd.read_csv(filename, sep=",", encoding='utf-8', parse_dates=True, date_parser=pd.to_datetime)
+    data.sort_index(inplace=True)
+
+    # replace timestamp
+    data['timestamp'] = pd.date_range(start=start, periods=len(data.index), freq=freq)
+    data.set_index('timestamp', inplace=True)
+
+    return data
+
+
+def create_model(data, datetimeindex, directory='./', store=None, scenario='dsm_test', progress=None,
+                 progress_file=None, **dsm_kwargs):
 
     ######################################################################
     # -------------------------- Create Model ----------------------
 
     # Create Model
-    m = solph.Model(es)
+    m = build_model(data, datetimeindex, **dsm_kwargs)
 
-    # Solve Model
-    m.solve(solver='cbc', solve_kwargs={'tee': False})
+    # Solve Model (solver log parsed into progress events, see dsm_solverlog)
+    events = dsm_solverlog.solve_with_progress(m, solver='cbc', callback=progress, jsonl=progress_file)
 
     # Write LP File
-    filename = os.path.join(os.path.dirname(__file__), directory, 'abw_dsm_test.lp')
-    m.write(filename, io_options={'symbolic_solver_labels': True})
+    lp_file = os.path.join(os.path.dirname(__file__), directory, 'abw_dsm_test.lp')
+    m.write(lp_file, io_options={'symbolic_solver_labels': True})
 
-    # Save Results
-    es.results['main'] = outputlib.processing.results(m)
-    es.results['meta'] = outputlib.processing.meta_results(m)
-    es.dump(dpath=None, filename=None)
+    # Save Results (with the DSM parameters the model was built with, see dsm_store.model_params)
+    return save_results(m, directory, store, scenario, events)
 
-    return m
 
-# ################################################################
-# ----------------- Input Data & Timesteps ----------------------------
+def save_results(m, directory='./', store=None, scenario='dsm_test', events=None, params=None):
+    """Process, audit and store the results of the solved model `m`.
 
-# Provide Data
-#project = '24h_konzept'
-project = 'recovery-time'
+    The store records the effective DSM parameters of `m`, `params` adds
+    further ones (e.g. the aggregation of the input data). `store=False`
+    skips the results store; without pyarrow it is skipped with a warning.
+    """
 
-pltdsm.make_directory(project, subfolder_name='Grafiken')
-#pltdsm.make_directory(project + '/Grafiken')
-directory = './' + project + '/'
+    m.es.results['main'] = outputlib.processing.results(m)
+    m.es.results['meta'] = outputlib.processing.meta_results(m)
+    m.es.results['meta']['solver_progress'] = events or []
+    m.es.results['dsm_shifts'] = dsm_results.shift_matrices(m)
+
+    # Check the solution (bus balance, delay compensation, capacities, interval balance)
+    m.es.results['audit'] = dsm_audit.audit(m)
+    if not m.es.results['audit'].empty:
+        warnings.warn('Solution violates {} rows:\n{}'.format(len(m.es.results['audit']),
+                                                            dsm_audit.summary(m.es.results['audit'])))
+
+    if store is False:
+        return m
+    if store is None:
+        store = os.path.join(os.path.dirname(__file__), directory, 'results')
+    if importlib.util.find_spec('pyarrow') is None:
+        warnings.warn('Results of "{}" were not stored, the results store needs pyarrow.'.format(scenario))
+        return m
+    dsm_store.ResultStore(store).save(m, scenario, params=params)
+
+    return m
 
-#file = directory + 'oemof_dsm_test_recovery.csv'
-#file = directory + 'abw_test_timestamp.csv'
-#file = directory + '24_konzept_generisch.csv'
-file = directory + 'recovery.csv'
-filename_data = os.path.join(os.path.dirname(__file__), file)
 
-# read data
-data = pd.read_csv(filename_data, sep=",", encoding='utf-8', parse_dates=True, date_parser=pd.to_datetime)
-data.sort_index(inplace=True)
+if __name__ == '__main__':
 
-# replace timestamp
-data['timestamp'] = pd.date_range(start='1/1/2013', periods=len(data.index), freq='H')
-data.set_index('timestamp', inplace=True)
+    # ################################################################
+    # ----------------- Input Data & Timesteps ----------------------------
 
-# Data manipulation
-data = data
+    # Provide Data
+    #project = '24h_konzept'
+    project = 'recovery-time'
 
-# Timesteps
-timesteps = 58
+    pltdsm.make_directory(project, subfolder_name='Grafiken')
+    #pltdsm.make_directory(project + '/Grafiken')
+    directory = './' + project + '/'
 
+    #file = directory + 'oemof_dsm_test_recovery.csv'
+    #file = directory + 'abw_test_timestamp.csv'
+    #file = directory + '24_konzept_generisch.csv'
+    file = directory + 'recovery.csv'
+    filename_data = os.path.join(os.path.dirname(__file__), file)
 
-# Adjust Timesteps
+    # Resolution of the input data (DSM durations are given as time spans)
+    freq = 'H'
 
-datetimeindex = pd.date_range(start='1/1/2013', periods=timesteps, freq='H')
+    # read data
+    data = read_data(filename_data, freq=freq)
 
+    # Data manipulation
+    data = data
 
-# Create & Solve Model
-model = create_model(data, datetimeindex)
+    # Timesteps
+    timesteps = 58
 
 
-# Get Results
-es = solph.EnergySystem()
-es.restore(dpath=None, filename=None)
+    # Adjust Timesteps
 
+    datetimeindex = pd.date_range(start='1/1/2013', periods=timesteps, freq=freq)
 
 
-df_gesamt = pltdsm.extract_results(model, data, datetimeindex, directory)
-# Plot
-pltdsm.plot(df_gesamt, datetimeindex, directory, timesteps, project)
+    # Create & Solve Model
+    model = create_model(data, datetimeindex, directory, scenario=project)
 
 
-# Show Output Data
+    df_gesamt = pltdsm.extract_results(model, data, datetimeindex, directory)
+    # Plot
+    pltdsm.plot(df_gesamt, datetimeindex, directory, timesteps, project)
 
-#print('-----------------------------------------------------')
-#print(df_total[ (('pp_coal_2', 'bus_elec'), 'flow') ])
-#print('-----------------------------------------------------')
-#print(df_total[ (('bus_elec', 'demand_dsm'), 'flow') ])
-#print('-----------------------------------------------------')
-#print(df_total[ (('pv', 'bus_elec'), 'flow') ])
-#print('-----------------------------------------------------')
-#print(df_total[ (('wind', 'bus_elec'), 'flow') ])
-#print(model.es.groups[<class 'oemof_DSM_component.SinkDsmBlock'>].demand)
 
-print('-----------------------------------------------------')
-print('OBJ: ', model.objective())
-print('-----------------------------------------------------')
+    # Show Output Data
 
-print(df_gesamt[['dsm_up', 'dsm_do', 'dsm_tot', 'demand_dsm']])
-print('------------------TOTAL------------------------')
+    #print('-----------------------------------------------------')
+    #print(df_total[ (('pp_coal_2', 'bus_elec'), 'flow') ])
+    #print('-----------------------------------------------------')
+    #print(df_total[ (('bus_elec', 'demand_dsm'), 'flow') ])
+    #print('-----------------------------------------------------')
+    #print(df_total[ (('pv', 'bus_elec'), 'flow') ])
+    #print('-----------------------------------------------------')
+    #print(df_total[ (('wind', 'bus_elec'), 'flow') ])
+    #print(model.es.groups[<class 'oemof_DSM_component.SinkDsmBlock'>].demand)
 
-print('DSMup')
-print(df_gesamt['dsm_up'].sum())
+    print('-----------------------------------------------------')
+    print('Removed by DSM presolve:')
+    print(oemof_dsm.presolve_report(model))
+    print('-----------------------------------------------------')
+    print('Audit: {} violations'.format(len(model.es.results['audit'])))
+    print('-----------------------------------------------------')
+    print('OBJ: ', model.objective())
+    print('-----------------------------------------------------')
 
-print('DSMdown')
-print(df_gesamt['dsm_do'].sum())
+    print(df_gesamt[['dsm_up', 'dsm_do', 'dsm_tot', 'demand_dsm']])
+    print('------------------TOTAL------------------------')
 
-#import pdb;    pdb.set_trace()
+    print('DSMup')
+    print(df_gesamt['dsm_up'].sum())
 
+    print('DSMdown')
+    print(df_gesamt['dsm_do'].sum())
 
+    #import pdb;    pdb.set_trace()
@@ -3,14 +3,27 @@ from oemof import outputlib
 import pandas as pd
 import os
 
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import matplotlib.ticker as ticker
+import dsm_results
 
-from pandas.plotting import register_matplotlib_converters
 
-# register matplotlib converters which have been overwritten by pandas
-register_matplotlib_converters()
+#################################################################
+#                       Plotting Imports
+
+def _pyplot():
+    """
+    Import matplotlib only when plotting, so solve-only runs do not load it.
+
+    Returns pyplot and matplotlib.dates.
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
+    from pandas.plotting import register_matplotlib_converters
+
+    # register matplotlib converters which have been overwritten by pandas
+    register_matplotlib_converters()
+
+    return plt, mdates
 
 
 #################################################################
@@ -118,12 +131,18 @@ def extract_results(model, data, datetimeindex, directory):
         (('bus_elec', 'demand_dsm'), 'flow')]
     df_demand_dsm.rename('demand_dsm', inplace=True)
 
-    # DSM Variables
-    df_dsmdo = outputlib.views.node(model.es.results['main'], 'demand_dsm')['sequences'].iloc[:, 1:-1].sum(axis=1)
-    df_dsmdo.rename('dsm_do', inplace=True)
+    # DSM Variables from the sparse shift matrix (timesteps removed by the presolve are 0)
+    shifts = dsm_results.shift_matrices(model)
+    if 'demand_dsm' in shifts:
+        df_dsmdo = pd.Series(shifts['demand_dsm'].col_sums(), index=df_demand_dsm.index, name='dsm_do')
+        df_dsmup = pd.Series(shifts['demand_dsm'].row_sums(), index=df_demand_dsm.index, name='dsm_up')
+    else:
+        # no delay method: variables of the block (DSMupdown of the potential method)
+        df_dsmdo = outputlib.views.node(model.es.results['main'], 'demand_dsm')['sequences'].iloc[:, 1:-1].sum(axis=1)
+        df_dsmdo.rename('dsm_do', inplace=True)
 
-    df_dsmup = outputlib.views.node(model.es.results['main'], 'demand_dsm')['sequences'].iloc[:, -1]
-    df_dsmup.rename('dsm_up', inplace=True)
+        df_dsmup = outputlib.views.node(model.es.results['main'], 'demand_dsm')['sequences'].iloc[:, -1].fillna(0)
+        df_dsmup.rename('dsm_up', inplace=True)
 
     df_dsm_tot = df_dsmdo - df_dsmup
     df_dsm_tot.rename('dsm_tot', inplace=True)
@@ -154,8 +173,13 @@ def extract_results(model, data, datetimeindex, directory):
 
 def plot(df_gesamt, datetimeindex, directory, timesteps, project):
 
+    plt, mdates = _pyplot()
+
     # ############ DATA PREPARATION FOR FIGURE #############################
 
+    # length of one timestep, the data may be hourly or sub-hourly
+    step = df_gesamt.index[1] - df_gesamt.index[0]
+
     # ########################################### create Figure
     for info, slice in df_gesamt.resample('D'):
         # Generators from model
@@ -175,7 +199,7 @@ def plot(df_gesamt, datetimeindex, directory, timesteps, project):
         # x-Axis date format
         ax1.xaxis_date()
         ax1.xaxis.set_major_formatter(mdates.DateFormatter('%H h'))  # ('%d.%m-%H h'))
-        ax1.set_xlim(info - pd.Timedelta(1, 'h'), info + pd.Timedelta(25, 'h'))
+        ax1.set_xlim(info - step, info + pd.Timedelta(1, 'D') + step)
         plt.xticks(pd.date_range(start=info._date_repr, periods=24, freq='H'), rotation=45)
 
         # Demands